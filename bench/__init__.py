@@ -0,0 +1,31 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Contains benchmark code.
+
+Each module has a main() function that prints its results. They can be run
+one at a time with python -m bench.<module> or all at once with runbench.py."""
+import timeit
+
+def time_per_call(func, number=1000, repeat=3):
+  """Returns the best time per call of func in seconds."""
+  timer = timeit.Timer(func)
+  return min(timer.repeat(repeat, number)) / number
+
+def report(name, seconds):
+  """Prints a single benchmark result line."""
+  print "{0:<50s} {1:>12.2f} us".format(name, seconds * 1e6)
@@ -0,0 +1,43 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the strict (offset based) decoder against bdecode."""
+from lib.util.bencode import bencode, bdecode, bdecode_strict
+
+from . import time_per_call, report
+
+def make_response(num_nodes, num_values):
+  """Returns a bencoded get_peers style response of the given size."""
+  r = {"id": "\x11" * 20, "token": "\x22" * 8}
+  if num_nodes:
+    r["nodes"] = "\x33" * (26 * num_nodes)
+  if num_values:
+    r["values"] = ["\x44" * 6 for x in range(num_values)]
+  return bencode({"y": "r", "t": "aa", "r": r, "v": "DP\x00\x01"})
+
+def main():
+  for nodes, values in ((8, 0), (8, 50), (8, 200), (8, 1000), (8, 5000)):
+    packet = make_response(nodes, values)
+    number = max(10, 20000 / (values + 10))
+    name = "{0:d} nodes, {1:d} values ({2:d} bytes)".format(nodes, values,
+                                                             len(packet))
+    report("bdecode " + name, time_per_call(lambda: bdecode(packet), number))
+    report("bdecode_strict " + name,
+           time_per_call(lambda: bdecode_strict(packet), number))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,84 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Cost of adding random ids to a routing table with a fixed own id.
+
+The nodes are added through RoutingTable.add_node, which resolves the bucket
+in the bucket tree, splits it if it holds our own id and is full, and queues
+the writes for the database. Most of the nodes end up as pending
+replacements."""
+import bisect
+import os
+import random
+import time
+
+from lib.net.routingtable import RoutingTable, iter_buckets
+from lib.sql import queries
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql.thread import SQLiteThread
+from lib.util.contactinfo import ContactInfo
+from lib.util.sha1hash import Hash
+
+from . import time_per_call, report
+
+CHECKPOINTS = (10000, 100000, 1000000)
+
+def depth(table, n):
+  """Returns the number of levels of the bucket tree above the bucket of
+  n."""
+  levels = 0
+  bucket = table._get_bucket(n)
+  while bucket.parent is not None:
+    bucket = bucket.parent
+    levels += 1
+  return levels
+
+def main():
+  thread = SQLiteThread(":memory:", 10000, 1)
+  thread.start()
+  thread.executescript(CREATE_DB_SCRIPT)
+  own = Hash.from_20(os.urandom(20))
+  server = queries.add_server(thread, own, ContactInfo("127.0.0.1", 6881),
+                              None, False)
+  table = RoutingTable(thread, server, own)
+  added = 0
+  for checkpoint in CHECKPOINTS:
+    nodes = [(Hash.from_20(os.urandom(20)),
+              ContactInfo.from_packed(os.urandom(6)))
+             for i in range(checkpoint - added)]
+    start = time.time()
+    for hash, contact in nodes:
+      table.add_node(contact, hash)
+    report("add_node, nodes {0} to {1}".format(added, checkpoint),
+           (time.time() - start) / len(nodes))
+    added = checkpoint
+  buckets = list(iter_buckets(table._root))
+  print "{0:<50s} {1:>12d}".format("buckets", len(buckets))
+  print "{0:<50s} {1:>12d}".format("tree levels above our own bucket",
+                                   depth(table, own.get_int()))
+  report("bucket tree lookup, random id",
+         time_per_call(lambda: table._get_bucket(random.getrandbits(160)),
+                       100000))
+  report("bucket tree lookup, our own id",
+         time_per_call(lambda: table._get_bucket(own.get_int()), 100000))
+  starts = [bucket.start for bucket in buckets]
+  report("bisect over the bucket starts, random id",
+         time_per_call(lambda: buckets[bisect.bisect(
+                         starts, random.getrandbits(160)) - 1], 100000))
+  thread.close()
+
+if __name__ == "__main__":
+  main()
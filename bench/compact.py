@@ -0,0 +1,52 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of compact node info parsing."""
+import os
+
+from lib.util.sha1hash import Hash
+from lib.util.contactinfo import ContactInfo
+from lib.util import compact
+
+from . import time_per_call, report
+
+def legacy_parse(nodes):
+  """The slicing loop DHTServer.add_nodes used to run, for comparison."""
+  result = []
+  while nodes:
+    contact = nodes[0:26]
+    nodes = nodes[26:]
+    result.append((Hash(contact[0:20]), ContactInfo(contact[20:26])))
+  return result
+
+def main():
+  for count in (8, 64, 512):
+    nodes = os.urandom(26 * count)
+    number = max(10, 20000 / count)
+    name = " {0:d} records".format(count)
+    report("slicing loop" + name,
+           time_per_call(lambda: legacy_parse(nodes), number))
+    report("split_nodes" + name,
+           time_per_call(lambda: compact.split_nodes(nodes), number))
+    report("parse_nodes" + name,
+           time_per_call(lambda: compact.parse_nodes(nodes), number))
+    if compact.HAVE_NUMPY:
+      report("nodes_array" + name,
+             time_per_call(lambda: compact.nodes_array(nodes), number))
+
+if __name__ == "__main__":
+  main()
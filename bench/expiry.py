@@ -0,0 +1,83 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Steady state ingest with and without expiry of old torrent db rows.
+
+Every round adds ROUND_ROWS peers, torrents and peer_torrents one simulated
+minute apart, with a time to live of TTL seconds."""
+import os
+import resource
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from lib.sql import expiry, queries
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql.thread import SQLiteThread
+from lib.util.bloom import BloomFilter
+from lib.util.contactinfo import ContactInfo
+from lib.util.sha1hash import Hash
+
+ROUNDS = 60
+ROUND_ROWS = 500
+TTL = 10 * 60 # s
+
+def file_size(path):
+  return sum(os.path.getsize(p) for p in (path, path + "-wal")
+             if os.path.exists(p))
+
+def ingest(path, expire):
+  thread = SQLiteThread(path, 100, 0.05)
+  thread.start()
+  thread.executescript(CREATE_DB_SCRIPT)
+  start = datetime(2013, 1, 1)
+  n = 0
+  begin = time.time()
+  for round in range(1, ROUNDS + 1):
+    now = start + timedelta(minutes=round)
+    for i in range(ROUND_ROWS):
+      n += 1
+      peer = queries.add_peer(thread, ContactInfo.from_packed(
+                              Hash(n).get_20()[-6:]), now)
+      torrent = queries.add_torrent(thread, Hash(n), now, BloomFilter(),
+                                    BloomFilter())
+      queries.add_peer_torrent(thread, peer, torrent, False, now)
+    if expire:
+      expiry.expire(thread, TTL, TTL, 500, None, now)
+    thread.flush()
+    if round % 10 == 0:
+      print "{0:<20s} round {1:>3d}: {2:>7d} peers {3:>9d} KiB db {4:>7d} " \
+            "KiB max rss".format("with expiry" if expire else "without expiry",
+                             round,
+                             thread.select_one("SELECT count(*) FROM peers")[0],
+                             file_size(path) / 1024,
+                             resource.getrusage(resource.RUSAGE_SELF)
+                             .ru_maxrss)
+  thread.close()
+  print "{0:<50s} {1:>12.2f} s".format("ingest time", time.time() - begin)
+
+def main():
+  for expire in (False, True):
+    directory = tempfile.mkdtemp()
+    try:
+      ingest(os.path.join(directory, "bench.db"), expire)
+    finally:
+      shutil.rmtree(directory)
+
+if __name__ == "__main__":
+  main()
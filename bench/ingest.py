@@ -0,0 +1,113 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Peer observations per second into the torrent db.
+
+The old path looks up, writes and looks up again the peer, the torrent and
+their link for every observation. The upsert path hands a whole get_peers
+response to one DB transaction."""
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from lib.sql import ingest, queries
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql.thread import SQLiteThread
+from lib.util.bloom import BloomFilter
+from lib.util.contactinfo import ContactInfo
+from lib.util.sha1hash import Hash
+
+OBSERVATIONS = 4000
+TORRENTS = 200
+PEERS = 2000
+
+def add_torrent(conn, peer, torrent, seed=False):
+  """The ingest path that TorrentDB.add_torrent used to take."""
+  now = datetime.now()
+  peer_row = queries.get_peer_by_contact(conn, peer)
+  if not peer_row:
+    queries.add_peer(conn, peer, now)
+  else:
+    queries.set_peer_updated(conn, peer_row["id"], now)
+  peer_row = queries.get_peer_by_contact(conn, peer)
+  seed_bloom = BloomFilter()
+  peer_bloom = BloomFilter()
+  if seed:
+    seed_bloom.insert_host(peer)
+  else:
+    peer_bloom.insert_host(peer)
+  torrent_row = queries.get_torrent_by_hash(conn, torrent)
+  if torrent_row is None:
+    queries.add_torrent(conn, torrent, now, seed_bloom, peer_bloom)
+  else:
+    queries.add_torrent_filters(conn, torrent_row["id"], now, seed_bloom,
+                                peer_bloom)
+  torrent_row = queries.get_torrent_by_hash(conn, torrent)
+  row = queries.get_peer_torrent_by_peer_and_torrent(conn, peer_row["id"],
+                                                     torrent_row["id"])
+  if row is None:
+    queries.add_peer_torrent(conn, peer_row["id"], torrent_row["id"], seed,
+                             now)
+  else:
+    queries.set_peer_torrent_updated(conn, row["id"], now)
+  queries.get_peer_torrent_by_peer_and_torrent(conn, peer_row["id"],
+                                               torrent_row["id"])
+
+def responses(per_response):
+  """Yields (hash, contacts) get_peers responses, the same ones every run."""
+  rand = random.Random(1)
+  for i in range(OBSERVATIONS / per_response):
+    yield (Hash(rand.randrange(TORRENTS)),
+           [ContactInfo("10.0.{0}.{1}".format(*divmod(rand.randrange(PEERS),
+                                                      256)), 6881)
+            for j in range(per_response)])
+
+def run(name, path, per_response, ingest_response):
+  thread = SQLiteThread(path, 100, 0.05)
+  thread.start()
+  thread.executescript(CREATE_DB_SCRIPT)
+  start = time.time()
+  for hash, contacts in responses(per_response):
+    ingest_response(thread, hash, contacts)
+  thread.flush()
+  seconds = time.time() - start
+  thread.close()
+  print "{0:<50s} {1:>12.0f} /s".format(name, OBSERVATIONS / seconds)
+
+def old_response(conn, hash, contacts):
+  for contact in contacts:
+    add_torrent(conn, contact, hash)
+
+def upsert_response(conn, hash, contacts):
+  ingest.add_torrent_peers(conn, hash, contacts)
+
+def main():
+  for name, per_response, func in (
+      ("old path, 8 values per response", 8, old_response),
+      ("upsert, 1 value per response", 1, upsert_response),
+      ("upsert, 8 values per response", 8, upsert_response),
+      ("upsert, 50 values per response", 50, upsert_response)):
+    directory = tempfile.mkdtemp()
+    try:
+      run(name, os.path.join(directory, "bench.db"), per_response, func)
+    finally:
+      shutil.rmtree(directory)
+
+if __name__ == "__main__":
+  main()
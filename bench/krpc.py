@@ -0,0 +1,80 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of per-packet KRPC encoding and dispatch decoding cost."""
+from lib.util.bencode import bencode, bdecode_strict
+from lib.net.krpc import KRPCEncoder, decode_message
+
+from . import time_per_call, report
+
+def legacy_bencode(obj):
+  """The format based encoder that bencode used to be, for comparison."""
+  if isinstance(obj, (int, long, bool)):
+    return "i{0:-d}e".format(long(obj))
+  elif isinstance(obj, (basestring, buffer)):
+    return "{0:d}:{1:s}".format(len(obj), str(obj))
+  elif isinstance(obj, (list, tuple)):
+    return "l{0:s}e".format("".join((legacy_bencode(x) for x in obj)))
+  keys = sorted(str(k) for k in obj.keys())
+  return "d{0:s}e".format("".join(
+    ("{0:d}:{1:s}".format(len(k), k) + legacy_bencode(obj[k]) for k in keys)))
+
+def main():
+  id = buffer("\x11" * 20)
+  version = "DP\x00\x01"
+  nodes = "\x22" * (26 * 8)
+  krpc = KRPCEncoder(id, version)
+  shapes = (
+    ("ping response", {"y": "r", "t": "aa", "v": version, "r": {"id": id}},
+     lambda: krpc.ping_response("aa")),
+    ("find_node response",
+     {"y": "r", "t": "aa", "v": version, "r": {"id": id, "nodes": nodes}},
+     lambda: krpc.find_node_response("aa", nodes)),
+    ("find_node query",
+     {"y": "q", "t": "aa", "v": version, "q": "find_node",
+      "a": {"id": id, "target": id}},
+     lambda: krpc.find_node_query("aa", id)),
+    ("get_peers query",
+     {"y": "q", "t": "aa", "v": version, "q": "get_peers",
+      "a": {"id": id, "info_hash": id, "scrape": True}},
+     lambda: krpc.query("aa", "get_peers", {"info_hash": id, "scrape": True})),
+  )
+  for name, msg, template in shapes:
+    report("legacy bencode " + name,
+           time_per_call(lambda: legacy_bencode(msg), 20000))
+    report("bencode " + name, time_per_call(lambda: bencode(msg), 20000))
+    report("KRPCEncoder " + name, time_per_call(template, 20000))
+  bench_decode()
+
+def dispatch(message):
+  """Touches the fields the request handler looks at before dispatching."""
+  return message["y"], message["t"], message["r"]["id"]
+
+def bench_decode():
+  for values in (0, 50, 500):
+    r = {"id": "\x11" * 20, "token": "\x22" * 8, "nodes": "\x33" * (26 * 8)}
+    if values:
+      r["values"] = ["\x44" * 6 for x in range(values)]
+    packet = bencode({"y": "r", "t": "aa", "r": r, "v": "DP\x00\x01"})
+    name = "dispatch, {0:d} values".format(values)
+    report("bdecode_strict " + name,
+           time_per_call(lambda: dispatch(bdecode_strict(packet)[0]), 2000))
+    report("decode_message " + name,
+           time_per_call(lambda: dispatch(decode_message(packet)), 2000))
+
+if __name__ == "__main__":
+  main()
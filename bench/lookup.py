@@ -0,0 +1,48 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Lookups in a simulated network of NODES nodes, 10% of them dead, with
+round trips of 50 to 300 ms and a 2 s timeout.
+
+alpha 1 is the old way of chasing nodes one single hop at a time. Reports
+the mean round trips, queries and simulated time per lookup."""
+from lib.net.lookup import Lookup
+from lib.util.sha1hash import Hash
+from test.lookup import SimulatedNetwork
+
+NODES = 1000
+LOOKUPS = 50
+
+def main():
+  network = SimulatedNetwork(NODES)
+  origin = [h for h in network.hashes if h not in network.dead][0]
+  targets = [Hash(network.random.getrandbits(160)) for i in range(LOOKUPS)]
+  for alpha in (1, 2, 3, 5):
+    rounds = queries = seconds = 0
+    for target in targets:
+      lookup = Lookup(target, network.sender(target),
+                      network.seeds(origin, target), alpha=alpha,
+                      exclude=origin)
+      seconds += network.run(lookup)
+      rounds += lookup.get_rounds()
+      queries += lookup.queries
+    print "{0:<50s} {1:>5.1f} {2:>6.1f} {3:>7.2f} s".format(
+        "alpha {0}: rounds, queries, time".format(alpha),
+        float(rounds) / LOOKUPS, float(queries) / LOOKUPS, seconds / LOOKUPS)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,61 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The cost of telling the UI about a change, and how many main loop
+callbacks a burst of packets turns into.
+
+Before, every change was its own glib.idle_add and signal emission. Now a
+change is noted in a dict and the main loop gets one delta per
+notify.INTERVAL ms."""
+import os
+import random
+
+from lib.net.notify import Notifier, INTERVAL
+from lib.util.sha1hash import Hash
+from bench import time_per_call, report
+
+PACKETS = 5000 # per second
+NODES = 1000
+
+def main():
+  scheduled = []
+  deltas = []
+  notifier = Notifier(deltas.append,
+                      lambda ms, func: scheduled.append(func))
+  hashes = [Hash.from_20(os.urandom(20)) for i in range(NODES)]
+  report("note a node change", time_per_call(
+      lambda: notifier.note("node-changed", random.choice(hashes)), 100000))
+  del scheduled[:]
+  notifier.flush()
+  del deltas[:]
+  # One second of packets, each touching a node and its bucket, with the
+  # main loop running whatever is due every INTERVAL ms.
+  callbacks = 0
+  for tick in range(1000 / INTERVAL):
+    for i in range(PACKETS * INTERVAL / 1000):
+      notifier.note("node-changed", random.choice(hashes))
+      notifier.note("bucket-changed", 1)
+    while scheduled:
+      scheduled.pop()()
+      callbacks += 1
+  print "{0:<50s} {1:>12d}".format("changes noted in one second", 2 * PACKETS)
+  print "{0:<50s} {1:>12d}".format("main loop callbacks", callbacks)
+  print "{0:<50s} {1:>12d}".format("keys delivered",
+                                   sum(len(delta) for delta in deltas))
+
+if __name__ == "__main__":
+  main()
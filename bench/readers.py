@@ -0,0 +1,90 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of find_node answer latency while the UI reloads every node.
+
+The refresh and the closest node lookup either share the SQLiteThread
+connection or go through its WAL reader pool."""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from lib.sql.thread import SQLiteThread
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql import queries
+from lib.util.sha1hash import Hash
+from lib.util.contactinfo import ContactInfo
+
+from . import report
+
+NUM_NODES = 5000
+
+def populate(thread):
+  """Fills the database with one server with NUM_NODES nodes."""
+  thread.executescript(CREATE_DB_SCRIPT)
+  now = datetime.now()
+  server = queries.add_server(thread, Hash.from_20(os.urandom(20)),
+                              ContactInfo("127.0.0.1", 6881), None, False)
+  bucket = thread.next_id("buckets")
+  queries.create_bucket(thread, bucket, Hash(0), Hash((1 << 160) - 1), now,
+                        server)
+  for i in range(NUM_NODES):
+    thread.execute("""INSERT INTO nodes(server_id, hash, contact, bucket_id,
+                      good, pending, version, received, created, updated,
+                      sent) VALUES (?, ?, ?, ?, 1, 0, NULL, 0, ?, ?, 0)""",
+                   (server, Hash.from_20(os.urandom(20)),
+                    ContactInfo.from_packed(os.urandom(6)), bucket, now, now))
+  thread.flush()
+  return server
+
+def find_node_latency(conn, server, number=20):
+  """Returns the mean time to look up the closest nodes to a random id."""
+  start = time.time()
+  for i in range(number):
+    queries.get_closest_nodes(conn, server, Hash.from_20(os.urandom(20)), 8)
+  return (time.time() - start) / number
+
+def main():
+  directory = tempfile.mkdtemp()
+  try:
+    thread = SQLiteThread(os.path.join(directory, "bench.db"), 100, 0.05)
+    thread.start()
+    server = populate(thread)
+    for name, conn in (("single connection", thread),
+                       ("reader pool", thread.readers)):
+      report(name + " find_node, idle", find_node_latency(conn, server))
+      running = [True]
+      def refresh():
+        while running[0]:
+          queries.get_nodes_in_server(conn, server)
+      refresher = threading.Thread(target=refresh)
+      refresher.start()
+      try:
+        report(name + " find_node, during UI refresh",
+               find_node_latency(conn, server))
+      finally:
+        running[0] = False
+        refresher.join()
+    thread.close()
+  finally:
+    shutil.rmtree(directory)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,102 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Handled packets per second, with the DB thread at full speed and slowed
+down to DELAY seconds per write.
+
+Every packet comes from a node that is already in the table and is answered,
+so it updates the node and counts the message sent to it. The SQL path is
+the one the routing table took before it was held in memory: a lookup of the
+node by id and one by contact, each waiting behind the queued writes."""
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from lib.net.routingtable import RoutingTable
+from lib.sql import queries
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql.thread import SQLiteThread
+from lib.util.contactinfo import ContactInfo
+from lib.util.sha1hash import Hash
+
+NODES = 1000
+PACKETS = 2000
+DELAY = 0.001 # s per write
+
+class SlowSQLiteThread(SQLiteThread):
+  """A SQLiteThread on a disk that takes delay seconds for every write."""
+  def __init__(self, db, delay, *args):
+    SQLiteThread.__init__(self, db, *args)
+    self.delay = delay
+  def _write(self, cursor, sql, batch, named):
+    time.sleep(self.delay * len(batch))
+    SQLiteThread._write(self, cursor, sql, batch, named)
+
+def sql_packet(conn, server, hash, contact):
+  row = conn.select_one("""SELECT * FROM nodes WHERE server_id=? AND hash=?
+                           LIMIT 1""", (server, hash))
+  conn.execute("""UPDATE nodes SET updated=?, version=?, received=received+1
+                  WHERE id=?""", (row["updated"], None, row["id"]))
+  row = conn.select_one("""SELECT * FROM nodes WHERE server_id=? AND
+                           contact=? LIMIT 1""", (server, contact))
+  conn.execute("UPDATE nodes SET sent=sent+1 WHERE id=?", (row["id"],))
+
+def table_packet(table, hash, contact):
+  table.add_node(contact, hash, None, True)
+  table.add_node_sent(contact)
+
+def run(path, delay):
+  thread = SlowSQLiteThread(path, delay, 100, 0.05)
+  thread.start()
+  thread.executescript(CREATE_DB_SCRIPT)
+  own = Hash.from_20(os.urandom(20))
+  server = queries.add_server(thread, own, ContactInfo("127.0.0.1", 6881),
+                              None, False)
+  table = RoutingTable(thread, server, own)
+  nodes = [(Hash.from_20(os.urandom(20)),
+            ContactInfo.from_packed(os.urandom(6))) for i in range(NODES)]
+  for hash, contact in nodes:
+    table.add_node(contact, hash)
+  thread.flush()
+  packets = [random.choice(nodes) for i in range(PACKETS)]
+  for name, handle in (("SQL", lambda hash, contact:
+                          sql_packet(thread, server, hash, contact)),
+                       ("in memory", lambda hash, contact:
+                          table_packet(table, hash, contact))):
+    start = time.time()
+    for hash, contact in packets:
+      handle(hash, contact)
+    seconds = time.time() - start
+    thread.flush()
+    print "{0:<50s} {1:>12.0f} /s".format("{0}, {1:g} ms per write".format(
+                                          name, delay * 1000),
+                                          PACKETS / seconds)
+    print "{0:<50s} {1:>12.2f} s".format("  then waiting for the database",
+                                         time.time() - start - seconds)
+  thread.close()
+
+def main():
+  for delay in (0, DELAY):
+    directory = tempfile.mkdtemp()
+    try:
+      run(os.path.join(directory, "bench.db"), delay)
+    finally:
+      shutil.rmtree(directory)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,69 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Microbenchmark of the Hash class against the long based implementation."""
+import os
+
+from lib.util.sha1hash import Hash, intern_hash
+
+from . import time_per_call, report
+
+class LegacyHash(object):
+  """The long based Hash that sha1hash used to contain, for comparison."""
+  def __init__(self, raw_hash):
+    self.id = raw_hash
+    if isinstance(self.id, (basestring, buffer)):
+      while len(self.id) < 20:
+        self.id = "\x00" + self.id
+      raw_hash = self.id
+      self.id = 0
+      for char in raw_hash:
+        self.id = self.id << 8
+        self.id += ord(char)
+    elif isinstance(self.id, LegacyHash):
+      self.id = self.id.id
+  def get_20(self):
+    raw_hash = self.id
+    result = ""
+    while raw_hash != 0:
+      result = chr(raw_hash & 0xFF) + result
+      raw_hash = raw_hash >> 8
+    while len(result) < 20:
+      result = "\x00" + result
+    return buffer(result)
+  def get_int(self):
+    return self.id
+  def distance(self, other):
+    return self.get_int() ^ other.get_int()
+
+def main():
+  raw1 = os.urandom(20)
+  raw2 = os.urandom(20)
+  for name, cls in (("LegacyHash", LegacyHash), ("Hash", Hash),
+                    ("intern_hash", intern_hash)):
+    a = cls(raw1)
+    b = cls(raw2)
+    report(name + " construct from 20 bytes",
+           time_per_call(lambda: cls(raw1), 20000))
+    report(name + " get_20", time_per_call(a.get_20, 20000))
+    # Fresh objects, so the lazily computed int form is part of the cost.
+    report(name + " construct + distance",
+           time_per_call(lambda: cls(raw1).distance(cls(raw2)), 20000))
+    report(name + " distance", time_per_call(lambda: a.distance(b), 20000))
+
+if __name__ == "__main__":
+  main()
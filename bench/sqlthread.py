@@ -0,0 +1,171 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmarks of the SQLiteThread dispatch loop, result delivery and writes.
+
+They compare the old polling loop and the old shared results queue against
+the blocking loop and per-call futures, and a commit per write against group
+commit on a file backed database."""
+import os
+import shutil
+import tempfile
+import time
+import threading
+import Queue
+import sqlite3
+
+from lib.sql.thread import SQLiteThread
+
+from . import time_per_call, report
+
+class SharedQueueSQLiteThread(SQLiteThread):
+  """SQLiteThread delivering results through the single shared queue it used
+  to have. Waiters put back results that belong to someone else."""
+  def __init__(self, db):
+    SQLiteThread.__init__(self, db)
+    self.results = Queue.Queue()
+    self.last_id = 0
+    self.id_lock = threading.Lock()
+  def _connect(self):
+    conn = sqlite3.connect(self.db, check_same_thread=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+  def _run_one(self, cursor, stmt):
+    kind, sql, params, id = stmt
+    if params is not None:
+      cursor.execute(sql, params)
+    else:
+      cursor.execute(sql)
+    if kind == self._QUERY:
+      self.results.put((id, cursor.fetchall(), cursor.lastrowid))
+  def run(self):
+    conn = self._connect()
+    cursor = conn.cursor()
+    while 1:
+      stmt = self.stmts.get()
+      if stmt is self._STOP:
+        conn.commit()
+        conn.close()
+        return
+      self._run_one(cursor, stmt)
+  def _call(self, stmt, params):
+    with self.id_lock:
+      self.last_id += 1
+      id = self.last_id
+    self._execute(self._QUERY, stmt, params, id)
+    while True:
+      res = self.results.get(True, None)
+      if res[0] != id:
+        self.results.put(res)
+      else:
+        return res
+  def select(self, stmt, params=None):
+    return self._call(stmt, params)[1]
+
+class PollingSQLiteThread(SharedQueueSQLiteThread):
+  """The non-blocking polling loop SQLiteThread used to have."""
+  def run(self):
+    conn = self._connect()
+    cursor = conn.cursor()
+    while 1:
+      try:
+        stmt = self.stmts.get(False)
+      except Queue.Empty:
+        if self._stopped:
+          conn.commit()
+          conn.close()
+          return
+        else:
+          continue
+      if stmt is not self._STOP:
+        self._run_one(cursor, stmt)
+
+def idle_cpu(seconds=1.0):
+  """Returns the fraction of a core used by this process while idle."""
+  start = os.times()
+  time.sleep(seconds)
+  end = os.times()
+  return (end[0] + end[1] - start[0] - start[1]) / seconds
+
+def mixed_load(thread):
+  """Runs a write followed by a select, the server's usual pattern."""
+  thread.execute("INSERT INTO t (v) VALUES (?)", (1,))
+  thread.select_one("SELECT count(*) FROM t")
+
+def contention(thread, callers, number=200):
+  """Returns the mean select latency with several threads selecting at once."""
+  latencies = []
+  def worker():
+    start = time.time()
+    for i in range(number):
+      thread.select_one("SELECT v FROM t WHERE id=?", (i,))
+    latencies.append((time.time() - start) / number)
+  workers = [threading.Thread(target=worker) for i in range(callers)]
+  for w in workers:
+    w.start()
+  for w in workers:
+    w.join()
+  return sum(latencies) / len(latencies)
+
+def write_burst(path, batch_size, number=2000):
+  """Returns the time per fire and forget write, including the final commit."""
+  thread = SQLiteThread(path, batch_size, 0.05)
+  thread.start()
+  thread.execute("CREATE TABLE IF NOT EXISTS w (id INTEGER PRIMARY KEY, "
+                 "v INTEGER)")
+  thread.flush()
+  start = time.time()
+  for i in range(number):
+    thread.execute("UPDATE w SET v=? WHERE id=?", (i, i))
+    thread.execute("INSERT INTO w (v) VALUES (?)", (i,))
+  thread.flush()
+  seconds = (time.time() - start) / (2 * number)
+  thread.close()
+  return seconds, thread.get_batch_stats()[1]
+
+def main():
+  for name, cls in (("polling", PollingSQLiteThread),
+                    ("shared queue", SharedQueueSQLiteThread),
+                    ("futures", SQLiteThread)):
+    thread = cls(":memory:")
+    thread.start()
+    thread.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v INTEGER)")
+    print "{0:<50s} {1:>12.1f} %".format(name + " idle CPU",
+                                         idle_cpu() * 100)
+    report(name + " select round trip",
+           time_per_call(lambda: thread.select_one("SELECT 1"), 2000))
+    report(name + " insert + select", time_per_call(lambda: mixed_load(thread),
+                                                    2000))
+    # The polling loop starves the waiters of the GIL, which swamps the
+    # difference between the two ways of delivering results.
+    for callers in (1, 4, 16) if cls is not PollingSQLiteThread else ():
+      report("{0} select latency, {1} callers".format(name, callers),
+             contention(thread, callers))
+    thread.close()
+  directory = tempfile.mkdtemp()
+  try:
+    for batch_size in (1, 100):
+      seconds, per_transaction = write_burst(os.path.join(directory,
+                                                          "bench.db"),
+                                             batch_size)
+      report("file write, batch_size={0} ({1:.1f} per commit)".format(
+             batch_size, per_transaction), seconds)
+  finally:
+    shutil.rmtree(directory)
+
+if __name__ == "__main__":
+  main()
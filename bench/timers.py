@@ -0,0 +1,85 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The timed work of a routing table whose nodes have all been idle for too
+long, as it is when it is loaded after a long break.
+
+The checks are spread over LOAD_SPREAD seconds instead of running in one
+burst, and the dispatch loop runs at most MAX_TIMERS of them between
+packets. Reports the most checks due in any one second, the cost of one
+check, and the cost of one dispatch pass."""
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from lib.net.routingtable import RoutingTable, IDLE_TIMEOUT, LOAD_SPREAD
+from lib.sql import queries
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql.thread import SQLiteThread
+from lib.util.contactinfo import ContactInfo
+from lib.util.sha1hash import Hash
+from bench import report
+
+NODES = 5000
+MAX_TIMERS = 64
+
+def run(path):
+  thread = SQLiteThread(path, 100, 0.05)
+  thread.start()
+  thread.executescript(CREATE_DB_SCRIPT)
+  own = Hash.from_20(os.urandom(20))
+  server = queries.add_server(thread, own, ContactInfo("127.0.0.1", 6881),
+                              None, False)
+  table = RoutingTable(thread, server, own)
+  for i in range(NODES):
+    table.add_node(ContactInfo.from_packed(os.urandom(6)),
+                   Hash.from_20(os.urandom(20)))
+  idle = datetime.now() - timedelta(seconds=2 * IDLE_TIMEOUT)
+  thread.execute("UPDATE nodes SET updated=?", (idle,))
+  thread.execute("UPDATE buckets SET updated=?", (idle,))
+  pings = []
+  start = time.time()
+  table = RoutingTable(thread, server, own, None, pings.append)
+  heap = table.scheduler._heap
+  per_second = {}
+  for entry in heap:
+    second = int(entry[0] - start)
+    per_second[second] = per_second.get(second, 0) + 1
+  print "{0:<50s} {1:>12d}".format("timers", len(heap))
+  print "{0:<50s} {1:>12d}".format("most due in one second",
+                                   max(per_second.values()))
+  now = time.time() + LOAD_SPREAD
+  passes = []
+  while table.scheduler.next_due() <= now:
+    t = time.time()
+    count = table.scheduler.run_due(now, MAX_TIMERS)
+    passes.append((time.time() - t, count))
+  report("one check", sum(t for t, c in passes) / sum(c for t, c in passes))
+  report("longest dispatch pass", max(t for t, c in passes))
+  thread.close()
+
+def main():
+  directory = tempfile.mkdtemp()
+  try:
+    run(os.path.join(directory, "bench.db"))
+  finally:
+    shutil.rmtree(directory)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,69 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A simulated day of queries, most of them to nodes that never answer,
+against the transaction table on a fake clock.
+
+Reports the cost of a query that is answered and of one that times out,
+and the most transactions and timers alive at once in each hour. Both must
+stay flat."""
+import os
+import random
+
+from lib.net.transactions import TransactionManager, TIMEOUT
+from lib.util.contactinfo import ContactInfo
+from lib.util.scheduler import Scheduler
+from bench import time_per_call, report
+
+RATE = 10 # queries per simulated second
+ANSWERED = 0.1
+HOURS = 24
+
+def main():
+  now = [0.0]
+  scheduler = Scheduler(lambda: now[0])
+  manager = TransactionManager(scheduler)
+  contacts = [ContactInfo.from_packed(os.urandom(6)) for i in range(1000)]
+  contact = contacts[0]
+  def answered():
+    manager.finish(manager.begin(contact), contact)
+  report("answered query", time_per_call(answered, 10000))
+  def timed_out():
+    manager.begin(contact)
+    now[0] += TIMEOUT
+    scheduler.run_due()
+  report("query that times out", time_per_call(timed_out, 10000))
+
+  most = []
+  for hour in range(HOURS):
+    largest = 0
+    for second in range(3600):
+      now[0] += 1
+      scheduler.run_due()
+      for i in range(RATE):
+        contact = random.choice(contacts)
+        tid = manager.begin(contact)
+        if random.random() < ANSWERED:
+          manager.finish(tid, contact)
+      largest = max(largest, len(manager), len(scheduler))
+    most.append(largest)
+  print "{0:<50s} {1:>12d}".format("most alive in the first hour", most[0])
+  print "{0:<50s} {1:>12d}".format("most alive in the last hour", most[-1])
+  print "{0:<50s} {1:>12d}".format("most alive in any hour", max(most))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,78 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of closest node lookups in the XorTrie against the SQL query."""
+import os
+import random
+import time
+from datetime import datetime
+
+from lib.sql.thread import SQLiteThread
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql import queries
+from lib.util.sha1hash import Hash
+from lib.util.contactinfo import ContactInfo
+from lib.util.xortrie import XorTrie
+
+from . import time_per_call, report
+
+SIZES = (1000, 100000, 1000000)
+K = 8
+
+def sql_closest(size, ids, contacts):
+  """Returns the time per get_closest_nodes call on an in memory table."""
+  thread = SQLiteThread(":memory:", 10000, 1)
+  thread.start()
+  thread.executescript(CREATE_DB_SCRIPT)
+  now = datetime.now()
+  server = queries.add_server(thread, Hash(0), ContactInfo("127.0.0.1", 6881),
+                              None, False)
+  bucket = thread.next_id("buckets")
+  queries.create_bucket(thread, bucket, Hash(0), Hash((1 << 160) - 1), now,
+                        server)
+  for id, contact in zip(ids, contacts):
+    thread.execute("""INSERT INTO nodes(server_id, hash, contact, bucket_id,
+                      good, pending, version, received, created, updated,
+                      sent) VALUES (?, ?, ?, ?, 1, 0, NULL, 0, ?, ?, 0)""",
+                   (server, id, contact, bucket, now, now))
+  thread.flush()
+  number = max(1, 10000 / size)
+  start = time.time()
+  for i in range(number):
+    queries.get_closest_nodes(thread, server, Hash.from_20(os.urandom(20)), K)
+  seconds = (time.time() - start) / number
+  thread.close()
+  return seconds
+
+def main():
+  for size in SIZES:
+    ids = [Hash.from_20(os.urandom(20)) for i in range(size)]
+    contacts = [ContactInfo.from_packed(os.urandom(6)) for i in range(size)]
+    trie = XorTrie()
+    start = time.time()
+    for id, contact in zip(ids, contacts):
+      trie.insert(id.get_int(), (id, contact))
+    report("XorTrie insert, {0} nodes".format(size),
+           (time.time() - start) / size)
+    report("XorTrie closest, {0} nodes".format(size),
+           time_per_call(lambda: trie.closest(random.getrandbits(160), K),
+                         2000))
+    report("SQL get_closest_nodes, {0} nodes".format(size),
+           sql_closest(size, ids, contacts))
+
+if __name__ == "__main__":
+  main()
@@ -35,6 +35,9 @@ def start():
   settings_file = os.path.join(settings_dir, "dhtplay.conf")
 
   config = defaults.DEFAULT_CONFIG
+  # Set before reading, so an empty snapshot in the file turns it off.
+  config.set("torrent", "snapshot",
+             os.path.join(settings_dir, "nodes.snapshot"))
   config.read(settings_file)
 
   gtk.gdk.threads_init()
@@ -0,0 +1,107 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Contains helpers for encoding and decoding KRPC (BEP_0005) messages."""
+
+from ..util.bencode import bencode, bencode_into, bdecode_lazy
+
+def decode_message(string):
+  """Decodes a KRPC message lazily and returns it as a mapping.
+
+  The top level keys and the keys of the 'a' (arguments) or 'r' (response)
+  dictionary are indexed by offset, and every value is only decoded the first
+  time it is looked up. Dispatching on 'y', 'q', 't' and the sender 'id'
+  therefore does not pay for large 'nodes' strings or 'values' lists that the
+  handler never reads. Raises BencodeError if the message is malformed."""
+  return bdecode_lazy(string, ("a", "r"))[0]
+
+class KRPCEncoder(object):
+  """Encodes KRPC messages sent by one server.
+
+  Everything that only depends on the server (its id and version) is
+  bencoded once when the encoder is created, so for each packet only the
+  transaction id and the variable arguments are serialized. The 'id' argument
+  is always filled in with the server's id, so it does not need to be passed
+  in args."""
+  def __init__(self, id, version):
+    self._raw_id = str(id)
+    self._id = "2:id" + bencode(self._raw_id)
+    self._tail = {}
+    for y in ("q", "r", "e"):
+      self._tail[y] = "1:v" + bencode(version) + "1:y1:" + y + "e"
+    self._names = {}
+
+    self._ping_query = "d1:ad" + self._id + "e1:q4:ping1:t"
+    self._find_node_query = "d1:ad" + self._id + "6:target"
+    self._ping_response = "d1:rd" + self._id + "e1:t"
+    self._find_node_response = "d1:rd" + self._id + "5:nodes"
+
+  def _args(self, args, buf):
+    """Appends an args dictionary with the server's id filled in."""
+    args = dict(args)
+    args["id"] = self._raw_id
+    bencode_into(args, buf)
+
+  def query(self, tid, name, args):
+    """Returns an encoded query message."""
+    buf = ["d1:a"]
+    self._args(args, buf)
+    try:
+      name = self._names[name]
+    except KeyError:
+      name = self._names[name] = "1:q" + bencode(name)
+    buf.append(name)
+    buf.append("1:t")
+    bencode_into(tid, buf)
+    buf.append(self._tail["q"])
+    return "".join(buf)
+
+  def response(self, tid, args):
+    """Returns an encoded response message."""
+    buf = ["d1:r"]
+    self._args(args, buf)
+    buf.append("1:t")
+    bencode_into(tid, buf)
+    buf.append(self._tail["r"])
+    return "".join(buf)
+
+  def error(self, tid, args):
+    """Returns an encoded error message. args is [code, message]."""
+    buf = ["d1:e"]
+    bencode_into(args, buf)
+    buf.append("1:t")
+    bencode_into(tid, buf)
+    buf.append(self._tail["e"])
+    return "".join(buf)
+
+  def ping_query(self, tid):
+    """Returns an encoded ping query."""
+    return "".join((self._ping_query, bencode(tid), self._tail["q"]))
+
+  def find_node_query(self, tid, target):
+    """Returns an encoded find_node query for a 20 byte target."""
+    return "".join((self._find_node_query, bencode(target),
+                    "e1:q9:find_node1:t", bencode(tid), self._tail["q"]))
+
+  def ping_response(self, tid):
+    """Returns an encoded ping response."""
+    return "".join((self._ping_response, bencode(tid), self._tail["r"]))
+
+  def find_node_response(self, tid, nodes):
+    """Returns an encoded find_node response carrying compact node info."""
+    return "".join((self._find_node_response, bencode(nodes), "e1:t",
+                    bencode(tid), self._tail["r"]))
@@ -0,0 +1,197 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Contains the iterative lookup of the nodes closest to an id."""
+import bisect
+import threading
+
+from ..util import compact
+from ..util.bencode import BencodeError
+
+ALPHA = 3 # queries in flight at once
+K = 8 # closest nodes that have to answer
+
+NEW, SENT, ANSWERED, FAILED = range(4)
+
+# What a response of the wrong shape raises while it is parsed. The fields
+# of a lazily decoded response raise BencodeError when they are first read.
+_MALFORMED = (AttributeError, BencodeError, TypeError, ValueError)
+
+class Candidate(object):
+  """A node on the shortlist of a lookup. hops is the number of responses
+  it took to learn about it, 0 for the nodes the lookup started with."""
+  __slots__ = ("hash", "contact", "distance", "state", "hops")
+  def __init__(self, hash, contact, distance, hops):
+    self.hash = hash
+    self.contact = contact
+    self.distance = distance
+    self.state = NEW
+    self.hops = hops
+
+class Lookup(object):
+  """An iterative Kademlia lookup of the k nodes closest to target.
+
+  The shortlist holds every node heard of, ordered by XOR distance to
+  target. Up to alpha of the k closest nodes that have not failed are
+  queried at once. Every response adds the nodes it returns, and every
+  answer or timeout sends the next query. The lookup is done once the k
+  closest nodes that have not failed have all answered.
+
+  send(contact, callback) sends the query and arranges for callback to be
+  called with the response, or with None if it times out. It returns False
+  if the query was not sent. nodes are the (Hash, ContactInfo) pairs to
+  start from, such as the closest ones in the routing table. contacts are
+  addresses to query whose ids are not known, such as a bootstrap node.
+
+  progress and done are called with the lookup, from the thread the
+  responses come in on, after every response and when it is done. Nodes
+  with the id exclude, normally our own, are ignored."""
+  def __init__(self, target, send, nodes=(), contacts=(), alpha=ALPHA, k=K,
+               progress=None, done=None, exclude=None):
+    self.target = target
+    self._target = target.get_int()
+    self._send = send
+    self.alpha = alpha
+    self.k = k
+    self._progress = progress or (lambda lookup: None)
+    self._done = done or (lambda lookup: None)
+    self._exclude = exclude
+    self._lock = threading.RLock()
+    self._candidates = {}
+    self._shortlist = [] # (distance, Candidate), closest first
+    self._contacts = list(contacts)
+    self._in_flight = 0
+    self.queries = 0
+    self.peers = set() # from the values of get_peers responses
+    self.finished = False
+    self._finish_reported = False
+    for hash, contact in nodes:
+      self._add(hash, contact, 0)
+
+  def start(self):
+    """Sends the first queries. Returns the lookup."""
+    with self._lock:
+      for contact in self._contacts:
+        self._query(contact, self._bootstrap_answered)
+      self._step()
+    self._report()
+    return self
+
+  def _add(self, hash, contact, hops):
+    if hash in self._candidates or hash == self._exclude:
+      return None
+    distance = hash.get_int() ^ self._target
+    candidate = Candidate(hash, contact, distance, hops)
+    self._candidates[hash] = candidate
+    bisect.insort(self._shortlist, (distance, candidate))
+    return candidate
+
+  def _query(self, contact, callback):
+    self._in_flight += 1
+    if not self._send(contact, callback):
+      self._in_flight -= 1
+      return False
+    self.queries += 1
+    return True
+
+  def _step(self):
+    """Sends queries to the closest new candidates while there is room,
+    and finishes the lookup if nothing is left to wait for."""
+    if self.finished:
+      return
+    closest = 0
+    for distance, candidate in self._shortlist:
+      if closest >= self.k:
+        break
+      if candidate.state == FAILED:
+        continue
+      if candidate.state == NEW and self._in_flight < self.alpha:
+        candidate.state = SENT
+        if not self._query(candidate.contact,
+                           lambda message, candidate=candidate:
+                             self._answered(candidate, message)):
+          candidate.state = FAILED
+          continue
+      closest += 1
+    if self._in_flight == 0:
+      self.finished = True
+
+  def _absorb(self, response, hops):
+    """Adds the nodes and peers from a response. A malformed nodes or
+    values entry is ignored."""
+    try:
+      hashes, contacts = compact.parse_nodes(response.get("nodes", ""))
+    except _MALFORMED:
+      hashes, contacts = [], []
+    for hash, contact in zip(hashes, contacts):
+      self._add(hash, contact, hops)
+    try:
+      if "values" in response:
+        self.peers.update(compact.parse_values(response["values"]))
+    except _MALFORMED:
+      pass
+
+  def _answered(self, candidate, message):
+    # Whatever the response holds, the next query has to go out, or the
+    # lookup never finishes.
+    try:
+      with self._lock:
+        self._in_flight -= 1
+        try:
+          if message is None or "r" not in message:
+            candidate.state = FAILED
+          else:
+            candidate.state = ANSWERED
+            self._absorb(message["r"], candidate.hops + 1)
+        finally:
+          self._step()
+    finally:
+      self._report()
+
+  def _bootstrap_answered(self, message):
+    try:
+      with self._lock:
+        self._in_flight -= 1
+        try:
+          if message is not None and "r" in message:
+            self._absorb(message["r"], 1)
+        finally:
+          self._step()
+    finally:
+      self._report()
+
+  def _report(self):
+    with self._lock:
+      done = self.finished and not self._finish_reported
+      self._finish_reported = self.finished
+    self._progress(self)
+    if done:
+      self._done(self)
+
+  def get_closest(self):
+    """Returns (Hash, ContactInfo) pairs for the closest nodes that have
+    answered, closest first."""
+    with self._lock:
+      return [(c.hash, c.contact) for distance, c in self._shortlist
+              if c.state == ANSWERED][:self.k]
+
+  def get_rounds(self):
+    """Returns the number of round trips in the longest chain of queries
+    that led to the result."""
+    closest = self.get_closest()
+    if not closest:
+      return 0
+    return max(self._candidates[hash].hops + 1 for hash, contact in closest)
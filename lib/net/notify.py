@@ -0,0 +1,111 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Contains the aggregator that turns the changes to a routing table or
+torrent db into batched deltas for the UI."""
+import threading
+
+INTERVAL = 100 # ms, so at most 10 deltas a second
+
+ADDED, CHANGED, REMOVED = range(3)
+
+# The kind, state and key of the change each per-item signal stands for.
+# bucket-split is special cased.
+_SIGNALS = {
+  "node-added": ("node", ADDED), "node-changed": ("node", CHANGED),
+  "node-removed": ("node", REMOVED),
+  "bucket-changed": ("bucket", CHANGED),
+  "torrent-added": ("torrent", ADDED), "torrent-changed": ("torrent", CHANGED),
+  "torrent-removed": ("torrent", REMOVED),
+  "peer-added": ("peer", ADDED), "peer-changed": ("peer", CHANGED),
+  "peer-removed": ("peer", REMOVED),
+  "peer-torrent-added": ("peer-torrent", ADDED),
+  "peer-torrent-updated": ("peer-torrent", CHANGED),
+  "peer-torrent-removed": ("peer-torrent", REMOVED),
+}
+
+class Delta(object):
+  """The changes since the last delta, as the sets of keys of each kind
+  (node, bucket, torrent, peer or peer-torrent) that were added, changed and
+  removed. A key is in at most one of the three sets of its kind. Node keys
+  are hashes, buckets ids, torrents info hashes, peers ContactInfos and
+  peer-torrents (peer, torrent) tuples."""
+  def __init__(self, states):
+    self._sets = {}
+    for (kind, key), state in states.iteritems():
+      if kind not in self._sets:
+        self._sets[kind] = (set(), set(), set())
+      self._sets[kind][state].add(key)
+  def added(self, kind):
+    return self._sets.get(kind, _EMPTY)[ADDED]
+  def changed(self, kind):
+    return self._sets.get(kind, _EMPTY)[CHANGED]
+  def removed(self, kind):
+    return self._sets.get(kind, _EMPTY)[REMOVED]
+  def __len__(self):
+    return sum(len(s) for sets in self._sets.itervalues() for s in sets)
+
+_EMPTY = (frozenset(), frozenset(), frozenset())
+
+class Notifier(object):
+  """Collects changes from any thread and delivers them as one Delta at most
+  every interval milliseconds.
+
+  note() takes the same arguments as the per-item signals of DHTRoutingTable
+  and TorrentDB. The first change after a delivery calls
+  schedule(interval, flush), which is glib.timeout_add in the UI, so a quiet
+  table costs nothing. flush() calls deliver with the Delta from the thread
+  it is called in. Changes to the same key are merged: an add followed by a
+  change is an add, and an add followed by a remove is dropped."""
+  def __init__(self, deliver, schedule, interval=INTERVAL):
+    self._deliver = deliver
+    self._schedule = schedule
+    self.interval = interval
+    self._states = {}
+    self._scheduled = False
+    self._lock = threading.Lock()
+  def note(self, signal, *args):
+    if signal == "bucket-split":
+      self._note("bucket", CHANGED, args[0])
+      self._note("bucket", ADDED, args[1])
+      return
+    kind, state = _SIGNALS[signal]
+    self._note(kind, state, args[0] if len(args) == 1 else args)
+  def _note(self, kind, state, key):
+    with self._lock:
+      item = (kind, key)
+      old = self._states.get(item)
+      if old == ADDED:
+        if state == REMOVED:
+          del self._states[item]
+      elif old == REMOVED:
+        if state != REMOVED:
+          self._states[item] = CHANGED # the view still has the old row
+      elif old != CHANGED or state == REMOVED:
+        self._states[item] = state
+      if self._scheduled:
+        return
+      self._scheduled = True
+    self._schedule(self.interval, self.flush)
+  def flush(self):
+    """Delivers the changes collected so far. Returns False, so it can be
+    used as a one shot glib timeout."""
+    with self._lock:
+      states, self._states = self._states, {}
+      self._scheduled = False
+    if states:
+      self._deliver(Delta(states))
+    return False
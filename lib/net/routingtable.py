@@ -0,0 +1,496 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Contains the routing table of a DHT server, kept in memory and mirrored to
+the buckets and nodes tables."""
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from ..util.sha1hash import Hash
+from ..util.contactinfo import ContactInfo
+from ..util.xortrie import XorTrie
+from ..util.scheduler import Scheduler
+from ..sql import queries
+from .snapshot import SnapshotNode
+
+MAX_BUCKET_SIZE = 8
+IDLE_TIMEOUT = 15 * 60 # s
+PING_TIMEOUT = 60 # s, for an idle node to answer before it counts as bad
+LOAD_SPREAD = 60 # s, over which the checks overdue at startup are spread
+MAX_FAILURES = 2 # queries in a row a node can leave unanswered and stay good
+
+_IDLE = timedelta(seconds=IDLE_TIMEOUT)
+_TOP = 1 << 160 # the end of the last bucket
+_TOP_ROW = _TOP - 1 # which is stored as the largest id
+
+class Bucket(object):
+  """A bucket holding the nodes with ids from start up to end, and a leaf of
+  the bucket tree.
+
+  nodes are the ones in use and pending the replacements waiting for one of
+  them to go bad. parent is the Split above the bucket, if any."""
+  __slots__ = ("id", "start", "end", "created", "updated", "nodes", "pending",
+               "parent")
+  def __init__(self, id, start, end, created, updated):
+    self.id = id
+    self.start = start
+    self.end = end
+    self.created = created
+    self.updated = updated
+    self.nodes = []
+    self.pending = []
+    self.parent = None
+  def row(self):
+    """Returns the bucket in the same form as a row of the buckets table."""
+    return {"id": self.id, "start": Hash(self.start),
+            "end": Hash(min(self.end, _TOP_ROW)),
+            "created": self.created, "updated": self.updated}
+
+class Split(object):
+  """An inner node of the bucket tree. Ids below mid are under lower and the
+  rest under upper, each of which is a Split or a Bucket."""
+  __slots__ = ("mid", "lower", "upper", "parent")
+  def __init__(self, mid, lower, upper):
+    self.mid = mid
+    self.lower = lower
+    self.upper = upper
+    self.parent = None
+    lower.parent = self
+    upper.parent = self
+
+def build_tree(buckets):
+  """Returns the root of a bucket tree over buckets, which must be ordered by
+  start. Each bucket is split off at the bucket boundary nearest to the
+  middle of its range, which gives back the tree that split the buckets
+  from one bucket over the whole id space."""
+  if len(buckets) == 1:
+    return buckets[0]
+  middle = buckets[0].start + (buckets[-1].end - buckets[0].start)/2
+  i = min(range(1, len(buckets)),
+          key=lambda i: abs(buckets[i].start - middle))
+  return Split(buckets[i].start, build_tree(buckets[:i]),
+               build_tree(buckets[i:]))
+
+def _timestamp(dt):
+  return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+
+def iter_buckets(tree):
+  """Yields the buckets of a bucket tree in order of their ids."""
+  stack = [tree]
+  while stack:
+    node = stack.pop()
+    if node.__class__ is Split:
+      stack.append(node.upper)
+      stack.append(node.lower)
+    else:
+      yield node
+
+class Node(object):
+  """A node in the routing table. pinged is set once the node has been idle
+  for too long and has been pinged, failures counts the queries to it that
+  have timed out since it was last heard from, and timer is its next check,
+  or None if it has gone bad and has none."""
+  __slots__ = ("id", "hash", "contact", "bucket", "good", "pending",
+               "version", "sent", "received", "rtt", "created", "updated",
+               "pinged", "failures", "timer")
+  def __init__(self, id, hash, contact, bucket, good, pending, version, sent,
+               received, rtt, created, updated):
+    self.id = id
+    self.hash = hash
+    self.contact = contact
+    self.bucket = bucket
+    self.good = good
+    self.pending = pending
+    self.version = version
+    self.sent = sent
+    self.received = received
+    self.rtt = rtt
+    self.created = created
+    self.updated = updated
+    self.pinged = False
+    self.failures = 0
+    self.timer = None
+  def row(self):
+    """Returns the node in the same form as a row of the nodes table."""
+    return {"id": self.id, "hash": self.hash, "contact": self.contact,
+            "bucket_id": self.bucket.id, "good": self.good,
+            "pending": self.pending, "version": self.version,
+            "sent": self.sent, "received": self.received, "rtt": self.rtt,
+            "created": self.created, "updated": self.updated}
+
+class RoutingTable(object):
+  """The buckets and nodes of one server.
+
+  The table is loaded from the database once and then only kept in step with
+  it: every change is queued on conn as a fire and forget write, with row ids
+  from conn.next_id, so handling a packet never waits for the DB thread. The
+  UI reads the table from here rather than from the database.
+
+  The periodic work is spread out over scheduler, one timer per node and per
+  bucket, each due when that node or bucket has been idle for IDLE_TIMEOUT:
+  - An idle node is pinged. If it still has not been heard from
+    PING_TIMEOUT later, it is marked bad and the best pending node takes its
+    place. Idle pending nodes are dropped.
+  - An idle bucket has a random node in it pinged.
+  A timer that comes up for a node or bucket that has been heard from since
+  is just moved to the new due time, so handling a packet does not touch the
+  scheduler.
+
+  changed is called with the name of a DHTRoutingTable signal and its
+  arguments for every change, and ping with an address tuple for every node
+  that should be pinged. Both are called with the table locked. All of the
+  methods are thread safe."""
+  def __init__(self, conn, server_id, id, changed=None, ping=None,
+               scheduler=None):
+    self.conn = conn
+    self.server_id = server_id
+    self.own_id = id.get_int()
+    self.scheduler = scheduler or Scheduler()
+    self._changed = changed or (lambda *args: None)
+    self._ping = ping or (lambda address: None)
+    self._lock = threading.RLock()
+    self._root = None # the bucket tree
+    self._bucket_ids = {}
+    self._nodes = {} # by hash
+    self._contacts = {}
+    self._trie = XorTrie() # all of the nodes by id, for get_closest
+    self._load()
+
+  def _load(self):
+    rows = queries.get_buckets_in_server(self.conn, self.server_id)
+    buckets = sorted((Bucket(row["id"], row["start"].get_int(),
+                             row["end"].get_int(), row["created"],
+                             row["updated"]) for row in rows),
+                     key=lambda bucket: bucket.start)
+    if buckets:
+      # Each bucket ends where the next one starts. Older versions could
+      # store ends that were off by one.
+      ends = [bucket.start for bucket in buckets[1:]] + [_TOP]
+      for bucket, end in zip(buckets, ends):
+        if bucket.end != min(end, _TOP_ROW):
+          queries.set_bucket_end(self.conn, bucket.id,
+                                 Hash(min(end, _TOP_ROW)), bucket.updated)
+        bucket.end = end
+        self._bucket_ids[bucket.id] = bucket
+        self._schedule_bucket(bucket, True)
+      self._root = build_tree(buckets)
+    else:
+      self._root = self._new_bucket(0, _TOP, datetime.now())
+    for row in queries.get_nodes_in_server(self.conn, self.server_id):
+      bucket = self._get_bucket(row["hash"].get_int())
+      if bucket.id != row["bucket_id"]:
+        queries.set_node_bucket(self.conn, row["id"], bucket.id)
+      node = Node(row["id"], row["hash"], row["contact"], bucket,
+                  bool(row["good"]), bool(row["pending"]), row["version"],
+                  row["sent"], row["received"], row["rtt"], row["created"],
+                  row["updated"])
+      self._insert_node(node)
+      self._schedule_node(node, True)
+    now = datetime.now()
+    for bucket in iter_buckets(self._root):
+      self._promote(now, bucket)
+
+  def _schedule_node(self, node, spread=False):
+    """Sets the timer of node for when it will have been idle for too long.
+    With spread, a time that has already passed is moved to a random time
+    in the next LOAD_SPREAD seconds."""
+    node.timer = self._schedule(self._check_node, node, node.updated, spread)
+
+  def _schedule_bucket(self, bucket, spread=False):
+    self._schedule(self._check_bucket, bucket, bucket.updated, spread)
+
+  def _schedule(self, func, item, updated, spread):
+    due = _timestamp(updated) + IDLE_TIMEOUT
+    now = self.scheduler.clock()
+    if spread and due < now:
+      due = now + random.uniform(0, LOAD_SPREAD)
+    return self.scheduler.call_at(due, func, item)
+
+  def _new_bucket(self, start, end, now):
+    bucket = Bucket(self.conn.next_id("buckets"), start, end, now, now)
+    queries.create_bucket(self.conn, bucket.id, Hash(start),
+                          Hash(min(end, _TOP_ROW)), now, self.server_id)
+    self._bucket_ids[bucket.id] = bucket
+    self._schedule_bucket(bucket)
+    return bucket
+
+  def _get_bucket(self, n):
+    """Returns the bucket for the id n, in one step per level of the
+    tree."""
+    node = self._root
+    while node.__class__ is Split:
+      if n < node.mid:
+        node = node.lower
+      else:
+        node = node.upper
+    return node
+
+  def _touch_bucket(self, bucket, now):
+    bucket.updated = now
+    queries.set_bucket_updated(self.conn, bucket.id, now)
+
+  def _insert_node(self, node):
+    if node.pending:
+      node.bucket.pending.append(node)
+    else:
+      node.bucket.nodes.append(node)
+    self._nodes[node.hash] = node
+    self._contacts[node.contact] = node
+    self._trie.insert(node.hash.get_int(), (node.hash, node.contact))
+
+  def _remove_node(self, node):
+    if node.pending:
+      node.bucket.pending.remove(node)
+    else:
+      node.bucket.nodes.remove(node)
+    del self._nodes[node.hash]
+    if self._contacts.get(node.contact) is node:
+      del self._contacts[node.contact]
+    self._trie.remove(node.hash.get_int())
+
+  def _add_node(self, hash, contact, bucket, now, pending, version, received):
+    node = Node(self.conn.next_id("nodes"), hash, contact, bucket, True,
+                pending, version, 0, int(received), None, now, now)
+    queries.create_node(self.conn, node.id, self.server_id, hash, contact,
+                        bucket.id, True, pending, version, node.received, 0,
+                        now)
+    self._insert_node(node)
+    self._schedule_node(node)
+    self._changed("node-added", hash)
+    if not pending:
+      self._touch_bucket(bucket, now)
+    self._changed("bucket-changed", bucket.id)
+
+  def _delete_node(self, node):
+    self._remove_node(node)
+    queries.delete_node(self.conn, node.id)
+    self._changed("node-removed", node.hash)
+
+  def _cull_bucket(self, now, bucket):
+    """Makes room in a full bucket by deleting a bad node. Returns whether
+    there is room."""
+    if len(bucket.nodes) < MAX_BUCKET_SIZE:
+      return True
+    for node in bucket.nodes:
+      if not node.good:
+        self._delete_node(node)
+        return True
+    return False
+
+  def _promote(self, now, bucket):
+    """Moves the most recently seen pending nodes into bucket while there is
+    room."""
+    while bucket.pending and self._cull_bucket(now, bucket):
+      node = max(bucket.pending, key=lambda node: node.updated)
+      bucket.pending.remove(node)
+      bucket.nodes.append(node)
+      node.pending = False
+      node.updated = now
+      queries.set_node_pending(self.conn, node.id, False, now)
+      self._changed("node-changed", node.hash)
+      self._touch_bucket(bucket, now)
+      self._changed("bucket-changed", bucket.id)
+
+  def _check_node(self, node):
+    """Runs when node may have been idle for too long."""
+    with self._lock:
+      if self._nodes.get(node.hash) is not node:
+        return # deleted
+      now = datetime.now()
+      if now - node.updated < _IDLE:
+        self._schedule_node(node)
+      elif node.pending:
+        self._delete_node(node)
+      elif not node.pinged:
+        node.pinged = True
+        self._ping(node.contact.get_tuple())
+        node.timer = self.scheduler.call_later(PING_TIMEOUT, self._check_node,
+                                               node)
+      else:
+        node.timer = None
+        self._mark_bad(now, node)
+
+  def _mark_bad(self, now, node):
+    if node.good:
+      node.good = False
+      queries.set_node_good(self.conn, node.id, False)
+      self._changed("node-changed", node.hash)
+      self._promote(now, node.bucket)
+
+  def _check_bucket(self, bucket):
+    """Runs when bucket may have been idle for too long."""
+    with self._lock:
+      now = datetime.now()
+      if now - bucket.updated < _IDLE:
+        self._schedule_bucket(bucket)
+        return
+      if bucket.nodes:
+        self._ping(random.choice(bucket.nodes).contact.get_tuple())
+      self.scheduler.call_later(IDLE_TIMEOUT, self._check_bucket, bucket)
+
+  def _split_bucket(self, now, bucket):
+    """Splits bucket in half in place: it keeps the lower half and a new
+    bucket takes the upper half and the nodes in it. Returns the new
+    bucket."""
+    mid = bucket.start + (bucket.end - bucket.start)/2
+    new = self._new_bucket(mid, bucket.end, now)
+    bucket.end = mid
+    bucket.updated = now
+    queries.set_bucket_end(self.conn, bucket.id, Hash(mid), now)
+    parent = bucket.parent
+    split = Split(mid, bucket, new)
+    if parent is None:
+      self._root = split
+    elif parent.lower is bucket:
+      parent.lower = split
+      split.parent = parent
+    else:
+      parent.upper = split
+      split.parent = parent
+    self._changed("bucket-split", bucket.id, new.id)
+
+    for old_nodes, new_nodes in ((bucket.nodes, new.nodes),
+                                 (bucket.pending, new.pending)):
+      moved = [node for node in old_nodes if node.hash.get_int() >= mid]
+      if not moved:
+        continue
+      old_nodes[:] = [node for node in old_nodes
+                      if node.hash.get_int() < mid]
+      new_nodes.extend(moved)
+      for node in moved:
+        node.bucket = new
+        queries.set_node_bucket(self.conn, node.id, new.id)
+        self._changed("node-changed", node.hash)
+    return new
+
+  def add_node_sent(self, contact):
+    with self._lock:
+      node = self._contacts.get(contact)
+      if node is not None:
+        node.sent += 1
+        queries.add_node_sent(self.conn, node.id)
+        self._changed("node-changed", node.hash)
+
+  def add_node(self, contact, hash, version=None, received=False):
+    if version is not None:
+      version = buffer(version)
+    received = int(received)
+    now = datetime.now()
+    n = hash.get_int()
+
+    with self._lock:
+      node = self._nodes.get(hash)
+      if node is not None:
+        node.updated = now
+        node.version = version
+        node.received += received
+        node.pinged = False
+        node.failures = 0
+        queries.set_node_updated(self.conn, node.id, now, version, received)
+        if not node.good:
+          node.good = True
+          queries.set_node_good(self.conn, node.id, True)
+          if node.timer is None:
+            self._schedule_node(node)
+        self._changed("node-changed", hash)
+        return
+
+      bucket = self._get_bucket(n)
+      while True:
+        if len(bucket.nodes) < MAX_BUCKET_SIZE:
+          # add normally
+          self._add_node(hash, contact, bucket, now, False, version,
+                         received)
+        elif bucket.start <= self.own_id < bucket.end:
+          new = self._split_bucket(now, bucket)
+          if n >= new.start:
+            bucket = new
+          continue
+        elif self._cull_bucket(now, bucket):
+          continue
+        else:
+          self._add_node(hash, contact, bucket, now, True, version, received)
+        return
+
+  def add_node_failed(self, contact):
+    """Records that a query to a node timed out. A node that fails
+    MAX_FAILURES queries in a row is bad, and a pending node that fails one
+    is dropped."""
+    with self._lock:
+      node = self._contacts.get(contact)
+      if node is None:
+        return
+      node.failures += 1
+      if node.pending:
+        self._delete_node(node)
+      elif node.failures >= MAX_FAILURES:
+        self._mark_bad(datetime.now(), node)
+
+  def add_nodes(self, hashes, contacts):
+    """Adds the nodes from one compact 'nodes' string.
+
+    hashes and contacts are parallel lists like the ones returned by
+    compact.parse_nodes. Nodes that appear more than once and our own id are
+    skipped."""
+    seen = set([Hash(self.own_id)])
+    for hash, contact in zip(hashes, contacts):
+      if hash not in seen:
+        seen.add(hash)
+        self.add_node(contact, hash)
+
+  def set_node_rtt(self, hash, rtt):
+    """Records the round trip time in seconds of a ping to a node."""
+    with self._lock:
+      node = self._nodes.get(hash)
+      if node is not None:
+        node.rtt = rtt
+        queries.set_node_rtt(self.conn, node.id, rtt)
+
+  def get_node_row(self, n):
+    """Returns the node with the ContactInfo or Hash n as a row dict, or
+    None."""
+    if isinstance(n, ContactInfo):
+      nodes = self._contacts
+    elif isinstance(n, Hash):
+      nodes = self._nodes
+    else:
+      raise TypeError("Unknown node identifier.")
+    with self._lock:
+      node = nodes.get(n)
+      return node.row() if node is not None else None
+  def get_bucket_row(self, id):
+    with self._lock:
+      bucket = self._bucket_ids.get(id)
+      return bucket.row() if bucket is not None else None
+  def get_node_rows(self):
+    with self._lock:
+      return [node.row() for node in self._nodes.itervalues()]
+  def get_bucket_rows(self):
+    with self._lock:
+      return [bucket.row() for bucket in iter_buckets(self._root)]
+  def get_snapshot_nodes(self):
+    """Returns the good nodes in the table as SnapshotNodes."""
+    with self._lock:
+      return [SnapshotNode(node.hash, node.contact,
+                           time.mktime(node.updated.timetuple()), node.rtt)
+              for node in self._nodes.itervalues()
+              if node.good and not node.pending]
+  def get_closest(self, hash, number=MAX_BUCKET_SIZE):
+    """Returns (Hash, ContactInfo) pairs for the nodes closest to hash."""
+    with self._lock:
+      return self._trie.closest(hash.get_int(), number)
@@ -20,18 +20,23 @@ import socket
 import glib
 import gobject
 import traceback
-import hashlib
-import random
+import time
 
 from ..net.dht import DHTRoutingTable
-from ..util.sha1hash import Hash
+from ..net.krpc import KRPCEncoder, decode_message
+from ..net.tokens import TokenManager
+from ..net.transactions import TransactionManager
+from ..net.lookup import Lookup
+from ..util.sha1hash import Hash, intern_hash
 from ..util.contactinfo import ContactInfo
 from ..util.bencode import *
 from ..util.bloom import BloomFilter
+from ..util import compact
+from . import snapshot
 from ..util import version
 
-REFRESH_CHECK = 30 # s
-NUM_SECRETS = 20 # s
+WARM_START_RATE = 50 # pings/s
+WARM_START_TICK = 100 # ms
 
 class DHTRequestHandler(SocketServer.DatagramRequestHandler):
   """Handler for DHT packets over UDP."""
@@ -40,24 +45,20 @@ class DHTRequestHandler(SocketServer.DatagramRequestHandler):
     enc_message = self.rfile.read()
     if not enc_message:
       return
-    error = False
+    c = ContactInfo(*self.client_address)
+    # Values are only decoded when they are first used, so a malformed one
+    # can turn up anywhere in the handlers.
     try:
-      message = bdecode(enc_message)[0]
+      message = decode_message(enc_message)
+      if message["y"] == "q":
+        self.server._log("Query "+str(message["q"])+" from "+str(c))
+        self.handle_query(c, message)
+      else:
+        self.server._log("Response "+repr(message["t"])+" from "+str(c))
+        self.handle_response(c, message)
     except BencodeError:
-      self.send_error(self.client_address, 0,
-                      [203,"Malformed DHT Packet!"])
-      return
-    if (message.has_key("q") and message["q"] == "refresh" and
-        message.has_key("a") and message["a"].has_key("secret") and
-        message["a"]["secret"] in self.server.secrets):
-      self.server._update()
-      return
-    c = ContactInfo(*self.client_address)
-    self.server._log("From "+str(c)+":"+str(message))  
-    if message["y"] == "q":
-      self.handle_query(c, message)
-    else:
-      self.handle_response(c, message)
+      self.server.send_error(self.client_address, 0,
+                             [203,"Malformed DHT Packet!"])
 
   def handle_query(self, contact, message):
     """Handle a Query packet."""
@@ -70,26 +71,26 @@ class DHTRequestHandler(SocketServer.DatagramRequestHandler):
     except KeyError:
       version = None
     try:
-      self.server.routingtable.add_node(contact, Hash(message["a"]["id"]),
+      self.server.routingtable.add_node(contact,
+                                        intern_hash(message["a"]["id"]),
                                         version, True)
     except KeyError:
       pass
 
-    response = {"id": self.server.id.get_20()}
+    response = {}
     if message["q"] == "ping":
-      pass
+      self.server.send_ping_response(contact.get_tuple(), message["t"])
+      return
     elif message["q"] == "find_node":
-      nodes = ""
-      for row in self.server.routingtable.get_closest(Hash(message["a"]
-                                                      ["target"])):
-        nodes += str(row["hash"].get_20()) + str(row["contact"].get_packed())
-      response["nodes"] = nodes
+      nodes = compact.pack_nodes(self.server.routingtable.get_closest(
+                                   Hash(message["a"]["target"])))
+      self.server.send_find_node_response(contact.get_tuple(), message["t"],
+                                          nodes)
+      return
     elif message["q"] == "get_peers":
-      nodes = ""
-      for row in self.server.routingtable.get_closest(Hash(message["a"]
-                                                      ["info_hash"])):
-        nodes += str(row["hash"].get_20()) + str(row["contact"].get_packed())
-      response["nodes"] = nodes
+      response["nodes"] = compact.pack_nodes(
+          self.server.routingtable.get_closest(Hash(message["a"]
+                                                    ["info_hash"])))
 
       trow = self.server.torrents.get_torrent_row(Hash(message["a"]
                                                   ["info_hash"]))
@@ -106,9 +107,9 @@ class DHTRequestHandler(SocketServer.DatagramRequestHandler):
         if message["a"].has_key("scrape") and message["a"]["scrape"]:
           response["BFsd"] = trow["seeds"].get_bin()
           response["BFpe"] = trow["peers"].get_bin()
-      response["token"] = self.get_token(contact)
+      response["token"] = self.server.tokens.get_token(contact)
     elif message["q"] == "announce_peer": 
-      if self.server.check_token(message["a"]["token"]):
+      if self.server.tokens.check_token(contact, message["a"]["token"]):
         seed = False
         if message["a"].has_key("seed") and message["a"]["seed"]:
           seed = True
@@ -125,15 +126,27 @@ class DHTRequestHandler(SocketServer.DatagramRequestHandler):
       version = message["v"]
     except KeyError:
       version = None
+    # The node is added before the callbacks run so that they can find it,
+    # e.g. to record the rtt of a ping.
     try:
       self.server.routingtable.add_node(contact,
-                                        Hash(message["r"]["id"]), version, True)
+                                        intern_hash(message["r"]["id"]),
+                                        version, True)
     except KeyError:
       pass
-    if self.server.callbacks.has_key(message["t"]):
-      while self.server.callbacks[message["t"]]:
-        self.server.callbacks[message["t"]].pop()(message)
-      del self.server.callbacks[message["t"]]
+    callbacks = self.server.transactions.finish(message["t"], contact)
+    if callbacks is None:
+      self.server._log("Unexpected response "+repr(message["t"])+" from "+
+                       str(contact))
+      return
+    for callback in callbacks:
+      # One failing callback mustn't keep the others, e.g. a lookup's, from
+      # hearing about the response.
+      try:
+        callback(message)
+      except Exception:
+        self.server._log("Error handling response from "+str(contact))
+        traceback.print_exc()
 
 class DHTServer(SocketServer.ThreadingUDPServer, gobject.GObject):
   incoming = gobject.property(type=bool, default=False)
@@ -141,51 +154,59 @@ class DHTServer(SocketServer.ThreadingUDPServer, gobject.GObject):
   allow_reuse_address = True
   daemon_threads = True
   def __init__(self, config, id_num, id, bind, serv, conn, torrents,
-               logfunc=None):
+               scheduler, logfunc=None):
     self.logfunc = logfunc
     self._log("Server Starting...")
 
     gobject.GObject.__init__(self)
     SocketServer.UDPServer.__init__(self, bind.get_tuple(), DHTRequestHandler)
-    self.last_tid = 0
     self.addr = serv
     self.bind = bind
-    self.callbacks = {}
     self.config = config
-    self.secrets = [hashlib.sha1(str(random.random())).digest()]
+    self.tokens = TokenManager()
+    self.scheduler = scheduler
     self.conn = conn
     self.torrents = torrents
     self.id = Hash(id)
     self.id_num = id_num
-    self.timeout_id = glib.timeout_add_seconds(REFRESH_CHECK,
-                                               self._send_update)
+    self.krpc = KRPCEncoder(self.id.get_20(), version.four_byte)
+    # The routing table schedules pings as it loads, so everything send_ping
+    # uses has to exist first.
+    self.transactions = TransactionManager(self.scheduler,
+                                           self._query_timed_out)
     self.routingtable = DHTRoutingTable(self, self.conn)
-    self.updatesocket = socket.socket(socket.AF_INET,
-                                      socket.SOCK_DGRAM)
+    self.warm_start_id = None
+    self.rotate_entry = self.scheduler.call_later(self.tokens.interval,
+                                                  self._rotate_tokens)
 
     self._log("Server Started.")
-  def next_tid(self):
-    self.last_tid += 1
-    if (self.last_tid > 0xFFFF):
-      self.last_tid = 0
-    return chr((self.last_tid & 0xFF00) >> 8) + chr(self.last_tid & 0x00FF)
+  def next_tid(self, to):
+    """Returns the transaction id for a query to the address tuple to, or
+    None if the query should be dropped because too many are outstanding."""
+    tid = self.transactions.begin(ContactInfo(*to))
+    if tid is None:
+      self._log("Too many outstanding queries, dropping one to "+str(to))
+    return tid
 
   def send_query(self, to, name, args):
-    query = {"y":"q", "t":self.next_tid(), "q":name, "a":args,
-             "v":version.four_byte}
-    self.send_msg(to, query)
-    return query["t"]
+    tid = self.next_tid(to)
+    if tid is not None:
+      self.send_msg(to, self.krpc.query(tid, name, args))
+    return tid
   def send_response(self, to, tid, args):
-    response = {"y":"r", "t":tid, "r": args, "v":version.four_byte}
-    self.send_msg(to, response)
-    return response["t"]
+    self.send_msg(to, self.krpc.response(tid, args))
+    return tid
   def send_error(self, to, tid, args):
-    error = {"t":"e", "t":tid, "e":args, "v":version.four_byte}
-    self.send_msg(to, error)
-    return error["t"]
-  def send_msg(self, to, msg):
-    self._log("Sending message to "+str(to) +" - "+str(msg))
-    enc_msg = bencode(msg)
+    self.send_msg(to, self.krpc.error(tid, args))
+    return tid
+  def send_ping_response(self, to, tid):
+    self.send_msg(to, self.krpc.ping_response(tid))
+    return tid
+  def send_find_node_response(self, to, tid, nodes):
+    self.send_msg(to, self.krpc.find_node_response(tid, nodes))
+    return tid
+  def send_msg(self, to, enc_msg):
+    self._log("Sending message to "+str(to) +" - "+repr(enc_msg))
     self.routingtable.add_node_sent(ContactInfo(*to))
     try:
       self.socket.sendto(enc_msg, to)
@@ -195,22 +216,21 @@ class DHTServer(SocketServer.ThreadingUDPServer, gobject.GObject):
     if self.logfunc:
       self._log("Message sent to "+str(to))
 
-  def add_callback(self, tid, func):
-    if self.callbacks.has_key(tid):
-      self.callbacks[tid].append(func)
-    else:
-      self.callbacks[tid] = [func]
+  def add_callback(self, tid, func, timed_out=None):
+    self.transactions.add_callback(tid, func, timed_out)
+  def _query_timed_out(self, contact):
+    self.routingtable.add_node_failed(contact)
   def shutdown(self):
     self._log("Server Stopping...")
-    glib.source_remove(self.timeout_id)
+    self.scheduler.cancel(self.rotate_entry)
+    if self.warm_start_id is not None:
+      glib.source_remove(self.warm_start_id)
+      self.warm_start_id = None
     self.routingtable.close()
     self._log("Server Stopped.")
   def add_nodes(self, nodes):
-    while nodes:
-      contact = nodes[0:26]
-      nodes = nodes[26:]
-      self.routingtable.add_node(ContactInfo(contact[20:26]),
-                                 Hash(contact[0:20]))
+    hashes, contacts = compact.parse_nodes(nodes)
+    self.routingtable.add_nodes(hashes, contacts)
   def handle_error(self, request, client_address):
     if self.logfunc:
       self.logfunc("Error with connection from "+str(client_address))
@@ -218,81 +238,128 @@ class DHTServer(SocketServer.ThreadingUDPServer, gobject.GObject):
 
   def send_ping(self, to):
     self._log("Sending ping to "+str(to))
-    result = self.send_query(to, "ping", {"id": self.id.get_20()})
-    self.add_callback(result, self._handle_ping_node)
+    result = self.next_tid(to)
+    if result is None:
+      return None
+    sent = time.time()
+    self.add_callback(result, lambda x: self._handle_ping_node(x, sent))
+    self.send_msg(to, self.krpc.ping_query(result))
     return result
 
-  def _handle_ping_node(self, message):
+  def _handle_ping_node(self, message, sent):
     if (message["y"] == "r"):
-      id = Hash(message["r"]["id"])
+      id = intern_hash(message["r"]["id"])
+      # handle_response has already added the node, so the rtt is kept.
+      self.routingtable.set_node_rtt(id, time.time() - sent)
       self.routingtable._handle_ping_response(id, message)
 
-  def send_find_node(self, to, hash):
+  def warm_start(self, nodes, rate=WARM_START_RATE):
+    """Pings the nodes from a snapshot, rate per second, so that the ones
+    that are still alive are added back to the routing table."""
+    pending = [n.contact.get_tuple()
+               for n in snapshot.sort_for_warm_start(nodes)]
+    if not pending:
+      return
+    pending.reverse()
+    per_tick = max(1, rate * WARM_START_TICK / 1000)
+    self._log("Warm starting from {0} nodes".format(len(pending)))
+    def tick():
+      for i in range(min(per_tick, len(pending))):
+        self.send_ping(pending.pop())
+      if not pending:
+        self.warm_start_id = None
+      return bool(pending)
+    self.warm_start_id = glib.timeout_add(WARM_START_TICK, tick)
+
+  def send_find_node(self, to, hash, callback=None, timed_out=None):
+    """Sends a find_node query. callback and timed_out, if given, are added
+    to the transaction like with add_callback, but before the query is sent,
+    so that they can't miss a fast response."""
     self._log("Sending find_node to "+str(to)+" with hash "+hash)
     tid = Hash(hash)
-    result = self.send_query(to, "find_node", {"id": self.id.get_20(),
-                                               "target": tid.get_20()})
+    result = self.next_tid(to)
+    if result is None:
+      return None
     self.add_callback(result, self._handle_find_node)
+    if callback is not None:
+      self.add_callback(result, callback, timed_out)
+    self.send_msg(to, self.krpc.find_node_query(result, tid.get_20()))
     return result
   def _handle_find_node(self, message):
+    if message["y"] != "r":
+      return
     nodes = message["r"]["nodes"]
     self.add_nodes(nodes)
     id = Hash(message["r"]["id"])
     self.routingtable._handle_find_response(id, message)
 
-  def send_get_peers(self, to, hash, scrape):
+  def send_get_peers(self, to, hash, scrape, callback=None, timed_out=None):
+    """Sends a get_peers query. callback and timed_out are like with
+    send_find_node."""
     self._log("Sending get_peers to "+str(to)+" with hash "+hash)
     hash = Hash(hash)
-    result = self.send_query(to, "get_peers", {"id": self.id.get_20(),
-                                               "info_hash": hash.get_20(),
-                                               "scrape": scrape})
+    result = self.next_tid(to)
+    if result is None:
+      return None
     self.add_callback(result, lambda x: self._handle_get_peers(x, hash))
+    if callback is not None:
+      self.add_callback(result, callback, timed_out)
+    self.send_msg(to, self.krpc.query(result, "get_peers",
+                                      {"info_hash": hash.get_20(),
+                                       "scrape": scrape}))
     return result
   def _handle_get_peers(self, message, hash):
+    if message["y"] != "r":
+      return
     if message["r"].has_key("values"):
-      for n in message["r"]["values"]:
-        self.torrents.add_torrent(ContactInfo(n), hash)
+      peers = compact.parse_values(message["r"]["values"])
+      if peers:
+        self.torrents.add_torrent_peers(hash, peers)
     if message["r"].has_key("nodes"):
       self.add_nodes(message["r"]["nodes"])
-    if message["r"].has_key("BFsp"):
-      self.torrents.add_filter(BloomFilter(message["r"]["BFsp"]), hash, True)
+    if message["r"].has_key("BFsd"):
+      self.torrents.add_filter(BloomFilter(message["r"]["BFsd"]), hash, True)
     if message["r"].has_key("BFpe"):
       self.torrents.add_filter(BloomFilter(message["r"]["BFpe"]), hash, False)
     self.routingtable._handle_get_peers_response(Hash(message["r"]["id"]),
                                                  message)
 
+  def lookup(self, hash, get_peers=False, scrape=False, contacts=(),
+             progress=None, done=None):
+    """Starts an iterative lookup of the nodes closest to hash, from the
+    closest nodes in the routing table and the address tuples in contacts.
+    With get_peers it sends get_peers queries and collects the peers, which
+    are also added to the torrent db. See lookup.Lookup for the callbacks,
+    which run in the server thread. Returns the lookup."""
+    hex = hash.get_hex()
+    def send(contact, callback):
+      timed_out = lambda: callback(None)
+      if get_peers:
+        tid = self.send_get_peers(contact.get_tuple(), hex, scrape, callback,
+                                  timed_out)
+      else:
+        tid = self.send_find_node(contact.get_tuple(), hex, callback,
+                                  timed_out)
+      return tid is not None
+    self._log("Looking up "+hex)
+    return Lookup(hash, send, self.routingtable.get_closest(hash),
+                  [ContactInfo(*c) for c in contacts], progress=progress,
+                  done=done, exclude=self.id).start()
+
   def load_torrent(self, filename):
     f = open(filename, "r")
-    dict = bdecode(f.read())[0]
+    dict = bdecode_strict(f.read())[0]
     if not dict.has_key("nodes"):
       raise ValueError("torrent has no DHT Nodes")
     for n in dict["nodes"]:
       self.send_ping(tuple(n))
 
-  def _update(self):
-    """Actually do an update from within the server thread."""
-    self._log("Updating routing table...")
-    self.routingtable.refresh()
-    self.secrets.insert(0, hashlib.sha1(str(random.random())).digest())
-    while len(self.secrets) > NUM_SECRETS:
-      self.secrets.pop()
-    self._log("Routing table updated.")
-    return True
-
-  def _send_update(self):
-    """Bootstrap an update from the main GUI thread by sending a UDP packet."""
-    self.send_query(self.socket.getsockname(), "refresh",
-                    {"secret": self.secrets[0]})
-    return True
+  def _rotate_tokens(self):
+    """Rotates the token secrets, from the scheduler in the server thread."""
+    self.tokens.rotate()
+    self.rotate_entry = self.scheduler.call_later(self.tokens.interval,
+                                                  self._rotate_tokens)
 
   def _log(self, msg):
     if self.logfunc:
       self.logfunc(msg)
-
-  def check_token(self, contact, token):
-    return any(token == self.get_token(contact, x) for x in self.secrets)
-
-  def get_token(self, contact, secret=None):
-    if secret is None:
-      secret = self.secrets[0]
-    return hashlib.sha1(contact.get_packed()+secret).digest()
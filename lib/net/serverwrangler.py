@@ -23,13 +23,15 @@ import threading
 import random
 
 from ..net.server import DHTServer
-from ..net.torrent import TorrentDB
+from ..net.torrent import TorrentDB, TorrentSweeper
 from ..net.upnp import UPNPManager
+from ..net import snapshot
 from ..util.contactinfo import ContactInfo
 from ..util.sha1hash import Hash
+from ..util.scheduler import Scheduler
 from ..sql.thread import SQLiteThread
-from ..sql.db import CREATE_DB_SCRIPT
-from ..sql import queries
+from ..sql.db import create_db
+from ..sql import queries, statements
 
 class ServerWrangler(gobject.GObject):
   incoming = gobject.property(type=bool, default=False)
@@ -40,6 +42,7 @@ class ServerWrangler(gobject.GObject):
       (gobject.TYPE_PYOBJECT, str))
   }
   timeout = 100
+  max_timers = 64 # per pass of the dispatch loop, so packets are not starved
   def __init__(self, config, logfunc=None):
     gobject.GObject.__init__(self)
 
@@ -49,6 +52,8 @@ class ServerWrangler(gobject.GObject):
     self.servers = []
     self.pending = Queue.Queue()
     self.thread = None
+    # Timed work of the servers, run by the dispatch thread between packets.
+    self.scheduler = Scheduler()
 
     try:
       self.upnp = UPNPManager()
@@ -58,11 +63,36 @@ class ServerWrangler(gobject.GObject):
       self.upnp.connect("port-added", self._port_added)
       self.upnp.connect("add-port-error", self._add_port_error)
 
-    self.conn = SQLiteThread(self.config.get("torrent", "db"))
+    # batch_window is configured in milliseconds
+    self.conn = SQLiteThread(self.config.get("torrent", "db"),
+                             self.config.getint("torrent", "batch_size"),
+                             self.config.getint("torrent", "batch_window") /
+                             1000.0,
+                             self.config.getint("torrent", "readers"))
     self.conn.start()
-    self.conn.executescript(CREATE_DB_SCRIPT)
+    create_db(self.conn)
 
     self.torrents = TorrentDB(self.conn, self._log)
+    self.sweeper = TorrentSweeper(self.torrents,
+                                  self.config.getint("torrent", "peer_ttl"),
+                                  self.config.getint("torrent", "torrent_ttl"),
+                                  self.config.getint("torrent", "sweep_batch"))
+    self.sweeper.start()
+    self.sweep_id = glib.timeout_add_seconds(
+        self.config.getint("torrent", "sweep_interval"), self.sweeper.sweep)
+
+    # Nodes from the last run, by server id, waiting for their server.
+    self.snapshot_path = self.config.get("torrent", "snapshot")
+    self.snapshot = {}
+    self.snapshot_id = None
+    if self.snapshot_path:
+      try:
+        self.snapshot = snapshot.read_snapshot(self.snapshot_path)
+      except (IOError, ValueError) as e:
+        self._log("Could not read snapshot ({0})".format(e))
+      self.snapshot_id = glib.timeout_add_seconds(
+          self.config.getint("torrent", "snapshot_interval"),
+          self.write_snapshot)
 
     servers = queries.get_servers(self.conn)
     for server in servers:
@@ -96,8 +126,13 @@ class ServerWrangler(gobject.GObject):
                       ContactInfo(host_addr, port), upnp)
   def _do_add_server(self, hash, bind, host, id):
     new_server = DHTServer(self.config, id, hash, bind, host,
-                           self.conn, self.torrents, self._log)
+                           self.conn, self.torrents, self.scheduler,
+                           self._log)
     new_server.connect("notify::incoming", self._do_notified)
+    nodes = self.snapshot.pop(str(new_server.id.get_20()), None)
+    if nodes:
+      new_server.warm_start(nodes,
+                            self.config.getint("torrent", "warm_start_rate"))
     self.pending.put(new_server)
     glib.idle_add(self.emit, "server-added", new_server)
   def _do_notified(self, server, value):
@@ -107,6 +142,18 @@ class ServerWrangler(gobject.GObject):
     self._do_add_server(row["hash"], internal, external, row["id"])
   def _add_port_error(self, manager, internal, error):
     glib.idle_add(self.emit, "upnp-error", internal, error)
+  def write_snapshot(self):
+    """Writes the good nodes of every server to the snapshot file, along with
+    the ones from the last run that are still waiting for their server."""
+    servers = [(server.id, server.routingtable.get_snapshot_nodes())
+               for server in list(self.servers)]
+    servers.extend((Hash.from_20(id), nodes)
+                   for id, nodes in self.snapshot.items())
+    try:
+      snapshot.write_snapshot(self.snapshot_path, servers)
+    except (IOError, OSError) as e:
+      self._log("Could not write snapshot ({0})".format(e))
+    return True
   def _log(self, msg):
     if self.logfunc:
       self.logfunc(msg)
@@ -129,9 +176,15 @@ class ServerWrangler(gobject.GObject):
           fd = a.fileno()
           fds[fd] = a
           poll.register(fd, select.POLLIN)
-      result = poll.poll(self.timeout)
+      timeout = self.timeout
+      due = self.scheduler.next_due()
+      if due is not None:
+        timeout = max(0, min(timeout,
+                             int((due - self.scheduler.clock()) * 1000)))
+      result = poll.poll(timeout)
       for (fd, event) in result:
         fds[fd].handle_request()
+      self.scheduler.run_due(limit=self.max_timers)
   def shutdown(self):
     self.running = False
     if self.thread is not None:
@@ -143,4 +196,15 @@ class ServerWrangler(gobject.GObject):
       server.shutdown()
     if self.upnp is not None:
       self.upnp.shutdown()
+    if self.snapshot_id is not None:
+      glib.source_remove(self.snapshot_id)
+      self.write_snapshot()
+    glib.source_remove(self.sweep_id)
+    self.sweeper.stop()
     self.conn.close()
+    transactions, per_transaction = self.conn.get_batch_stats()
+    self._log("Committed {0} write transactions, {1:.1f} statements "
+              "each".format(transactions, per_transaction))
+    for name, calls, seconds in statements.get_stats()[:5]:
+      self._log("Statement {0}: {1} calls, {2:.3f}s".format(name, calls,
+                                                             seconds))
@@ -0,0 +1,108 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Contains the routing table snapshot file format.
+
+A snapshot holds the good nodes of every server, so that a restarted server
+can ping them back into its routing table instead of bootstrapping from
+scratch. The file is the magic string followed by one block per server: the
+20 byte server id and a node count, then for every node its 20 byte id, the
+length of its packed contact and the packed contact, the last time it was
+seen in seconds since the epoch and its round trip time in milliseconds
+(0xFFFF if unknown). All integers are big endian."""
+import collections
+import os
+import struct
+
+from ..util.sha1hash import Hash
+from ..util.contactinfo import ContactInfo
+
+MAGIC = "DHTPSNP1"
+NO_RTT = 0xFFFF
+
+SnapshotNode = collections.namedtuple("SnapshotNode",
+                                      "hash contact last_seen rtt")
+
+_SERVER = struct.Struct(">20sI")
+_NODE = struct.Struct(">20sB")
+_NODE_TAIL = struct.Struct(">IH")
+
+def write_snapshot(path, servers):
+  """Writes a snapshot file.
+
+  servers is a sequence of (server id, nodes) pairs, where the id is a Hash
+  and nodes is a sequence of SnapshotNodes with rtt in seconds or None. The
+  file is written next to path and renamed over it, so a crash never leaves
+  a partial snapshot behind."""
+  parts = [MAGIC]
+  for server_id, nodes in servers:
+    parts.append(_SERVER.pack(str(server_id.get_20()), len(nodes)))
+    for node in nodes:
+      packed = str(node.contact.get_packed())
+      if node.rtt is None:
+        rtt = NO_RTT
+      else:
+        rtt = min(int(node.rtt * 1000), NO_RTT - 1)
+      parts.append(_NODE.pack(str(node.hash.get_20()), len(packed)))
+      parts.append(packed)
+      parts.append(_NODE_TAIL.pack(int(node.last_seen), rtt))
+  tmp = path + ".tmp"
+  with open(tmp, "wb") as f:
+    f.write("".join(parts))
+  os.rename(tmp, path)
+
+def read_snapshot(path):
+  """Reads a snapshot file.
+
+  Returns a dict from 20 byte server id strings to lists of SnapshotNodes.
+  A missing file is an empty snapshot. Raises ValueError if the file is not
+  a valid snapshot."""
+  try:
+    with open(path, "rb") as f:
+      data = f.read()
+  except IOError:
+    if os.path.exists(path):
+      raise
+    return {}
+  if not data.startswith(MAGIC):
+    raise ValueError("Not a DHTPlay snapshot: " + path)
+  servers = {}
+  pos = len(MAGIC)
+  try:
+    while pos < len(data):
+      server_id, count = _SERVER.unpack_from(data, pos)
+      pos += _SERVER.size
+      nodes = servers.setdefault(server_id, [])
+      for i in xrange(count):
+        id, length = _NODE.unpack_from(data, pos)
+        pos += _NODE.size
+        packed = data[pos:pos + length]
+        pos += length
+        last_seen, rtt = _NODE_TAIL.unpack_from(data, pos)
+        pos += _NODE_TAIL.size
+        nodes.append(SnapshotNode(Hash.from_20(id),
+                                  ContactInfo.from_packed(packed), last_seen,
+                                  None if rtt == NO_RTT else rtt / 1000.0))
+  except (struct.error, ValueError) as e:
+    raise ValueError("Truncated or corrupt snapshot {0} ({1})".format(path,
+                                                                      e))
+  return servers
+
+def sort_for_warm_start(nodes):
+  """Orders nodes for pinging: known round trip times first, fastest first,
+  then the most recently seen."""
+  return sorted(nodes, key=lambda n: (n.rtt is None, n.rtt, -n.last_seen))
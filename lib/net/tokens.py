@@ -0,0 +1,67 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Contains the token manager for get_peers and announce_peer."""
+import hashlib
+import hmac
+import os
+
+TOKEN_LENGTH = 8 # bytes
+ROTATE_INTERVAL = 5 * 60 # s
+MAX_CACHED_TOKENS = 4096
+
+class TokenManager(object):
+  """Issues and checks the tokens handed out in get_peers responses.
+
+  A token is a keyed SHA1 of the packed contact (address+port) it was given
+  to, truncated to TOKEN_LENGTH bytes, so nothing has to be stored per token.
+  Two secrets are kept, the current one and the one it replaced. A token is
+  valid for one to two rotation intervals, and checking one takes at most two
+  hash evaluations. Tokens issued under the current secret are cached, so
+  checking a token that was just handed out is a dictionary lookup."""
+  def __init__(self, interval=ROTATE_INTERVAL):
+    self.interval = interval
+    self._secrets = (os.urandom(20), os.urandom(20))
+    self._cache = {}
+  def _make_token(self, secret, packed):
+    return hashlib.sha1(secret + packed).digest()[:TOKEN_LENGTH]
+  def get_token(self, contact):
+    """Returns the token for a contact under the current secret."""
+    secret, cache = self._secrets[0], self._cache
+    packed = str(contact.get_packed())
+    token = cache.get(packed)
+    if token is None:
+      if len(cache) >= MAX_CACHED_TOKENS:
+        cache.clear()
+      token = cache[packed] = self._make_token(secret, packed)
+    return token
+  def check_token(self, contact, token):
+    """Returns whether a token is valid for a contact."""
+    secrets, cache = self._secrets, self._cache
+    token = str(token)
+    packed = str(contact.get_packed())
+    expected = cache.get(packed)
+    if expected is None:
+      expected = self._make_token(secrets[0], packed)
+    if hmac.compare_digest(expected, token):
+      return True
+    return hmac.compare_digest(self._make_token(secrets[1], packed), token)
+  def rotate(self):
+    """Replaces the previous secret with the current one and picks a new
+    current secret. The server calls this every interval seconds."""
+    self._secrets = (os.urandom(20), self._secrets[0])
+    self._cache = {}
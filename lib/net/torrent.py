@@ -17,87 +17,62 @@
 
 import gobject
 import glib
+import threading
+import traceback
+import Queue
 from datetime import datetime
 
-from ..util.bloom import BloomFilter
-from ..sql import queries
+from ..sql import queries, expiry, ingest
+from .notify import Notifier
 
 class TorrentDB(gobject.GObject):
+  """The torrents and peers seen by the servers.
+
+  changed is emitted in the main loop with a notify.Delta of the torrents,
+  peers and peer-torrents that changed, at most every notify.INTERVAL ms."""
   __gsignals__ = {
-    "torrent-added":
-      (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-    "torrent-changed":
-      (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-    "peer-added":
-      (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-    "peer-changed":
-      (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
-    "peer-torrent-added":
-      (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE,
-       (gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT)),
-    "peer-torrent-updated":
-      (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE,
-       (gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT))
+    "changed":
+      (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,))
   }
   def __init__(self, conn, logfunc):
     gobject.GObject.__init__(self)
     self.conn = conn
     self._log = logfunc
+    self.notifier = Notifier(lambda delta: self.emit("changed", delta),
+                             glib.timeout_add)
 
-  def do_torrent_added(self, torrent):
-    self._log("Torrent added to db ({0})".format(torrent))
-
-  def do_peer_added(self, peer):
-    self._log("Peer added to db ({0})".format(peer))
+  def do_changed(self, delta):
+    for torrent in delta.added("torrent"):
+      self._log("Torrent added to db ({0})".format(torrent))
+    for peer in delta.added("peer"):
+      self._log("Peer added to db ({0})".format(peer))
 
   def add_torrent(self, peer, torrent, seed=False):
-    now = datetime.now()
-
-    peer_row = queries.get_peer_by_contact(self.conn, peer)
-    if not peer_row:
-      queries.add_peer(self.conn, peer, now)
-      signal = "peer-added"
-    else:
-      queries.set_peer_updated(self.conn, peer_row["id"], now)
-      signal = "peer-changed"
-
-    peer_row = queries.get_peer_by_contact(self.conn, peer)
-    glib.idle_add(self.emit, signal, peer)
-
-    seed_bloom = BloomFilter()
-    peer_bloom = BloomFilter()
-    if seed:
-      seed_bloom.insert_host(peer)
-    else:
-      peer_bloom.insert_host(peer)
-
-    torrent_row = queries.get_torrent_by_hash(self.conn, torrent)
-    if torrent_row is None:
-      queries.add_torrent(self.conn, torrent, now, seed_bloom, peer_bloom)
-      signal = "torrent-added"
-    else:
-      queries.add_torrent_filters(self.conn, torrent_row["id"], now,
-                                  seed_bloom, peer_bloom)
-      signal = "torrent-changed"
-
-    torrent_row = queries.get_torrent_by_hash(self.conn, torrent)
-    glib.idle_add(self.emit, signal, torrent)
-
-    peer_torrent_row = queries.get_peer_torrent_by_peer_and_torrent(self.conn,
-                                                 peer_row["id"],
-                                                 torrent_row["id"])
-    if peer_torrent_row is None:
-      queries.add_peer_torrent(self.conn, peer_row["id"], torrent_row["id"],
-                               seed, now)
-      signal = "peer-torrent-added"
-    else:
-      queries.set_peer_torrent_updated(self.conn, peer_torrent_row["id"], now)
-      signal = "peer-torrent-updated"
-
-    peer_torrent_row = queries.get_peer_torrent_by_peer_and_torrent(self.conn,
-                                                 peer_row["id"],
-                                                 torrent_row["id"])
-    glib.idle_add(self.emit, signal, peer, torrent)
+    self.add_torrent_peers(torrent, (peer,), seed)
+
+  def add_torrent_peers(self, torrent, peers, seed=False):
+    """Records peers seen for torrent in a single DB transaction and emits the
+    added or changed signals for each of them. See ingest.add_torrent_peers.
+    """
+    result = ingest.add_torrent_peers(self.conn, torrent, peers, seed)
+    note = self.notifier.note
+    for peer in result.peers:
+      note("peer-added" if peer.added else "peer-changed", peer.contact)
+    note("torrent-added" if result.torrent_added else "torrent-changed",
+         torrent)
+    for peer in result.peers:
+      note("peer-torrent-added" if peer.link_added else
+           "peer-torrent-updated", peer.contact, torrent)
+    return result
+
+  def expire(self, peer_ttl, torrent_ttl, batch_size):
+    """Deletes the peers, torrents and peer_torrents rows that have not been
+    updated within their time to live. See expiry.expire."""
+    total = expiry.expire(self.conn, peer_ttl, torrent_ttl, batch_size,
+                          self.notifier.note)
+    if total:
+      self._log("Expired {0} rows from the torrent db".format(total))
+    return total
 
   def close(self):
     pass
@@ -109,16 +84,22 @@ class TorrentDB(gobject.GObject):
   def get_peer_by_id(self, id):
     return queries.get_peer(self.conn, id)
   def get_torrent_rows(self):
-    return queries.get_all_torrents(self.conn)
+    return queries.get_all_torrents(self.conn.readers)
   def get_peer_rows(self):
-    return queries.get_all_peers(self.conn)
+    return queries.get_all_peers(self.conn.readers)
+  def get_top_torrents(self, number):
+    return queries.get_top_torrents(self.conn.readers, number)
+  def get_total_estimates(self):
+    """Returns the estimated number of distinct seeds and peers over all
+    torrents."""
+    return tuple(queries.get_total_estimates(self.conn.readers))
   def get_torrent_peers(self, id, noseed = False):
     if noseed:
-      return queries.get_torrent_peers_noseed(self.conn, id)
+      return queries.get_torrent_peers_noseed(self.conn.readers, id)
     else:
-      return queries.get_torrent_peers(self.conn, id)
+      return queries.get_torrent_peers(self.conn.readers, id)
   def get_peer_torrents(self, id):
-    return queries.get_peer_torrents(self.conn, id)
+    return queries.get_peer_torrents(self.conn.readers, id)
   def add_filter(self, filter, hash, seed):
     now = datetime.now()
     row = self.get_torrent_row(hash)
@@ -130,6 +111,35 @@ class TorrentDB(gobject.GObject):
     else:
       queries.add_torrent_filters(self.conn, row["id"], now, 0, filter)
 
-    glib.idle_add(self.emit, "torrent-changed", hash)
+    self.notifier.note("torrent-changed", hash)
   def get_magnet(self, hash):
     return "magnet:?urn:btih:{0}".format(hash.get_hex())
+
+class TorrentSweeper(threading.Thread):
+  """Runs TorrentDB.expire in the background.
+
+  sweep() only queues a request, so it can be called from a glib timeout, and
+  the thread blocks on its queue between sweeps."""
+  daemon = True
+  def __init__(self, torrents, peer_ttl, torrent_ttl, batch_size):
+    threading.Thread.__init__(self, name="Sweeper")
+    self.torrents = torrents
+    self.peer_ttl = peer_ttl
+    self.torrent_ttl = torrent_ttl
+    self.batch_size = batch_size
+    self.requests = Queue.Queue()
+  def run(self):
+    while self.requests.get() is not None:
+      try:
+        self.torrents.expire(self.peer_ttl, self.torrent_ttl, self.batch_size)
+      except RuntimeError: # sql connection closed
+        return
+      except Exception:
+        traceback.print_exc()
+  def sweep(self):
+    self.requests.put(True)
+    return True
+  def stop(self):
+    """Waits for a running sweep to finish and stops the thread."""
+    self.requests.put(None)
+    self.join()
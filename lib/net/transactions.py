@@ -0,0 +1,111 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Contains the table of queries waiting for a response."""
+import random
+import struct
+import threading
+import traceback
+
+TIMEOUT = 20 # s, for a response to a query
+MAX_TRANSACTIONS = 16384
+
+class Transaction(object):
+  """A query that has been sent and not yet answered. contact is the
+  ContactInfo it was sent to."""
+  __slots__ = ("tid", "contact", "callbacks", "timeouts", "entry")
+  def __init__(self, tid, contact):
+    self.tid = tid
+    self.contact = contact
+    self.callbacks = []
+    self.timeouts = []
+    self.entry = None
+
+class TransactionManager(object):
+  """Hands out transaction ids and matches responses to the queries they
+  answer.
+
+  A transaction id is four bytes, from a counter that starts at a random
+  value, so the ids of live transactions never collide. A response is only
+  matched if it comes from the contact the query was sent to. Every
+  transaction has a deadline on scheduler, and one that passes drops its
+  callbacks and calls timed_out with the contact. At
+  most max_size transactions are kept; past that, begin() returns None and
+  the query should not be sent. All of the methods are thread safe."""
+  def __init__(self, scheduler, timed_out=None, timeout=TIMEOUT,
+               max_size=MAX_TRANSACTIONS):
+    self.scheduler = scheduler
+    self.timeout = timeout
+    self.max_size = max_size
+    self._timed_out = timed_out or (lambda contact: None)
+    self._pending = {}
+    self._next = random.getrandbits(32)
+    self._lock = threading.Lock()
+    self.shed = 0 # queries not sent because the table was full
+    self.expired = 0
+    self.mismatched = 0 # responses from the wrong contact
+  def begin(self, contact):
+    """Returns the transaction id for a query to contact, or None if there
+    are too many outstanding queries."""
+    with self._lock:
+      if len(self._pending) >= self.max_size:
+        self.shed += 1
+        return None
+      tid = struct.pack(">I", self._next)
+      self._next = (self._next + 1) & 0xFFFFFFFF
+      transaction = Transaction(tid, contact)
+      self._pending[tid] = transaction
+      transaction.entry = self.scheduler.call_later(self.timeout,
+                                                    self._expire, transaction)
+    return tid
+  def add_callback(self, tid, func, timed_out=None):
+    """Calls func with the response to the transaction tid, or timed_out
+    with no arguments if there is none in time."""
+    with self._lock:
+      transaction = self._pending.get(tid)
+      if transaction is not None:
+        transaction.callbacks.append(func)
+        if timed_out is not None:
+          transaction.timeouts.append(timed_out)
+  def finish(self, tid, contact):
+    """Ends the transaction tid if contact is the one it was sent to and
+    returns its callbacks, or returns None if there is no such
+    transaction."""
+    with self._lock:
+      transaction = self._pending.get(tid)
+      if transaction is None:
+        return None
+      if transaction.contact != contact:
+        self.mismatched += 1
+        return None
+      del self._pending[tid]
+    self.scheduler.cancel(transaction.entry)
+    return transaction.callbacks
+  def _expire(self, transaction):
+    with self._lock:
+      if self._pending.get(transaction.tid) is not transaction:
+        return
+      del self._pending[transaction.tid]
+      self.expired += 1
+    for timed_out in ([lambda: self._timed_out(transaction.contact)] +
+                      transaction.timeouts):
+      try:
+        timed_out()
+      except Exception:
+        # Report it and carry on, so that the rest are still told.
+        traceback.print_exc()
+  def __len__(self):
+    return len(self._pending)
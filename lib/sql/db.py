@@ -19,7 +19,8 @@
 
 CREATE_DB_SCRIPT = """
 /* This SQL script for SQLite generates the tables for DHTPlay.
- * It depends upon custom types that are registered by the python connection.
+ * It depends upon custom types and functions that are registered by the
+ * python connection.
  * The types are as follows:
  *   * sha1hash corresponds to the Hash class in net.sha1hash. It is stored
  *     as a 20 byte binary BLOB.
@@ -27,6 +28,8 @@ CREATE_DB_SCRIPT = """
  *     It is stored as a 6/20 byte binary BLOB depending on the IP version.
  *   * bloom corresponds to the Bloom class in net.bloom. It is stored as a
  *     256 byte binary BLOB.
+ * The functions are xor, bloom_or, bloom_estimate and the aggregate
+ * bloom_union.
  */
 PRAGMA foreign_keys = on;
 
@@ -50,10 +53,14 @@ CREATE TABLE IF NOT EXISTS buckets (
 
   FOREIGN KEY(server_id) REFERENCES servers(id)
 );
-CREATE INDEX IF NOT EXISTS buckets_server_id ON buckets(server_id);
+CREATE INDEX IF NOT EXISTS buckets_server_range
+  ON buckets(server_id, start, end);
 
+/* server_id duplicates buckets.server_id, so that the per packet lookups
+ * of a node by hash or contact don't have to join through buckets. */
 CREATE TABLE IF NOT EXISTS nodes (
   id INTEGER PRIMARY KEY NOT NULL,
+  server_id INTEGER NOT NULL,
   hash sha1hash NOT NULL,
   contact contactinfo NOT NULL,
   bucket_id INTEGER NOT NULL,
@@ -62,13 +69,15 @@ CREATE TABLE IF NOT EXISTS nodes (
   version BLOB NULL,
   received INTEGER NOT NULL,
   sent INTEGER NOT NULL,
+  rtt REAL NULL,
   created timestamp NOT NULL,
   updated timestamp NOT NULL,
 
+  FOREIGN KEY(server_id) REFERENCES servers(id),
   FOREIGN KEY(bucket_id) REFERENCES buckets(id)
 );
-CREATE INDEX IF NOT EXISTS nodes_hash ON nodes(hash);
-CREATE INDEX IF NOT EXISTS nodes_contact ON nodes(contact);
+CREATE INDEX IF NOT EXISTS nodes_server_hash ON nodes(server_id, hash);
+CREATE INDEX IF NOT EXISTS nodes_server_contact ON nodes(server_id, contact);
 CREATE INDEX IF NOT EXISTS nodes_bucket_id ON nodes(bucket_id);
 
 CREATE TABLE IF NOT EXISTS peers (
@@ -78,6 +87,7 @@ CREATE TABLE IF NOT EXISTS peers (
   updated timestamp NOT NULL
 );
 CREATE UNIQUE INDEX IF NOT EXISTS peers_contact ON peers(contact);
+CREATE INDEX IF NOT EXISTS peers_updated ON peers(updated);
 
 CREATE TABLE IF NOT EXISTS torrents (
   id INTEGER PRIMARY KEY NOT NULL,
@@ -85,9 +95,29 @@ CREATE TABLE IF NOT EXISTS torrents (
   created timestamp NOT NULL,
   updated timestamp NOT NULL,
   seeds bloom NOT NULL,
-  peers bloom NOT NULL
+  peers bloom NOT NULL,
+  seeds_estimate REAL NOT NULL DEFAULT 0,
+  peers_estimate REAL NOT NULL DEFAULT 0
 );
 CREATE UNIQUE INDEX IF NOT EXISTS torrents_hash ON torrents(hash);
+CREATE INDEX IF NOT EXISTS torrents_seeds_estimate ON torrents(seeds_estimate);
+CREATE INDEX IF NOT EXISTS torrents_updated ON torrents(updated);
+
+/* Keep the swarm size estimates in step with the filters, so that torrents
+ * can be ordered by them without decoding every filter. */
+CREATE TRIGGER IF NOT EXISTS torrents_insert_estimate AFTER INSERT ON torrents
+BEGIN
+  UPDATE torrents SET seeds_estimate=bloom_estimate(NEW.seeds),
+                      peers_estimate=bloom_estimate(NEW.peers)
+  WHERE id=NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS torrents_update_estimate
+AFTER UPDATE OF seeds, peers ON torrents
+BEGIN
+  UPDATE torrents SET seeds_estimate=bloom_estimate(NEW.seeds),
+                      peers_estimate=bloom_estimate(NEW.peers)
+  WHERE id=NEW.id;
+END;
 
 CREATE TABLE IF NOT EXISTS peer_torrents (
   id INTEGER PRIMARY KEY NOT NULL,
@@ -100,6 +130,58 @@ CREATE TABLE IF NOT EXISTS peer_torrents (
   FOREIGN KEY(peer_id) REFERENCES peers(id),
   FOREIGN KEY(torrent_id) REFERENCES torrents(id)
 );
-CREATE INDEX IF NOT EXISTS peer_torrents_peer_id ON peer_torrents(peer_id);
+/* Each peer is linked to a torrent once, which the ingest upserts rely on.
+ * Older databases may hold duplicate links from racing inserts; they are
+ * dropped before the index is built. The index also serves lookups by
+ * peer_id. */
+DELETE FROM peer_torrents WHERE id NOT IN
+  (SELECT min(id) FROM peer_torrents GROUP BY peer_id, torrent_id);
+DROP INDEX IF EXISTS peer_torrents_peer_id;
+CREATE UNIQUE INDEX IF NOT EXISTS peer_torrents_peer_torrent
+  ON peer_torrents(peer_id, torrent_id);
 CREATE INDEX IF NOT EXISTS peer_torrents_torrent_id ON peer_torrents(torrent_id);
+CREATE INDEX IF NOT EXISTS peer_torrents_updated ON peer_torrents(updated);
 """
+
+SCHEMA_VERSION = 1
+
+# The columns added to tables since the first release, with the statement
+# that fills them in for existing rows. A column added with ALTER TABLE
+# cannot have a REFERENCES clause and a non-NULL default, so a migrated
+# nodes.server_id has no foreign key.
+_ADDED_COLUMNS = (
+  ("nodes", "server_id", "INTEGER NOT NULL DEFAULT 0",
+   """UPDATE nodes SET server_id=(SELECT server_id FROM buckets
+                                  WHERE buckets.id=nodes.bucket_id)"""),
+  ("nodes", "rtt", "REAL NULL", None),
+  ("torrents", "seeds_estimate", "REAL NOT NULL DEFAULT 0", None),
+  ("torrents", "peers_estimate", "REAL NOT NULL DEFAULT 0",
+   """UPDATE torrents SET seeds_estimate=bloom_estimate(seeds),
+                          peers_estimate=bloom_estimate(peers)"""),
+)
+# Indexes that were replaced by ones over the new columns.
+_DROPPED_INDEXES = ("nodes_hash", "nodes_contact", "buckets_server_id")
+
+def migrate(conn):
+  """Brings the tables of a database written by an older version up to
+  date, so that CREATE_DB_SCRIPT can build its indexes and triggers over the
+  new columns. Tables that do not exist yet are left to the script."""
+  if conn.select_one("PRAGMA user_version")[0] >= SCHEMA_VERSION:
+    return
+  for table, column, definition, backfill in _ADDED_COLUMNS:
+    columns = [row["name"] for row in
+               conn.select("PRAGMA table_info({0})".format(table))]
+    if columns and column not in columns:
+      conn.select("ALTER TABLE {0} ADD COLUMN {1} {2}".format(table, column,
+                                                             definition))
+      if backfill is not None:
+        conn.select(backfill)
+  for index in _DROPPED_INDEXES:
+    conn.select("DROP INDEX IF EXISTS {0}".format(index))
+
+def create_db(conn):
+  """Creates the tables of a new database, or migrates and completes the
+  ones of an existing database, on the SQLiteThread conn."""
+  migrate(conn)
+  conn.executescript(CREATE_DB_SCRIPT)
+  conn.execute("PRAGMA user_version = {0:d}".format(SCHEMA_VERSION))
@@ -0,0 +1,65 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Contains the expiry of old peers, torrents and peer_torrents rows."""
+from datetime import datetime, timedelta
+
+from . import queries
+
+def expire(conn, peer_ttl, torrent_ttl, batch_size, removed=None, now=None):
+  """Deletes rows not updated for longer than their time to live.
+
+  peer_torrents rows and peers expire after peer_ttl seconds and torrents
+  after torrent_ttl seconds, but peers and torrents are kept while a
+  peer_torrents row still refers to them. Rows are deleted batch_size at a
+  time, each batch in a transaction of its own, so a row refreshed after it
+  was read can't be deleted with it. removed, if given, is called with the
+  name of the removal signal and its arguments for every deleted row. The
+  freed pages are returned to the file system afterwards. Returns the number
+  of rows deleted."""
+  if now is None:
+    now = datetime.now()
+  if removed is None:
+    removed = lambda *args: None
+  peer_cutoff = now - timedelta(seconds=peer_ttl)
+  torrent_cutoff = now - timedelta(seconds=torrent_ttl)
+  total = 0
+  for select, delete, cutoff, signal in (
+      (queries.get_expired_peer_torrents, queries.delete_peer_torrent,
+       peer_cutoff, lambda row: ("peer-torrent-removed", row["contact"],
+                                 row["hash"])),
+      (queries.get_expired_peers, queries.delete_peer, peer_cutoff,
+       lambda row: ("peer-removed", row["contact"])),
+      (queries.get_expired_torrents, queries.delete_torrent, torrent_cutoff,
+       lambda row: ("torrent-removed", row["hash"]))):
+    while True:
+      rows = conn.transaction(_expire_batch, select, delete, cutoff,
+                              batch_size)
+      for row in rows:
+        removed(*signal(row))
+      total += len(rows)
+      if len(rows) < batch_size:
+        break
+  if total and conn.is_file:
+    queries.incremental_vacuum(conn)
+  return total
+
+def _expire_batch(tx, select, delete, cutoff, batch_size):
+  rows = select(tx, cutoff, batch_size)
+  for row in rows:
+    delete(tx, row["id"])
+  return rows
@@ -0,0 +1,62 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Contains the ingest of peers seen for a torrent into the torrent db."""
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+
+from . import queries
+from ..util.bloom import BloomFilter
+
+IngestedPeer = namedtuple("IngestedPeer", "contact id added link_added")
+Ingested = namedtuple("Ingested", "torrent_id torrent_added peers")
+
+def add_torrent_peers(conn, hash, contacts, seed=False, now=None):
+  """Records that contacts were seen as peers, or seeds, of the torrent hash.
+
+  The torrent, the peers and the peer_torrents rows linking them are all
+  upserted in one transaction on the DB thread, so a whole get_peers
+  response costs a single round trip. Returns an Ingested with the id of
+  the torrent and whether it was new, and an IngestedPeer for every distinct
+  contact saying whether the peer and its link to the torrent were new."""
+  if now is None:
+    now = datetime.now()
+  contacts = list(OrderedDict.fromkeys(contacts))
+  seed_bloom = BloomFilter()
+  peer_bloom = BloomFilter()
+  (seed_bloom if seed else peer_bloom).insert_hosts(contacts)
+  return conn.transaction(_add_torrent_peers, hash, contacts, seed, now,
+                          seed_bloom, peer_bloom)
+
+def _add_torrent_peers(tx, hash, contacts, seed, now, seed_bloom,
+                       peer_bloom):
+  torrent_row = queries.get_torrent_by_hash(tx, hash)
+  torrent_id = queries.upsert_torrent(tx, hash, now, seed_bloom, peer_bloom)
+  if torrent_row is not None:
+    torrent_id = torrent_row["id"]
+  peers = []
+  for contact in contacts:
+    row = queries.get_peer_by_contact(tx, contact)
+    peer_id = queries.upsert_peer(tx, contact, now)
+    if row is None:
+      link_added = True
+    else:
+      peer_id = row["id"]
+      link_added = queries.get_peer_torrent_by_peer_and_torrent(
+                     tx, peer_id, torrent_id) is None
+    queries.upsert_peer_torrent(tx, peer_id, torrent_id, seed, now)
+    peers.append(IngestedPeer(contact, peer_id, row is None, link_added))
+  return Ingested(torrent_id, torrent_row is None, peers)
@@ -14,181 +14,273 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Contains functions for doing all those pesky SQL queries.
 
-"""Contains functions for doing all those pesky SQL queries."""
+Each statement is declared once in the registry in statements.py, next to the
+function that runs it by name."""
+
+from .statements import statement, ROWS, ONE, SCALAR, LASTROWID, NONE
 
 # DHT Queries (nodes/buckets)
 
+statement("get_num_buckets", SCALAR,
+          "SELECT COUNT(*) FROM buckets WHERE server_id=?")
 def get_num_buckets(conn, id) :
-  r = conn.select_one("""SELECT COUNT(*) FROM buckets
-                         WHERE server_id=?""", (id,))
-  return r[0]
-
-def create_bucket(conn, start, end, time, server_id):
-  return conn.insert("""INSERT INTO buckets(id, start, end, created, updated,
-                        server_id) VALUES(NULL, ?, ?, ?, ?, ?)""",
-                     (start, end, time, time, server_id))
-
-def create_node(conn, hash, contact, bucket, good, pending, version, received,
-                sent, time):
-  return conn.insert("""INSERT INTO nodes(id, hash, contact, bucket_id, good,
-                        pending, version, received, created, updated, sent)
-                        VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                      (hash, contact, bucket, good, pending, version,
-                       received, time, time, sent))
-
+  return conn.call("get_num_buckets", (id,))
+
+# Buckets and nodes are inserted with ids from conn.next_id, so that the
+# routing table never has to wait for the insert.
+
+statement("create_bucket", NONE,
+          """INSERT INTO buckets(id, start, end, created, updated, server_id)
+             VALUES(?, ?, ?, ?, ?, ?)""")
+def create_bucket(conn, id, start, end, time, server_id):
+  conn.call("create_bucket", (id, start, end, time, time, server_id))
+
+statement("create_node", NONE,
+          """INSERT INTO nodes(id, server_id, hash, contact, bucket_id, good,
+             pending, version, received, created, updated, sent)
+             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""")
+def create_node(conn, id, server_id, hash, contact, bucket, good, pending,
+                version, received, sent, time):
+  conn.call("create_node", (id, server_id, hash, contact, bucket, good,
+                            pending, version, received, time, time, sent))
+
+statement("set_bucket_updated", NONE,
+          "UPDATE buckets SET updated=? WHERE id=?")
 def set_bucket_updated(conn, id, time):
-  conn.execute("UPDATE buckets SET updated=? WHERE id=?",
-               (time, id))
+  conn.call("set_bucket_updated", (time, id))
 
+statement("delete_node", NONE, "DELETE FROM nodes WHERE id=?")
 def delete_node(conn, id):
-  conn.execute("DELETE FROM nodes WHERE id=?", (id,))
-
-def get_num_nodes_in_bucket(conn, id):
-  r = conn.select_one("SELECT COUNT(*) FROM nodes WHERE bucket_id=?", (id,))
-  return r[0]
-
-def get_nodes_in_bucket(conn, id):
-  return conn.select("SELECT * FROM nodes WHERE bucket_id=?", (id,))
-
-def get_non_pending_nodes_in_bucket(conn, id):
-  return conn.select("""SELECT * FROM nodes WHERE bucket_id=? AND NOT pending
-                        ORDER BY updated ASC""", (id,))
+  conn.call("delete_node", (id,))
 
+statement("set_bucket_end", NONE,
+          "UPDATE buckets SET end=?, updated=? WHERE id=?")
 def set_bucket_end(conn, id, end, time):
-  conn.execute("UPDATE buckets SET end=?, updated=? WHERE id=?",
-               (end, time, id))
+  conn.call("set_bucket_end", (end, time, id))
 
+statement("set_node_bucket", NONE, "UPDATE nodes SET bucket_id=? WHERE id=?")
 def set_node_bucket(conn, node_id, bucket_id):
-  conn.execute("UPDATE nodes SET bucket_id=? WHERE id=?",
-               (bucket_id, node_id))
-
-def get_node_by_hash(conn, server_id, hash):
-  return conn.select_one("""SELECT nodes.* FROM nodes INNER JOIN buckets ON
-                            nodes.bucket_id=buckets.id WHERE nodes.hash=? AND
-                            buckets.server_id=? LIMIT 1""", (hash, server_id))
-
-def get_node_by_contact(conn, server_id, contact):
-  return conn.select_one("""SELECT nodes.* FROM nodes INNER JOIN buckets ON
-                            nodes.bucket_id=buckets.id WHERE nodes.contact=?
-                            AND buckets.server_id=? LIMIT 1""",
-                         (contact, server_id))
+  conn.call("set_node_bucket", (bucket_id, node_id))
 
+statement("set_node_updated", NONE,
+          """UPDATE nodes SET updated=?, version=?, received=received+?
+             WHERE id=?""")
 def set_node_updated(conn, id, time, version, received):
-  conn.execute("""UPDATE nodes SET updated=?, version=?, received=received+?
-                  WHERE id=?""", (time, version, received, id))
+  conn.call("set_node_updated", (time, version, received, id))
 
+statement("add_node_sent", NONE, "UPDATE nodes SET sent=sent+1 WHERE id=?")
 def add_node_sent(conn, id):
-  conn.execute("UPDATE nodes SET sent=sent+1 WHERE id=?", (id,))
+  conn.call("add_node_sent", (id,))
 
-def get_bucket_for_hash(conn, server_id, hash):
-  return conn.select_one("""SELECT * FROM buckets WHERE start<=? AND end>? AND
-                            server_id=? LIMIT 1""", (hash, hash, server_id))
+statement("set_node_rtt", NONE, "UPDATE nodes SET rtt=? WHERE id=?")
+def set_node_rtt(conn, id, rtt):
+  conn.call("set_node_rtt", (rtt, id))
 
+statement("get_bucket", ONE, "SELECT * FROM buckets WHERE id=? LIMIT 1")
 def get_bucket(conn, id):
-  return conn.select_one("SELECT * FROM buckets WHERE id=? LIMIT 1", (id,))
+  return conn.call("get_bucket", (id,))
 
+statement("get_nodes_in_server", ROWS,
+          "SELECT * FROM nodes WHERE server_id=?")
 def get_nodes_in_server(conn, id):
-  return conn.select("""SELECT nodes.* FROM nodes INNER JOIN buckets ON
-                        buckets.id=nodes.bucket_id WHERE
-                        buckets.server_id=?""", (id,))
+  return conn.call("get_nodes_in_server", (id,))
 
+statement("get_buckets_in_server", ROWS,
+          "SELECT * FROM buckets WHERE server_id=?")
 def get_buckets_in_server(conn, id):
-  return conn.select("SELECT * FROM buckets WHERE server_id=?", (id,))
+  return conn.call("get_buckets_in_server", (id,))
 
-def get_pending_nodes_in_server(conn, id):
-  return conn.select("""SELECT nodes.* FROM nodes INNER JOIN buckets ON
-                        buckets.id=nodes.bucket_id WHERE nodes.pending AND
-                        buckets.server_id=?""", (id,))
+statement("set_node_good", NONE, "UPDATE nodes SET good=? WHERE id=?")
+def set_node_good(conn, id, good):
+  conn.call("set_node_good", (good, id))
 
+statement("set_node_pending", NONE,
+          "UPDATE nodes SET pending=?,updated=? WHERE id=?")
 def set_node_pending(conn, id, pending, time):
-  conn.execute("UPDATE nodes SET pending=?,updated=? WHERE id=?",
-               (pending, time, id))
-
-def get_random_node_in_bucket(conn, id):
-  return conn.select_one("""SELECT * FROM nodes WHERE bucket_id=? AND NOT
-                            pending ORDER BY random() LIMIT 1""", (id,))
+  conn.call("set_node_pending", (pending, time, id))
 
+statement("get_closest_nodes", ROWS,
+          """SELECT * FROM nodes WHERE server_id=?
+             ORDER BY xor(hash, ?) ASC LIMIT ?""")
 def get_closest_nodes(conn, server_id, hash, number):
-  return conn.select("""SELECT nodes.* FROM nodes INNER JOIN buckets ON
-                        buckets.id=nodes.bucket_id WHERE buckets.server_id=?
-                        ORDER BY xor(nodes.hash, ?) ASC LIMIT ?""",
-                     (server_id, hash, number))
+  return conn.call("get_closest_nodes", (server_id, hash, number))
 
 # TORRENT Queries (peers/torrents)
 
+statement("get_peer", ONE, "SELECT * FROM peers WHERE id=? LIMIT 1")
 def get_peer(conn, id):
-  return conn.select_one("SELECT * FROM peers WHERE id=? LIMIT 1", (id,))
+  return conn.call("get_peer", (id,))
 
+statement("get_all_torrents", ROWS, "SELECT * FROM torrents", scan=True)
 def get_all_torrents(conn):
-  return conn.select("SELECT * FROM torrents")
+  return conn.call("get_all_torrents")
 
+statement("get_all_peers", ROWS, "SELECT * FROM peers", scan=True)
 def get_all_peers(conn):
-  return conn.select("SELECT * FROM peers")
+  return conn.call("get_all_peers")
 
+statement("get_peer_by_contact", ONE,
+          "SELECT * FROM peers WHERE contact=? LIMIT 1")
 def get_peer_by_contact(conn, contact):
-  return conn.select_one("SELECT * FROM peers WHERE contact=? LIMIT 1",
-                         (contact,))
+  return conn.call("get_peer_by_contact", (contact,))
 
+statement("add_peer", LASTROWID, "INSERT INTO peers VALUES (NULL, ?, ?, ?)")
 def add_peer(conn, contact, time):
-  return conn.insert("INSERT INTO peers VALUES (NULL, ?, ?, ?)",
-                     (contact, time, time))
+  return conn.call("add_peer", (contact, time, time))
 
+statement("set_peer_updated", NONE, "UPDATE peers SET updated=? WHERE id=?")
 def set_peer_updated(conn, id, time):
-  conn.execute("UPDATE peers SET updated=? WHERE id=?", (time, id))
+  conn.call("set_peer_updated", (time, id))
 
+statement("get_torrent_by_hash", ONE,
+          "SELECT * FROM torrents WHERE hash=? LIMIT 1")
 def get_torrent_by_hash(conn, hash):
-  return conn.select_one("SELECT * FROM torrents WHERE hash=? LIMIT 1",
-                         (hash,))
+  return conn.call("get_torrent_by_hash", (hash,))
 
+statement("add_torrent", LASTROWID,
+          """INSERT INTO torrents(id, hash, created, updated, seeds, peers)
+             VALUES (NULL, ?, ?, ?, ?, ?)""")
 def add_torrent(conn, hash, time, seed_bloom, peer_bloom):
-  return conn.insert("INSERT INTO torrents VALUES (NULL, ?, ?, ?, ?, ?)",
-                     (hash, time, time, seed_bloom, peer_bloom))
+  return conn.call("add_torrent", (hash, time, time, seed_bloom, peer_bloom))
 
+statement("set_torrent_filters", NONE,
+          "UPDATE torrents SET updated=?,seeds=?,peers=? WHERE id=?")
 def set_torrent_filters(conn, id, time, seed_bloom, peer_bloom):
-  conn.execute("UPDATE torrents SET updated=?,seeds=?,peers=? WHERE id=?",
-               (time, seed_bloom, peer_bloom, id))
+  conn.call("set_torrent_filters", (time, seed_bloom, peer_bloom, id))
 
+statement("add_torrent_filters", NONE,
+          """UPDATE torrents SET updated=?,seeds=bloom_or(seeds,?),
+             peers=bloom_or(peers,?) WHERE id=?""")
 def add_torrent_filters(conn, id, time, seed_bloom, peer_bloom):
-  conn.execute("""UPDATE torrents SET updated=?,seeds=seeds|?,peers=peers|?
-                   WHERE id=?""", (time, seed_bloom, peer_bloom, id))
-
+  conn.call("add_torrent_filters", (time, seed_bloom, peer_bloom, id))
+
+statement("get_top_torrents", ROWS,
+          "SELECT * FROM torrents ORDER BY seeds_estimate DESC LIMIT ?",
+          scan=True)
+def get_top_torrents(conn, number):
+  return conn.call("get_top_torrents", (number,))
+
+statement("get_total_estimates", ONE,
+          """SELECT bloom_estimate(bloom_union(seeds)),
+             bloom_estimate(bloom_union(peers)) FROM torrents""", scan=True)
+def get_total_estimates(conn):
+  return conn.call("get_total_estimates")
+
+statement("get_peer_torrent_by_peer_and_torrent", ONE,
+          """SELECT * FROM peer_torrents WHERE peer_id=? AND torrent_id=?
+             LIMIT 1""")
 def get_peer_torrent_by_peer_and_torrent(conn, peer, torrent):
-  return conn.select_one("""SELECT * FROM peer_torrents WHERE peer_id=? AND
-                            torrent_id=? LIMIT 1""", (peer, torrent))
+  return conn.call("get_peer_torrent_by_peer_and_torrent", (peer, torrent))
 
+statement("add_peer_torrent", LASTROWID,
+          "INSERT INTO peer_torrents VALUES(NULL,?,?,?,?,?)")
 def add_peer_torrent(conn, peer, torrent, seed, time):
-  return conn.insert("INSERT INTO peer_torrents VALUES(NULL,?,?,?,?,?)",
-                     (peer, torrent, seed, time, time))
+  return conn.call("add_peer_torrent", (peer, torrent, seed, time, time))
 
+statement("set_peer_torrent_updated", NONE,
+          "UPDATE peer_torrents SET updated=? WHERE id=?")
 def set_peer_torrent_updated(conn, id, time):
-  conn.execute("UPDATE peer_torrents SET updated=? WHERE id=?",
-               (time, id))
-
+  conn.call("set_peer_torrent_updated", (time, id))
+
+# The upserts return the id of the row if it was inserted. After an update the
+# id is left over from an earlier insert and means nothing.
+
+statement("upsert_peer", LASTROWID,
+          """INSERT INTO peers(contact, created, updated) VALUES (?, ?, ?)
+             ON CONFLICT(contact) DO UPDATE SET updated=excluded.updated""")
+def upsert_peer(conn, contact, time):
+  return conn.call("upsert_peer", (contact, time, time))
+
+statement("upsert_torrent", LASTROWID,
+          """INSERT INTO torrents(hash, created, updated, seeds, peers)
+             VALUES (?, ?, ?, ?, ?)
+             ON CONFLICT(hash) DO UPDATE SET updated=excluded.updated,
+               seeds=bloom_or(seeds, excluded.seeds),
+               peers=bloom_or(peers, excluded.peers)""")
+def upsert_torrent(conn, hash, time, seed_bloom, peer_bloom):
+  return conn.call("upsert_torrent",
+                   (hash, time, time, seed_bloom, peer_bloom))
+
+statement("upsert_peer_torrent", LASTROWID,
+          """INSERT INTO peer_torrents(peer_id, torrent_id, seed, created,
+                                       updated) VALUES (?, ?, ?, ?, ?)
+             ON CONFLICT(peer_id, torrent_id)
+             DO UPDATE SET updated=excluded.updated""")
+def upsert_peer_torrent(conn, peer, torrent, seed, time):
+  return conn.call("upsert_peer_torrent", (peer, torrent, seed, time, time))
+
+statement("get_torrent_peers_noseed", ROWS,
+          "SELECT peer_id FROM peer_torrents WHERE torrent_id=? AND NOT seed")
 def get_torrent_peers_noseed(conn, id):
-  return conn.select("""SELECT peer_id FROM peer_torrents 
-                        WHERE torrent_id=? AND NOT seed""", (id,))
+  return conn.call("get_torrent_peers_noseed", (id,))
 
+statement("get_torrent_peers", ROWS,
+          "SELECT peer_id FROM peer_torrents WHERE torrent_id=?")
 def get_torrent_peers(conn, id):
-  return conn.select("SELECT peer_id FROM peer_torrents WHERE torrent_id=?",
-                     (id,))
+  return conn.call("get_torrent_peers", (id,))
 
+statement("get_peer_torrents", ROWS,
+          "SELECT torrent_id FROM peer_torrents WHERE peer_id=?")
 def get_peer_torrents(conn, id):
-  return conn.select("SELECT torrent_id FROM peer_torrents WHERE peer_id=?",
-                     (id,))
+  return conn.call("get_peer_torrents", (id,))
+
+statement("get_expired_peer_torrents", ROWS,
+          """SELECT peer_torrents.id, peers.contact, torrents.hash
+             FROM peer_torrents
+             INNER JOIN peers ON peers.id=peer_torrents.peer_id
+             INNER JOIN torrents ON torrents.id=peer_torrents.torrent_id
+             WHERE peer_torrents.updated<? LIMIT ?""")
+def get_expired_peer_torrents(conn, before, number):
+  return conn.call("get_expired_peer_torrents", (before, number))
+
+statement("delete_peer_torrent", NONE, "DELETE FROM peer_torrents WHERE id=?")
+def delete_peer_torrent(conn, id):
+  conn.call("delete_peer_torrent", (id,))
+
+statement("get_expired_peers", ROWS,
+          """SELECT id, contact FROM peers WHERE updated<? AND NOT EXISTS
+             (SELECT 1 FROM peer_torrents WHERE peer_id=peers.id) LIMIT ?""")
+def get_expired_peers(conn, before, number):
+  return conn.call("get_expired_peers", (before, number))
+
+statement("delete_peer", NONE, "DELETE FROM peers WHERE id=?")
+def delete_peer(conn, id):
+  conn.call("delete_peer", (id,))
+
+statement("get_expired_torrents", ROWS,
+          """SELECT id, hash FROM torrents WHERE updated<? AND NOT EXISTS
+             (SELECT 1 FROM peer_torrents WHERE torrent_id=torrents.id)
+             LIMIT ?""")
+def get_expired_torrents(conn, before, number):
+  return conn.call("get_expired_torrents", (before, number))
+
+statement("delete_torrent", NONE, "DELETE FROM torrents WHERE id=?")
+def delete_torrent(conn, id):
+  conn.call("delete_torrent", (id,))
+
+statement("incremental_vacuum", ROWS, "PRAGMA incremental_vacuum")
+def incremental_vacuum(conn):
+  """Returns the pages freed by deletes to the file system, if the database
+  was created with auto_vacuum=INCREMENTAL."""
+  conn.call("incremental_vacuum")
 
 # SERVER queries
 
+statement("get_servers", ROWS, "SELECT * FROM SERVERS", scan=True)
 def get_servers(conn):
-  return conn.select("SELECT * FROM SERVERS")
+  return conn.call("get_servers")
 
+statement("add_server", LASTROWID,
+          "INSERT INTO servers(hash, bind, host, upnp) VALUES (?, ?, ?, ?)")
 def add_server(conn, hash, bind, host, upnp):
-  return conn.insert("""INSERT INTO servers(hash, bind, host, upnp)
-                        VALUES (?, ?, ?, ?)""",
-                     (hash, bind, host, upnp))
+  return conn.call("add_server", (hash, bind, host, upnp))
 
+statement("get_server_by_hash", ONE, "SELECT * FROM servers WHERE hash=?")
 def get_server_by_hash(conn, hash):
-  return conn.select_one("SELECT * FROM servers WHERE hash=?", (hash,))
+  return conn.call("get_server_by_hash", (hash,))
 
+statement("get_server_by_bind", ONE, "SELECT * FROM servers WHERE bind=?")
 def get_server_by_bind(conn, bind):
-  return conn.select_one("SELECT * FROM servers WHERE bind=?", (bind,))
+  return conn.call("get_server_by_bind", (bind,))
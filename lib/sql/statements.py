@@ -0,0 +1,103 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Contains the registry of named SQL statements.
+
+Statements are declared once with statement() and run by name with the call()
+method of SQLiteThread or ReaderPool, which checks the number of parameters
+and gives back the declared shape of result. Every statement keeps a count of
+its runs and the time spent in them."""
+
+import threading
+
+ROWS = "rows" # a list of rows
+ONE = "one" # the first row, or None
+SCALAR = "scalar" # the first column of the first row, or None
+LASTROWID = "lastrowid" # the rowid of the inserted row
+NONE = "none" # nothing, it is run as a fire and forget write
+
+SHAPES = (ROWS, ONE, SCALAR, LASTROWID, NONE)
+
+STATEMENTS = {}
+
+_stats_lock = threading.Lock()
+
+class Statement(object):
+  """A named SQL statement with a fixed number of parameters."""
+  __slots__ = ("name", "shape", "sql", "arity", "scan", "calls", "seconds")
+  def __init__(self, name, shape, sql, scan=False):
+    if shape not in SHAPES:
+      raise ValueError("Unknown result shape " + repr(shape))
+    self.name = name
+    self.shape = shape
+    self.sql = sql
+    self.arity = sql.count("?")
+    self.scan = scan # whether it is expected to read a whole table
+    self.calls = 0
+    self.seconds = 0.0
+  def check(self, params):
+    if len(params) != self.arity:
+      raise ValueError("Statement {0} takes {1} parameters ({2} given)".format(
+                       self.name, self.arity, len(params)))
+  def record(self, calls, seconds):
+    with _stats_lock:
+      self.calls += calls
+      self.seconds += seconds
+  def shape_result(self, rows, lastrowid):
+    if self.shape == ROWS:
+      return rows
+    elif self.shape == LASTROWID:
+      return lastrowid
+    elif not rows:
+      return None
+    elif self.shape == ONE:
+      return rows[0]
+    elif self.shape == SCALAR:
+      return rows[0][0]
+  def __repr__(self):
+    return "Statement({0!r}, {1!r})".format(self.name, self.shape)
+
+def statement(name, shape, sql, scan=False):
+  """Declares a statement and returns it.
+
+  scan marks statements that are meant to read a whole table, which the
+  query plan tests would otherwise reject."""
+  if name in STATEMENTS:
+    raise ValueError("Statement {0} is already declared".format(name))
+  stmt = STATEMENTS[name] = Statement(name, shape, sql, scan)
+  return stmt
+
+def get_statement(name):
+  try:
+    return STATEMENTS[name]
+  except KeyError:
+    raise ValueError("Unknown statement " + repr(name))
+
+def get_stats():
+  """Returns (name, calls, seconds) for every statement that has run, the
+  most time consuming first."""
+  with _stats_lock:
+    stats = [(s.name, s.calls, s.seconds) for s in STATEMENTS.itervalues()
+             if s.calls]
+  stats.sort(key=lambda s: s[2], reverse=True)
+  return stats
+
+def reset_stats():
+  with _stats_lock:
+    for s in STATEMENTS.itervalues():
+      s.calls = 0
+      s.seconds = 0.0
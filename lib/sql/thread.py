@@ -15,99 +15,448 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import itertools
 import sqlite3
+import sys
 import threading
+import time
+import traceback
 import Queue
 
-from ..util.sha1hash import Hash
-from ..util.bloom import BloomFilter
+from ..util.sha1hash import intern_hash
+from ..util.bloom import BloomFilter, BloomUnion, bloom_or, bloom_estimate
 from ..util.contactinfo import ContactInfo
+from .statements import Statement, get_statement, NONE, LASTROWID
+
+CACHED_STATEMENTS = 256 # well above the number of registered statements
+
+def _xor(op1, op2):
+  result = ""
+  for i in range(min(len(op1), len(op2))):
+    result += chr(ord(op1[i]) ^ ord(op2[i]))
+  return buffer(result)
+
+def _connect(db, check_same_thread):
+  """Opens a connection with the converters, functions and row factory that
+  every query expects."""
+  sqlite3.register_converter("contactinfo", ContactInfo)
+  sqlite3.register_converter("sha1hash", intern_hash)
+  sqlite3.register_converter("bloom", BloomFilter)
+
+  conn = sqlite3.connect(db,
+                      detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES,
+                      check_same_thread=check_same_thread,
+                      cached_statements=CACHED_STATEMENTS)
+  conn.isolation_level = None # transactions are opened explicitly
+  conn.create_function("xor", 2, _xor)
+  conn.create_function("bloom_or", 2, bloom_or)
+  conn.create_function("bloom_estimate", 1, bloom_estimate)
+  conn.create_aggregate("bloom_union", 1, BloomUnion)
+  conn.row_factory = sqlite3.Row
+  return conn
+
+def _is_file(db):
+  return db not in ("", ":memory:") and not db.startswith("file::memory:")
+
+class _Future(object):
+  """The result of a single synchronous call, filled in by the DB thread.
+
+  A lock that starts out held is cheaper to wait on than an Event, which is
+  built on a Condition."""
+  __slots__ = ("_done", "rows", "lastrowid", "error")
+  def __init__(self):
+    self._done = threading.Lock()
+    self._done.acquire()
+    self.rows = None
+    self.lastrowid = None
+    self.error = None
+  def set_result(self, rows, lastrowid):
+    self.rows = rows
+    self.lastrowid = lastrowid
+    self._done.release()
+  def set_error(self, error):
+    self.error = error
+    self._done.release()
+  def wait(self):
+    """Blocks until the statement has run and raises its error, if any."""
+    self._done.acquire()
+    if self.error is not None:
+      raise self.error
+    return self
+
+class _Transaction(object):
+  """Runs registry statements straight on the DB thread's cursor, for the
+  functions passed to SQLiteThread.transaction()."""
+  __slots__ = ("_cursor",)
+  def __init__(self, cursor):
+    self._cursor = cursor
+  def call(self, name, params=()):
+    stmt = get_statement(name)
+    stmt.check(params)
+    start = time.time()
+    self._cursor.execute(stmt.sql, params)
+    rows = self._cursor.fetchall()
+    stmt.record(1, time.time() - start)
+    return stmt.shape_result(rows, self._cursor.lastrowid)
 
 class SQLiteThread(threading.Thread):
   """This is a class for sharing a SQLite connection between threads by using
-  a queue system."""
-  _SCRIPT = -2
-  _NO_RESULT = -1
+  a queue system.
+
+  Every synchronous call gets its own _Future which the DB thread completes
+  directly, so concurrent callers never see each other's results.
+
+  Statements from the registry in statements.py are run by name with call(),
+  which also records how often each one runs and how long it takes.
+
+  Fire and forget writes are committed in groups: a transaction is opened by
+  the first one and committed after batch_size writes or batch_window
+  seconds, whichever comes first. Runs of the same statement are sent through
+  executemany. batch_window is in seconds. Reads on this connection always
+  see the open transaction; flush() commits it for anyone else. Work that
+  needs several statements to see each other's results can be handed to
+  transaction() and runs on the DB thread in one go.
+
+  A file backed database is switched to WAL mode with incremental auto
+  vacuum, and readers holds a ReaderPool for reads that can make do with the
+  last committed state and should not wait behind the write queue. For other
+  databases readers is this object."""
+  _SCRIPT = 0
+  _EXECUTE = 1 # fire and forget
+  _QUERY = 2 # completes a _Future
+  _ASYNC = 3 # calls a callback with the rows
+  _FLUSH = 4 # commits, then completes a _Future
+  _TRANSACTION = 5 # runs a function in its own transaction
+  _STOP = ("stop",) # sentinel put on the queue by close()
+  _ERRORS = (sqlite3.OperationalError, sqlite3.ProgrammingError, ValueError,
+             sqlite3.InterfaceError, sqlite3.IntegrityError)
   daemon = True
-  def __init__(self, db):
+  def __init__(self, db, batch_size=1, batch_window=0, readers=2):
     threading.Thread.__init__(self)
     self.stmts = Queue.Queue()
-    self.results = Queue.Queue()
-    self.last_id = 0
-    self.id_lock = threading.Lock()
     self.db = db
+    self.is_file = _is_file(db)
+    if self.is_file and readers > 0:
+      self.readers = ReaderPool(db, readers)
+    else:
+      self.readers = self # an in memory database can't be shared
+    self.batch_size = max(batch_size, 1)
+    self.batch_window = batch_window
+    self.transactions = 0 # committed write transactions
+    self.batched = 0 # fire and forget writes in those transactions
+    self._count = 0 # writes in the open transaction
+    self._deadline = None # commit time of the open transaction, if any
     self._stopped = False
+    self._ids = {} # row id counters by table, see next_id
+    self._ids_lock = threading.Lock()
   def run(self):
-    sqlite3.register_converter("contactinfo", ContactInfo)
-    sqlite3.register_converter("sha1hash", Hash)
-    sqlite3.register_converter("bloom", BloomFilter)
-
-    conn = sqlite3.connect(self.db,
-                        detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES,
-                        check_same_thread=True)
-    conn.create_function("xor", 2, self._xor)
-    conn.row_factory = sqlite3.Row
+    conn = _connect(self.db, True)
+    if self.is_file:
+      # auto_vacuum only takes effect on a new database, and only if it is
+      # set before the switch to WAL.
+      conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+      conn.execute("PRAGMA journal_mode=WAL")
+      conn.execute("PRAGMA synchronous=NORMAL")
     cursor = conn.cursor()
+    stmts = self.stmts
+    pending = None
     while 1:
-      try:
-        stmt = self.stmts.get(False)
-      except Queue.Empty:
-        if self._stopped:
-          conn.commit()
-          conn.close()
-          return
-        else:
+      if self._deadline is not None and time.time() >= self._deadline:
+        self._commit(cursor)
+      if pending is not None:
+        stmt, pending = pending, None
+      elif self._deadline is None:
+        # Block without a timeout; Queue.get with a timeout polls in Python 2,
+        # so it is only used while a transaction is waiting to be committed.
+        stmt = stmts.get()
+      else:
+        try:
+          stmt = stmts.get(True, max(self._deadline - time.time(), 0))
+        except Queue.Empty:
+          self._commit(cursor)
           continue
+      if stmt is self._STOP:
+        self._commit(cursor)
+        conn.close()
+        return
+      kind, sql, params, target = stmt
+      named = None
+      if sql.__class__ is Statement:
+        named, sql = sql, sql.sql
+      if kind == self._EXECUTE:
+        batch = [params]
+        while params is not None and len(batch) < self.batch_size:
+          try:
+            pending = stmts.get(False)
+          except Queue.Empty:
+            break
+          if (pending is self._STOP or pending[0] != self._EXECUTE or
+              pending[1] != stmt[1] or pending[2] is None):
+            break
+          batch.append(pending[2])
+          pending = None
+        self._write(cursor, sql, batch, named)
+        continue
+      start = time.time()
       try:
-        if stmt[0] == self._SCRIPT:
-          cursor.executescript(stmt[1])
-        elif stmt[2] is not None:
-          cursor.execute(stmt[1], stmt[2])
+        if kind == self._TRANSACTION:
+          target.set_result(self._transaction(cursor, sql, params), None)
+          continue
+        elif kind == self._SCRIPT:
+          self._commit(cursor)
+          cursor.executescript(sql)
+        elif kind == self._FLUSH:
+          self._commit(cursor)
+        elif params is not None:
+          cursor.execute(sql, params)
+        else:
+          cursor.execute(sql)
+        if kind == self._QUERY or kind == self._FLUSH:
+          rows = cursor.fetchall()
+          if named is not None:
+            named.record(1, time.time() - start)
+          target.set_result(rows, cursor.lastrowid)
+        elif kind == self._ASYNC:
+          rows = cursor.fetchall()
+          if named is not None:
+            named.record(1, time.time() - start)
+          target(rows)
+      except self._ERRORS as e:
+        error = ValueError("Invalid SQL Statement - {0} ({1})".format(
+                           (sql, params), e))
+        if kind in (self._QUERY, self._FLUSH, self._TRANSACTION):
+          target.set_error(error)
         else:
-          cursor.execute(stmt[1])
-      except (sqlite3.OperationalError, sqlite3.ProgrammingError,
-              ValueError, sqlite3.InterfaceError, sqlite3.IntegrityError) as e:
-        raise ValueError("Invalid SQL Statement - {0} ({1})".format(stmt, e))
-      if stmt[0] >= 0:
-        self.results.put((stmt[0], cursor.fetchall(), cursor.lastrowid))
+          # Nobody is waiting for this one, so report it and carry on.
+          traceback.print_exc()
+      except Exception as e:
+        if kind in (self._QUERY, self._FLUSH, self._TRANSACTION):
+          target.set_error(e)
+        else:
+          traceback.print_exc()
+  def _write(self, cursor, sql, batch, named):
+    """Runs a fire and forget write, or a run of them, in the open
+    transaction. If the transaction itself fails, it is rolled back and
+    reported, and the thread carries on with the next statement."""
+    start = time.time()
+    try:
+      if self._deadline is None:
+        cursor.execute("BEGIN")
+        self._deadline = time.time() + self.batch_window
+      if len(batch) > 1:
+        cursor.execute("SAVEPOINT batch")
+        try:
+          cursor.executemany(sql, batch)
+        except Exception:
+          # executemany stops at the first bad row, so undo the rows it got
+          # through and run them one at a time to keep all the good ones.
+          cursor.execute("ROLLBACK TO batch")
+          for params in batch:
+            self._write_one(cursor, sql, params)
+        cursor.execute("RELEASE batch")
+      else:
+        self._write_one(cursor, sql, batch[0])
+    except Exception:
+      traceback.print_exc()
+      sys.stderr.write("Write transaction failed, rolled back: {0}\n".format(
+                       (sql, len(batch))))
+      self._rollback(cursor)
+      return
+    if named is not None:
+      named.record(len(batch), time.time() - start)
+    self._count += len(batch)
+    if self._count >= self.batch_size or time.time() >= self._deadline:
+      self._commit(cursor)
+  def _write_one(self, cursor, sql, params):
+    try:
+      if params is not None:
+        cursor.execute(sql, params)
+      else:
+        cursor.execute(sql)
+    except Exception:
+      # Nobody is waiting for this one, so report it and carry on.
+      traceback.print_exc()
+      sys.stderr.write("Write failed: {0}\n".format((sql, params)))
+  def _transaction(self, cursor, func, args):
+    """Commits the open transaction, then runs func in one of its own and
+    returns its result. Nothing func did is kept if it raises."""
+    self._commit(cursor)
+    cursor.execute("BEGIN")
+    try:
+      result = func(_Transaction(cursor), *args)
+      cursor.execute("COMMIT")
+    except Exception:
+      self._rollback(cursor)
+      raise
+    self.transactions += 1
+    return result
+  def _commit(self, cursor):
+    if self._deadline is None:
+      return
+    try:
+      cursor.execute("COMMIT")
+    except Exception:
+      # A failed COMMIT can leave the transaction open, and the next BEGIN
+      # would fail with it.
+      traceback.print_exc()
+      self._rollback(cursor)
+      return
+    self._deadline = None
+    self.transactions += 1
+    self.batched += self._count
+    self._count = 0
+  def _rollback(self, cursor):
+    """Rolls back the open transaction, if there still is one, and forgets
+    the writes batched into it."""
+    self._deadline = None
+    self._count = 0
+    try:
+      cursor.execute("ROLLBACK")
+    except sqlite3.Error:
+      pass # some errors roll back on their own
+  def get_batch_stats(self):
+    """Returns the number of write transactions committed so far and the mean
+    number of fire and forget writes in each."""
+    if self.transactions == 0:
+      return 0, 0.0
+    return self.transactions, float(self.batched) / self.transactions
   def execute(self, stmt, params=None):
-    self._execute(self._NO_RESULT, stmt, params)
+    self._execute(self._EXECUTE, stmt, params, None)
   def executescript(self, stmt):
-    self._execute(self._SCRIPT, stmt, None)
-  def _execute(self, id, stmt, params):
+    self._execute(self._SCRIPT, stmt, None, None)
+  def _execute(self, kind, stmt, params, target):
     if self._stopped:
       raise RuntimeError("Connection closed.")
-    self.stmts.put((id, stmt, params))
-  def _get_id(self):
-    with self.id_lock:
-      self.last_id += 1
-      return self.last_id
+    self.stmts.put((kind, stmt, params, target))
+  def _call(self, stmt, params):
+    future = _Future()
+    self._execute(self._QUERY, stmt, params, future)
+    return future.wait()
+  def call(self, name, params=()):
+    """Runs a statement from the registry by name.
+
+    Statements of shape NONE are queued as fire and forget writes, the rest
+    wait for their result."""
+    stmt = get_statement(name)
+    stmt.check(params)
+    if stmt.shape == NONE:
+      self._execute(self._EXECUTE, stmt, params, None)
+      return None
+    result = self._call(stmt, params)
+    return stmt.shape_result(result.rows, result.lastrowid)
   def select(self, stmt, params=None):
-    id = self._get_id()
-    self._execute(id, stmt, params)
-    return self._wait_for_result(id)[1]
+    return self._call(stmt, params).rows
   def select_one(self, stmt, params=None):
     rows = self.select(stmt, params)
     if len(rows):
       return rows[0]
     else:
       return None
+  def select_async(self, stmt, params=None, callback=None):
+    """Runs a select without waiting for it.
+
+    callback is called with the list of rows on the DB thread, so it should
+    be quick and must not make synchronous calls on this connection. GTK code
+    should hand the rows over with gobject.idle_add."""
+    self._execute(self._ASYNC, stmt, params, callback or (lambda rows: None))
   def insert(self, stmt, params=None):
-    id = self._get_id()
-    self._execute(id, stmt, params)
-    return self._wait_for_result(id)[2]
-  def _wait_for_result(self, id):
-    while True:
-      res = self.results.get(True, None) # block forever
-      if res[0] != id:
-        self.results.put(res) # oops
-      else:
-        return res
+    return self._call(stmt, params).lastrowid
+  def transaction(self, func, *args):
+    """Runs func(tx, *args) on the DB thread in a single transaction and
+    returns its result.
+
+    tx has the same call() as this object, but runs every statement right
+    away, so func can use the functions in queries.py and read its own
+    writes without a round trip through the queue. It is rolled back if func
+    raises."""
+    future = _Future()
+    self._execute(self._TRANSACTION, func, args, future)
+    return future.wait().rows
+  def next_id(self, table):
+    """Returns a new row id for table, so that rows can be inserted with fire
+    and forget writes and still be referred to right away.
+
+    The ids count up from the largest one in the table when this is first
+    called for it, so every insert into the table has to take its id from
+    here."""
+    with self._ids_lock:
+      ids = self._ids.get(table)
+      if ids is None:
+        last = self.select_one("SELECT max(id) FROM " + table)[0]
+        ids = self._ids[table] = itertools.count((last or 0) + 1)
+      return next(ids)
+  def flush(self):
+    """Blocks until everything queued so far has run and been committed."""
+    future = _Future()
+    self._execute(self._FLUSH, None, None, future)
+    future.wait()
   def close(self):
+    """Runs any queued statements, then commits and closes the connection."""
     self._stopped = True
+    self.stmts.put(self._STOP)
     self.join()
-  def _xor(self, op1, op2):
-    result = ""
-    for i in range(min(len(op1), len(op2))):
-      result += chr(ord(op1[i]) ^ ord(op2[i]))
-    return buffer(result)
+    if self.readers is not self:
+      self.readers.close()
+
+class ReaderPool(object):
+  """A pool of read only connections to a WAL mode database.
+
+  Reads through the pool run on the calling thread, alongside the writer and
+  each other, and see the last committed state, so writes still waiting in
+  the SQLiteThread queue or its open transaction are not visible. It has the
+  same select() and select_one() as SQLiteThread."""
+  def __init__(self, db, size):
+    self.db = db
+    self.size = size
+    self._idle = Queue.LifoQueue()
+    self._conns = []
+    self._lock = threading.Lock()
+    self._closed = False
+  def _get_conn(self):
+    try:
+      return self._idle.get(False)
+    except Queue.Empty:
+      pass
+    with self._lock:
+      if len(self._conns) < self.size:
+        conn = _connect(self.db, False)
+        conn.execute("PRAGMA query_only=1")
+        self._conns.append(conn)
+        return conn
+    return self._idle.get()
+  def call(self, name, params=()):
+    """Runs a read only statement from the registry by name."""
+    stmt = get_statement(name)
+    stmt.check(params)
+    if stmt.shape in (NONE, LASTROWID):
+      raise ValueError("Statement {0} is not read only".format(name))
+    start = time.time()
+    rows = self.select(stmt.sql, params)
+    stmt.record(1, time.time() - start)
+    return stmt.shape_result(rows, None)
+  def select(self, stmt, params=None):
+    if self._closed:
+      raise RuntimeError("Connection closed.")
+    conn = self._get_conn()
+    try:
+      if params is not None:
+        return conn.execute(stmt, params).fetchall()
+      else:
+        return conn.execute(stmt).fetchall()
+    except SQLiteThread._ERRORS as e:
+      raise ValueError("Invalid SQL Statement - {0} ({1})".format(
+                       (stmt, params), e))
+    finally:
+      self._idle.put(conn)
+  def select_one(self, stmt, params=None):
+    rows = self.select(stmt, params)
+    if len(rows):
+      return rows[0]
+    else:
+      return None
+  def close(self):
+    self._closed = True
+    with self._lock:
+      for conn in self._conns:
+        conn.close()
+      self._conns = []
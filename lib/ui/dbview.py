@@ -21,6 +21,7 @@ import time
 import urllib
 
 from ..util.sha1hash import Hash
+from ..util.contactinfo import ContactInfo
 
 class BaseDBView(gtk.ScrolledWindow):
   """Base class for convenient database views."""
@@ -88,9 +89,25 @@ class BaseDBView(gtk.ScrolledWindow):
            self._data.get_value(iter, col) != value):
       iter = self._data.iter_next(iter)
     return iter
+  def _find_rows(self, col, values):
+    """Returns a dict of the iters of the rows whose col is in values, found
+    in one pass over the store."""
+    rows = {}
+    if not values:
+      return rows
+    iter = self._data.get_iter_first()
+    while iter is not None:
+      value = self._data.get_value(iter, col)
+      if value in values:
+        rows[value] = iter
+      iter = self._data.iter_next(iter)
+    return rows
 
 class DBView(BaseDBView):
-  """Base class for database views that mirror the data."""
+  """Base class for database views that mirror the data.
+
+  signals maps the signals of the bound object to their handlers, which for
+  the routing table and torrent db is changed, with a notify.Delta."""
   def __init__(self, schema, cols, signals):
     BaseDBView.__init__(self, schema, cols)
     self._signals = signals
@@ -163,21 +180,19 @@ class BucketView(DBView):
     ("Last Changed", 4, 5),
   )
   def __init__(self, routingtable=None):
-    signals = {
-      "bucket-split": self._do_bucket_split,
-      "bucket-changed": self._do_bucket_changed
-    }
+    signals = {"changed": self._do_changed}
     DBView.__init__(self, self.schema, self.cols, signals)
     if routingtable is not None:
       self.bind_to(routingtable)
   def _hard_update(self):
     for bucket in self._db.get_bucket_rows():
       self._add_bucket_row(bucket)
-  def _do_bucket_split(self, router, bucket1, bucket2):
-    self._add_bucket_row(router.get_bucket_row(bucket2))
-    self._update_bucket_row(router.get_bucket_row(bucket1))
-  def _do_bucket_changed(self, router, bucket):
-    self._update_bucket_row(router.get_bucket_row(bucket))
+  def _do_changed(self, router, delta):
+    for id in delta.added("bucket"):
+      self._add_bucket_row(router.get_bucket_row(id))
+    rows = self._find_rows(0, delta.changed("bucket"))
+    for id, iter in rows.iteritems():
+      self._update_bucket_row(router.get_bucket_row(id), iter)
   def _add_bucket_row(self, row):
     self._data.append((row["id"],
                        row["start"].get_pow(),
@@ -185,14 +200,12 @@ class BucketView(DBView):
                        0,
                        row["updated"].ctime(),
                        time.mktime(row["updated"].timetuple())))
-  def _update_bucket_row(self, row):
-    iter = self._find_row(0, row["id"])
-    if iter is not None:
-      self._data.set(iter, 0, row["id"],
-                     1, row["start"].get_pow(),
-                     2, row["end"].get_pow(),
-                     4, row["updated"].ctime(),
-                     5, time.mktime(row["updated"].timetuple()))
+  def _update_bucket_row(self, row, iter):
+    self._data.set(iter, 0, row["id"],
+                   1, row["start"].get_pow(),
+                   2, row["end"].get_pow(),
+                   4, row["updated"].ctime(),
+                   5, time.mktime(row["updated"].timetuple()))
   def _mod_bucket_row(self, id, amt):
     iter = self._find_row(0, id)
     if iter is not None:
@@ -212,11 +225,7 @@ class NodeView(DBView):
     ("Last Good", 4, 5),
   )
   def __init__(self, bucketview, routingtable=None):
-    signals = {
-      "node-added": self._do_node_added,
-      "node-removed": self._do_node_removed,
-      "node-changed": self._do_node_changed
-    }
+    signals = {"changed": self._do_changed}
 
     DBView.__init__(self, self.schema, self.cols, signals)
 
@@ -239,34 +248,40 @@ class NodeView(DBView):
                        row["received"]))
     if not row["pending"]:
       self.bucketview._mod_bucket_row(row["bucket_id"], +1)
-  def _update_node_row(self, row):
-    iter = self._find_row(3, Hash(row["hash"]).get_hex())
-    if iter is not None:
-      if not self._data.get_value(iter, 6):
-        self.bucketview._mod_bucket_row(self._data.get_value(iter, 0), -1)
-      version = row["version"]
-      if version is not None:
-        version = urllib.quote(str(version))
-      self._data.set(iter, 0, row["bucket_id"],
-                     1, row["contact"].host, 2, row["contact"].port,
-                     3, row["hash"].get_hex(),
-                     4, row["updated"].ctime(),
-                     5, time.mktime(row["updated"].timetuple()),
-                     6, row["pending"], 7, version,
-                     8, row["sent"], 9, row["received"])
-      if not row["pending"]:
-        self.bucketview._mod_bucket_row(row["bucket_id"], +1)
-  def _remove_node_row(self, hash):
-    iter = self._find_row(3, Hash(hash).get_hex())
-    if iter is not None:
+  def _update_node_row(self, row, iter):
+    if not self._data.get_value(iter, 6):
       self.bucketview._mod_bucket_row(self._data.get_value(iter, 0), -1)
-      self._data.remove(iter)
-  def _do_node_added(self, router, hash):
-    self._add_node_row(router.get_node_row(hash))
-  def _do_node_removed(self, router, hash):
-    self._remove_node_row(hash)
-  def _do_node_changed(self, router, hash):
-    self._update_node_row(router.get_node_row(hash))
+    version = row["version"]
+    if version is not None:
+      version = urllib.quote(str(version))
+    self._data.set(iter, 0, row["bucket_id"],
+                   1, row["contact"].host, 2, row["contact"].port,
+                   3, row["hash"].get_hex(),
+                   4, row["updated"].ctime(),
+                   5, time.mktime(row["updated"].timetuple()),
+                   6, row["pending"], 7, version,
+                   8, row["sent"], 9, row["received"])
+    if not row["pending"]:
+      self.bucketview._mod_bucket_row(row["bucket_id"], +1)
+  def _remove_node_row(self, iter):
+    if not self._data.get_value(iter, 6):
+      self.bucketview._mod_bucket_row(self._data.get_value(iter, 0), -1)
+    self._data.remove(iter)
+  def _do_changed(self, router, delta):
+    removed = set(hash.get_hex() for hash in delta.removed("node"))
+    changed = dict((hash.get_hex(), hash) for hash in delta.changed("node"))
+    rows = self._find_rows(3, removed.union(changed))
+    for hex, iter in rows.iteritems():
+      if hex in removed:
+        self._remove_node_row(iter)
+      else:
+        row = router.get_node_row(changed[hex])
+        if row is not None:
+          self._update_node_row(row, iter)
+    for hash in delta.added("node"):
+      row = router.get_node_row(hash)
+      if row is not None:
+        self._add_node_row(row)
 
 class TorrentView(DBView):
   schema = (int, str, str, float, float, float)
@@ -278,10 +293,7 @@ class TorrentView(DBView):
     ("Updated", 2, 3)
   )
   def __init__(self, db = None):
-    signals = {
-      "torrent-added": self._do_torrent_added,
-      "torrent-changed": self._do_torrent_changed
-    }
+    signals = {"changed": self._do_changed}
     DBView.__init__(self, self.schema, self.cols, signals)
     if db is not None:
       self.bind_to(db)
@@ -292,20 +304,29 @@ class TorrentView(DBView):
     self._data.append((row["id"], row["hash"].get_hex(),
                        row["updated"].ctime(),
                        time.mktime(row["updated"].timetuple()),
-                       row["seeds"].get_estimate(),
-                       row["peers"].get_estimate()))
-  def _update_torrent_row(self, row):
-    iter = self._find_row(0, row["id"])
-    if iter is not None:
-      self._data.set(iter, 0, row["id"], 1, row["hash"].get_hex(),
-                        2, row["updated"].ctime(),
-                        3, time.mktime(row["updated"].timetuple()),
-                        4, row["seeds"].get_estimate(),
-                        5, row["peers"].get_estimate())
-  def _do_torrent_added(self, db, hash):
-    self._add_torrent_row(db.get_torrent_row(hash))
-  def _do_torrent_changed(self, db, hash):
-    self._update_torrent_row(db.get_torrent_row(hash))
+                       row["seeds_estimate"],
+                       row["peers_estimate"]))
+  def _update_torrent_row(self, row, iter):
+    self._data.set(iter, 0, row["id"], 1, row["hash"].get_hex(),
+                      2, row["updated"].ctime(),
+                      3, time.mktime(row["updated"].timetuple()),
+                      4, row["seeds_estimate"],
+                      5, row["peers_estimate"])
+  def _do_changed(self, db, delta):
+    removed = set(hash.get_hex() for hash in delta.removed("torrent"))
+    changed = dict((hash.get_hex(), hash) for hash in delta.changed("torrent"))
+    rows = self._find_rows(1, removed.union(changed))
+    for hex, iter in rows.iteritems():
+      if hex in removed:
+        self._data.remove(iter)
+      else:
+        row = db.get_torrent_row(changed[hex])
+        if row is not None:
+          self._update_torrent_row(row, iter)
+    for hash in delta.added("torrent"):
+      row = db.get_torrent_row(hash)
+      if row is not None:
+        self._add_torrent_row(row)
 
 class PeerView(DBView):
   schema = (int, str, int, str, float)
@@ -316,10 +337,7 @@ class PeerView(DBView):
     ("Updated", 3, 4)
   )
   def __init__(self, db=None):
-    signals = {
-      "peer-added": self._do_peer_added,
-      "peer-changed": self._do_peer_changed
-    }
+    signals = {"changed": self._do_changed}
     DBView.__init__(self, self.schema, self.cols, signals)
     if db is not None:
       self.bind_to(db)
@@ -330,17 +348,31 @@ class PeerView(DBView):
     self._data.append((row["id"], row["contact"].host, row["contact"].port,
                        row["updated"].ctime(),
                        time.mktime(row["updated"].timetuple())))
-  def _update_peer_row(self, row):
-    iter = self._find_row(0, row["id"])
-    if iter is not None:
-      self._data.set(iter, 0, row["id"],
-                     1, row["contact"].host, 2, row["contact"].port,
-                     3, row["updated"].ctime(),
-                     4, time.mktime(row["updated"].timetuple()))
-  def _do_peer_added(self, db, peer):
-    self._add_peer_row(db.get_peer_row(peer))
-  def _do_peer_changed(self, db, peer):
-    self._update_peer_row(db.get_peer_row(peer))
+  def _update_peer_row(self, row, iter):
+    self._data.set(iter, 0, row["id"],
+                   1, row["contact"].host, 2, row["contact"].port,
+                   3, row["updated"].ctime(),
+                   4, time.mktime(row["updated"].timetuple()))
+  def _do_changed(self, db, delta):
+    removed = set(delta.removed("peer"))
+    changed = set(delta.changed("peer"))
+    if removed or changed:
+      iter = self._data.get_iter_first()
+      while iter is not None:
+        next = self._data.iter_next(iter)
+        peer = ContactInfo(self._data.get_value(iter, 1),
+                           self._data.get_value(iter, 2))
+        if peer in removed:
+          self._data.remove(iter)
+        elif peer in changed:
+          row = db.get_peer_row(peer)
+          if row is not None:
+            self._update_peer_row(row, iter)
+        iter = next
+    for peer in delta.added("peer"):
+      row = db.get_peer_row(peer)
+      if row is not None:
+        self._add_peer_row(row)
 
 class ServerView(DBView):
   schema = (str, str, int, gobject.TYPE_PYOBJECT)
@@ -328,7 +328,8 @@ class Interface(gtk.Window):
       self.cfg.set("last", "find_port", str(port))
       self.cfg.set("last", "find_hash", hash)
 
-      self.current_server.send_find_node((host, port), hash)
+      self.current_server.lookup(Hash(hash), contacts=[(host, port)],
+                                 done=self._do_lookup_done)
 
   def get_peers(self, widget=None, host=None, port=None):
     if not self.current_server:
@@ -356,7 +357,16 @@ class Interface(gtk.Window):
       self.cfg.set("last", "get_peers_hash", hash)
       self.cfg.set("last", "get_peers_scrape", str(scrape))
 
-      self.current_server.send_get_peers((host, port), hash, scrape)
+      self.current_server.lookup(Hash(hash), True, scrape, [(host, port)],
+                                 done=self._do_lookup_done)
+
+  def _do_lookup_done(self, lookup):
+    message = ("Lookup of {0} done: {1} nodes, {2} peers, {3} queries, "
+               "{4} round trips").format(lookup.target.get_hex(),
+                                         len(lookup.get_closest()),
+                                         len(lookup.peers), lookup.queries,
+                                         lookup.get_rounds())
+    self._do_log(message)
 
   def load_torrent(self, widget):
     if not self.current_server:
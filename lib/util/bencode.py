@@ -1,4 +1,4 @@
-# FreeBencode v0.3.1
+# FreeBencode v0.4
 # 
 # This is a simple bencode/bdecode python module that I wrote because
 # I wasn't happy with the license of the official bittorrent one.
@@ -25,11 +25,15 @@
 # THE SOFTWARE.
 #
 # Changelog:
+# 0.4: Added a linear-time, offset based strict decoder (bdecode_strict) and
+#      an encoder that appends into a single output buffer (bencode_into)
+#      and a lazy dictionary decoder (bdecode_lazy).
 # 0.3.1: Minor code cleanup.
 # 0.3: Added support for encoding bools as integers.
 # 0.2: Added support for type factories and added documentation.
 # 0.1: Initial release.
 """FreeBencode: A simple and free python bencode/bdecode library."""
+import collections
 
 str_factory = str
 int_factory = long
@@ -51,14 +55,48 @@ def bencode(obj):
   The module variables int_types, str_types, list_types and dict_types can
   be changed to change the type guessing behavior. They are passed to
   isinstance to determine to proper encoding function to use."""
-  if isinstance(obj, tuple(int_types)):
-    return bencode_int(obj)
-  elif isinstance(obj, tuple(str_types)):
-    return bencode_str(obj)
-  elif isinstance(obj, tuple(list_types)):
-    return bencode_list(obj)
-  elif isinstance(obj, tuple(dict_types)):
-    return bencode_dict(obj)
+  buf = []
+  bencode_into(obj, buf)
+  return "".join(buf)
+
+def bencode_into(obj, buf):
+  """Bencode an object by appending the encoded pieces to a list.
+
+  This is what bencode uses internally. Nested objects are appended to the
+  same list instead of being joined into intermediate strings, so callers
+  that build a message from several parts can share one buffer and join it
+  once. The type guessing is the same as in bencode."""
+  types = (tuple(int_types), tuple(str_types), tuple(list_types),
+           tuple(dict_types))
+  _encode(obj, buf.append, types)
+
+def _encode(obj, append, types):
+  if isinstance(obj, types[0]):
+    append("i%de" % obj)
+  elif isinstance(obj, types[1]):
+    if type(obj) is not str:
+      obj = str(obj)
+    append(str(len(obj)))
+    append(":")
+    append(obj)
+  elif isinstance(obj, types[2]):
+    append("l")
+    for x in obj:
+      _encode(x, append, types)
+    append("e")
+  elif isinstance(obj, types[3]):
+    try:
+      keys = [str(k) for k in obj.keys()]
+    except AttributeError:
+      raise BencodeError("Could not bencode object: no keys method.")
+    keys.sort()
+    append("d")
+    for k in keys:
+      append(str(len(k)))
+      append(":")
+      append(k)
+      _encode(obj[k], append, types)
+    append("e")
   else:
     raise BencodeError("Cannot bencode object: unrecognized type.")
 
@@ -192,3 +230,186 @@ def bdecode_dict(string, factory=None):
   for i in range(0, len(items), 2):
     result[items[i]] = items[i+1]
   return factory(result), leftovers
+
+def bdecode_strict(string):
+  """Bdecode a complete string in linear time and return the result.
+
+  The return value is a tuple like the one returned by bdecode, but the
+  leftover string is always empty: trailing data after the first object is an
+  error. Unlike bdecode, this walks the input with an integer offset instead of
+  slicing it, so nothing is copied until a leaf value is created. Integers and
+  string lengths must be in canonical form (no leading zeros, no -0) and
+  dictionary keys must be strings. The module factory variables are honored
+  like in the other bdecode functions."""
+  if isinstance(string, (buffer, bytearray)):
+    string = str(string)
+  result, pos = bdecode_at(string, 0)
+  if pos != len(string):
+    raise BencodeError("Invalid bencoded object: trailing data.")
+  return result, ""
+
+def bdecode_at(string, pos=0):
+  """Bdecode the object starting at offset pos of a string.
+
+  Returns a tuple of the decoded object and the offset just past its end. The
+  same strictness rules as bdecode_strict apply to the object itself, but
+  anything after it is left alone."""
+  try:
+    return _decode(string, pos)
+  except (IndexError, KeyError, ValueError):
+    raise BencodeError("Invalid bencoded object at offset {0:d}.".format(pos))
+  except RuntimeError:
+    raise BencodeError("Invalid bencoded object: nested too deeply.")
+
+def bdecode_lazy(string, lazy=()):
+  """Bdecode a complete bencoded dictionary without decoding its values.
+
+  The return value is a tuple like the one returned by bdecode_strict, but the
+  result is a LazyDict: the keys and value offsets are indexed up front and
+  each value is only decoded the first time it is accessed. Values of the keys
+  in lazy that are dictionaries are themselves returned as LazyDicts. The
+  structure of the whole string is checked up front, but the bdecode_strict
+  rules for integers and strings are only applied to values as they are
+  decoded."""
+  if isinstance(string, (buffer, bytearray)):
+    string = str(string)
+  if not string.startswith("d"):
+    raise BencodeError("Invalid bencoded dict: string does not start with 'd'.")
+  result = LazyDict(string, 0, lazy)
+  if result.end != len(string):
+    raise BencodeError("Invalid bencoded object: trailing data.")
+  return result, ""
+
+class LazyDict(collections.Mapping):
+  """A read only mapping over a bencoded dictionary inside a string.
+
+  Values are decoded on first access and then cached. Membership tests and
+  iteration only look at the index of keys and never decode a value."""
+  def __init__(self, string, pos=0, lazy=()):
+    self._string = string
+    self._offsets = {}
+    self._values = {}
+    try:
+      pos += 1
+      char = string[pos]
+      while char != "e":
+        if not char.isdigit():
+          raise BencodeError("Invalid bencoded dict: key is not a string.")
+        colon = string.index(":", pos)
+        end = colon + 1 + int(string[pos:colon])
+        key = string[colon+1:end]
+        char = string[end]
+        if char.isdigit():
+          # Most values are strings, so skip them without a function call.
+          colon = string.index(":", end)
+          pos = colon + 1 + int(string[end:colon])
+        elif char == "d" and key in lazy:
+          value = self._values[key] = LazyDict(string, end)
+          pos = value.end
+        else:
+          pos = _skip(string, end)
+        self._offsets[key] = end
+        char = string[pos]
+    except (IndexError, ValueError):
+      raise BencodeError("Invalid bencoded dict at offset {0:d}.".format(pos))
+    self.end = pos + 1
+  def __getitem__(self, key):
+    value = self._values.get(key)
+    if value is None:
+      pos = self._offsets[key]
+      value = self._values[key] = bdecode_at(self._string, pos)[0]
+    return value
+  def __contains__(self, key):
+    return key in self._offsets
+  def has_key(self, key):
+    return key in self._offsets
+  def __iter__(self):
+    return iter(self._offsets)
+  def __len__(self):
+    return len(self._offsets)
+  def __repr__(self):
+    return repr(dict(self.iteritems()))
+
+def _skip(string, pos):
+  # Only the structure (lengths and terminators) is checked here, leaf values
+  # are checked when they are decoded.
+  depth = 0
+  while True:
+    char = string[pos]
+    if char == "l" or char == "d":
+      depth += 1
+      pos += 1
+      continue
+    elif char == "e":
+      if not depth:
+        raise BencodeError("Invalid bencoded object: unexpected end.")
+      depth -= 1
+      pos += 1
+    elif char == "i":
+      pos = string.index("e", pos) + 1
+    else:
+      colon = string.index(":", pos)
+      length = int(string[pos:colon])
+      if length < 0:
+        raise BencodeError("Invalid bencoded string: negative length.")
+      pos = colon + 1 + length
+    if not depth:
+      return pos
+
+def _decode(string, pos):
+  return _DECODERS[string[pos]](string, pos)
+
+def _decode_int(string, pos):
+  end = string.index("e", pos)
+  digits = string[pos+1:end]
+  if digits[0] == "-":
+    if digits[1] == "0" or not digits[1:].isdigit():
+      raise BencodeError("Invalid bencoded int: not canonical.")
+  elif not digits.isdigit() or (digits[0] == "0" and len(digits) > 1):
+    raise BencodeError("Invalid bencoded int: not canonical.")
+  return int_factory(digits), end + 1
+
+def _str_bounds(string, pos):
+  colon = string.index(":", pos)
+  digits = string[pos:colon]
+  if not digits.isdigit() or (digits[0] == "0" and len(digits) > 1):
+    raise BencodeError("Invalid bencoded string: length not canonical.")
+  end = colon + 1 + int(digits)
+  if end > len(string):
+    raise BencodeError("Invalid bencoded string: Too long length.")
+  return colon + 1, end
+
+def _decode_str(string, pos):
+  start, end = _str_bounds(string, pos)
+  return str_factory(string[start:end]), end
+
+def _decode_list(string, pos):
+  pos += 1
+  result = []
+  append = result.append
+  char = string[pos]
+  while char != "e":
+    if char.isdigit():
+      # Strings are the common case (e.g. values lists), so skip the dispatch.
+      start, pos = _str_bounds(string, pos)
+      append(str_factory(string[start:pos]))
+    else:
+      item, pos = _DECODERS[char](string, pos)
+      append(item)
+    char = string[pos]
+  return list_factory(result), pos + 1
+
+def _decode_dict(string, pos):
+  pos += 1
+  result = {}
+  while string[pos] != "e":
+    if not string[pos].isdigit():
+      raise BencodeError("Invalid bencoded dict: key is not a string.")
+    start, end = _str_bounds(string, pos)
+    result[string[start:end]], pos = _DECODERS[string[end]](string, end)
+  return dict_factory(result), pos + 1
+
+_DECODERS = {"i": _decode_int, "l": _decode_list, "d": _decode_dict}
+for _digit in "0123456789":
+  _DECODERS[_digit] = _decode_str
+del _digit
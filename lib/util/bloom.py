@@ -16,15 +16,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """This module contains the bloom filter implementation."""
+import binascii
 import hashlib
 import math
 import sqlite3
-import operator
-
-from .sha1hash import Hash
 
 class BloomFilter(object):
-  """Bloom filter implemented to BEP_0033 spec."""
+  """Bloom filter implemented to BEP_0033 spec.
+
+  The bits are kept in a single integer whose most significant byte is the
+  first byte of the BEP_0033 binary form, so a union is a single | and
+  counting the set bits is a single bin().count(). The size estimate is
+  cached until the filter changes."""
   K = 2
   M = 256 * 8
   def __init__(self, filter1=None, filter2=None):
@@ -34,25 +37,21 @@ class BloomFilter(object):
     a bloom filter, one hex string representing a bloom filter,
     or two of any of the previous which are ORed together to
     create a new bloom filter."""
-    if filter1 in (None,0,"0") and filter2 in (None,0,"0"):
-      self.bloom = [0 for x in range(self.M/8)]
-    elif filter2 in (None,0,"0"):
-      self.bloom = []
-      if isinstance(filter1, BloomFilter):
-        self.bloom[:] = filter1.bloom[:]
-      elif len(filter1) == (self.M/8):
-        for b in filter1:
-          self.bloom.append(ord(b))
-      elif len(filter1) == (self.M/8)*2:
-        for x in range(0, 64, 2):
-          self.bloom.append(int(filter1[x:x+1], 16))
-    else:
-      filter1 = BloomFilter(filter1)
-      filter2 = BloomFilter(filter2)
-      self.bloom = [filter1.bloom[x] | filter2.bloom[x]
-                      for x in range(len(filter1.bloom))]
-  def insert_host(self, host):
-    hash = Hash(hashlib.sha1(host.get_packed_host()).digest()).get_20()
+    self.bits = self._get_bits(filter1) | self._get_bits(filter2)
+    self._estimate = None
+  @classmethod
+  def _get_bits(cls, filter):
+    if filter in (None, 0, "0"):
+      return 0
+    elif isinstance(filter, BloomFilter):
+      return filter.bits
+    elif len(filter) == cls.M/8:
+      return long(binascii.hexlify(filter), 16)
+    elif len(filter) == cls.M/4:
+      return long(filter, 16)
+    raise ValueError("Invalid bloom filter (len {0})".format(len(filter)))
+  def _get_host_bits(self, host):
+    hash = hashlib.sha1(host.get_packed_host()).digest()
 
     index1 = ord(hash[0]) | (ord(hash[1]) << 8)
     index2 = ord(hash[2]) | (ord(hash[3]) << 8)
@@ -60,32 +59,67 @@ class BloomFilter(object):
     index1 %= self.M
     index2 %= self.M
 
-    self.bloom[index1 / 8] |= 0x01 << (index1 % 8)
-    self.bloom[index2 / 8] |= 0x01 << (index2 % 8)
-
-    self.bloom[index1 / 8] &= 0xFF
-    self.bloom[index2 / 8] &= 0xFF
+    # Bit index % 8 of byte index / 8, counting bytes from the most
+    # significant end.
+    last = self.M/8 - 1
+    return ((1 << ((last - index1 / 8) * 8 + index1 % 8)) |
+            (1 << ((last - index2 / 8) * 8 + index2 % 8)))
+  def insert_host(self, host):
+    self.bits |= self._get_host_bits(host)
+    self._estimate = None
+  def insert_hosts(self, hosts):
+    bits = self.bits
+    for host in hosts:
+      bits |= self._get_host_bits(host)
+    self.bits = bits
+    self._estimate = None
   def count_zero_bits(self):
-    return reduce(operator.add,
-                  ("{0:08b}".format(x).count('0') for x in self.bloom))
+    return self.M - bin(self.bits).count("1")
   def get_estimate(self):
-    c = float(min(self.M-1, self.count_zero_bits()))
-    try:
-      size = math.log(c/self.M) / (self.K * math.log1p(-1./self.M))
-    except ValueError:
-      size = 0
-    return size
+    if self._estimate is None:
+      c = float(min(self.M-1, self.count_zero_bits()))
+      try:
+        size = math.log(c/self.M) / (self.K * math.log1p(-1./self.M))
+      except ValueError:
+        size = 0
+      self._estimate = size
+    return self._estimate
   def get_hex(self):
-    result = ""
-    for b in self.bloom:
-      result += "{0:02x}".format(b)
-    return result
+    return "{0:0{1}x}".format(self.bits, self.M/4)
   def get_bin(self):
-    return buffer("".join(chr(b) for b in self.bloom))
+    return buffer(binascii.unhexlify(self.get_hex()))
   def __str__(self):
     return str(self.get_bin())
   def __or__(self, other):
     return BloomFilter(self, other)
+  def __ior__(self, other):
+    self.bits |= self._get_bits(other)
+    self._estimate = None
+    return self
   def __conform__(self, protocol):
     if protocol is sqlite3.PrepareProtocol:
       return self.get_bin()
+
+def bloom_or(filter1, filter2):
+  """Returns the union of two binary bloom filters as a binary filter.
+
+  This is registered as the SQLite function bloom_or. NULL or 0 counts as an
+  empty filter."""
+  return BloomFilter(filter1, filter2).get_bin()
+
+def bloom_estimate(filter):
+  """Returns the estimated number of items in a binary bloom filter.
+
+  This is registered as the SQLite function bloom_estimate."""
+  return BloomFilter(filter).get_estimate()
+
+class BloomUnion(object):
+  """SQLite aggregate returning the union of binary bloom filters.
+
+  This is registered as the SQLite aggregate bloom_union."""
+  def __init__(self):
+    self.bloom = BloomFilter()
+  def step(self, filter):
+    self.bloom |= filter
+  def finalize(self):
+    return self.bloom.get_bin()
@@ -0,0 +1,84 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Contains functions for parsing BEP_0005 compact node and peer info."""
+import struct
+
+try:
+  import numpy
+except ImportError:
+  HAVE_NUMPY = False
+else:
+  HAVE_NUMPY = True
+
+from .sha1hash import intern_20s
+from .contactinfo import ContactInfo
+
+NODE_LENGTH = 26
+PEER_LENGTHS = (6, 18)
+
+def split_nodes(nodes):
+  """Splits a compact 'nodes' string into lists of raw ids and addresses.
+
+  Returns a tuple of two lists of the same length: the 20 byte node ids and
+  the 6 byte packed addresses. The string is unpacked with a single struct
+  call. Raises ValueError if the length is not a multiple of 26."""
+  nodes = str(nodes)
+  count, extra = divmod(len(nodes), NODE_LENGTH)
+  if extra:
+    raise ValueError("Invalid compact node info: bad length.")
+  fields = struct.unpack("20s6s" * count, nodes)
+  return list(fields[0::2]), list(fields[1::2])
+
+def parse_nodes(nodes):
+  """Parses a compact 'nodes' string.
+
+  Returns a tuple of two lists of the same length: the Hash of
+  every node and its ContactInfo. The hashes are interned, so they are
+  shared with the routing table."""
+  ids, addrs = split_nodes(nodes)
+  return (intern_20s(ids),
+          [ContactInfo.from_packed(addr) for addr in addrs])
+
+def parse_values(values):
+  """Parses a 'values' list of compact peer info into ContactInfos.
+
+  Items that are not 6 (IPv4) or 18 (IPv6) bytes long are skipped."""
+  return [ContactInfo.from_packed(str(v)) for v in values
+          if len(v) in PEER_LENGTHS]
+
+def pack_nodes(nodes):
+  """Packs (Hash, ContactInfo) pairs into a compact 'nodes' string."""
+  return "".join([str(hash.get_20()) + str(contact.get_packed())
+                  for hash, contact in nodes])
+
+def nodes_array(nodes):
+  """Parses a compact 'nodes' string into a NumPy record array.
+
+  The array has an 'id' field with the node ids and an 'ip' field with the
+  IPv4 addresses, both as rows of unsigned bytes, and a 'port' field with the
+  port as an integer. No Python objects are created per node, and the ids
+  can be XORed against a target as a whole. Raises NotImplementedError if
+  NumPy is not available and ValueError if the length is not a multiple of
+  26."""
+  if not HAVE_NUMPY:
+    raise NotImplementedError("No numpy support")
+  if len(nodes) % NODE_LENGTH:
+    raise ValueError("Invalid compact node info: bad length.")
+  dtype = numpy.dtype([("id", "u1", (20,)), ("ip", "u1", (4,)),
+                       ("port", ">u2")])
+  return numpy.frombuffer(str(nodes), dtype)
@@ -16,53 +16,107 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """contains a class for representing internet address + port combinations."""
+import functools
 import socket
 import sqlite3
+import struct
 
+@functools.total_ordering
 class ContactInfo(object):
-  """Represents an internet address + port combination."""
+  """Represents an internet address + port combination.
+
+  The address is stored in its BEP_0005 'packed' form (6 bytes for IPv4, 18
+  for IPv6), which is what goes over the wire and into the database. The text
+  form of the host is only worked out when it is asked for. ContactInfos
+  compare and hash by their packed form, so they can be used as dictionary
+  keys."""
+  __slots__ = ("_packed", "_host")
   def __init__(self, addr, port=None):
     if isinstance(addr, ContactInfo):
-      self.host = addr.host
-      self.port = addr.port
+      self._packed = addr._packed
+      self._host = addr._host
       return
     if port is None:
-      if len(addr) == 6:
-        port = addr[4:6]
-        addr = addr[0:4]
-      elif len(addr) == 18:
-        port = addr[16:18]
-        addr = addr[0:16]
-      else:
+      if len(addr) not in (6, 18):
         raise ValueError("Unknown combined addr+port format.")
-    if len(addr) == 4:
-      self.host = socket.inet_ntop(socket.AF_INET, addr)
-    elif (len(addr) == 16 and
-          not all(x.isdigit() and x == ":" for x in addr)):
-      self.host = socket.inet_ntop(socket.AF_INET6, addr)
-    else:
-      self.host = addr
+      self._packed = str(addr)
+      self._host = None
+      return
     if isinstance(port, (buffer, basestring)):
-      self.port = (ord(port[0]) << 8) + ord(port[1])
+      port = str(port)
     else:
-      self.port = port
+      port = struct.pack("!H", port)
+    packed = _pton(addr)
+    if packed is not None:
+      self._host = addr
+    elif len(addr) in (4, 16):
+      packed = str(addr)
+      self._host = None
+    else:
+      packed = socket.inet_pton(socket.AF_INET6, addr)
+      self._host = addr
+    self._packed = packed + port
+  @classmethod
+  def from_packed(cls, packed):
+    """Returns a ContactInfo for a 6 or 18 byte packed string.
+
+    This skips all of the argument checking done by the constructor and is
+    meant for data that is already known to be in compact format, like
+    slices of a 'nodes' string or the items of a 'values' list."""
+    result = cls.__new__(cls)
+    result._packed = packed
+    result._host = None
+    return result
+  @property
+  def host(self):
+    """The host as an IPv4 or IPv6 address string."""
+    if self._host is None:
+      packed = self._packed[:-2]
+      if len(packed) == 4:
+        self._host = socket.inet_ntop(socket.AF_INET, packed)
+      else:
+        self._host = socket.inet_ntop(socket.AF_INET6, packed)
+    return self._host
+  @property
+  def port(self):
+    """The port as an integer."""
+    return (ord(self._packed[-2]) << 8) + ord(self._packed[-1])
   def get_tuple(self):
     """Returns a tuple of (addr, port) (e.g. for raw socket communication)"""
     return self.host, self.port
   def get_packed(self):
     """Returns a BEP_0005 'packed' representation of the addr+port."""
-    result = self.get_packed_host()
-    result += chr(self.port >> 8) + chr(self.port % 256)
-    return buffer(result)
+    return buffer(self._packed)
   def get_packed_host(self):
     """Returns a BEP_0005 'packed' representation of the addr."""
-    try:
-      result = socket.inet_pton(socket.AF_INET, self.host)
-    except (ValueError, socket.error):
-      result = socket.inet_pton(socket.AF_INET6, self.host)
-    return buffer(result)
+    return buffer(self._packed, 0, len(self._packed) - 2)
   def __str__(self):
     return "{0}:{1}".format(self.host, self.port)
+  def __eq__(self, other):
+    if isinstance(other, ContactInfo):
+      return self._packed == other._packed
+    return NotImplemented
+  def __ne__(self, other):
+    if isinstance(other, ContactInfo):
+      return self._packed != other._packed
+    return NotImplemented
+  def __lt__(self, other):
+    if isinstance(other, ContactInfo):
+      return self._packed < other._packed
+    return NotImplemented
+  def __hash__(self):
+    return hash(self._packed)
   def __conform__(self, protocol):
     if protocol is sqlite3.PrepareProtocol:
       return self.get_packed()
+
+def _pton(host):
+  """Returns the packed form of a textual address, or None if it isn't one."""
+  try:
+    return socket.inet_pton(socket.AF_INET, host)
+  except (ValueError, TypeError, socket.error):
+    pass
+  try:
+    return socket.inet_pton(socket.AF_INET6, host)
+  except (ValueError, TypeError, socket.error):
+    return None
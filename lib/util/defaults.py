@@ -23,6 +23,16 @@ import io
 DEFAULTS = """ 
 [torrent]
 db = :memory:
+batch_size = 100
+batch_window = 50
+readers = 2
+snapshot =
+snapshot_interval = 300
+warm_start_rate = 50
+peer_ttl = 7200
+torrent_ttl = 86400
+sweep_interval = 60
+sweep_batch = 500
 
 [view]
 
@@ -0,0 +1,83 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Contains a scheduler for timed work, such as the periodic checks of a
+routing table."""
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+class Scheduler(object):
+  """A min-heap of calls keyed on the time they are due.
+
+  Calls can be added from any thread. run_due() is called from one thread,
+  which runs the calls that are due, and next_due() tells it how long it may
+  sleep before the next one. Cancelled calls stay in the heap until they
+  come up, so cancelling is cheap."""
+  def __init__(self, clock=time.time):
+    self.clock = clock
+    self._heap = []
+    self._seq = itertools.count() # keeps calls due at once in order
+    self._lock = threading.Lock()
+  def call_at(self, when, func, *args):
+    """Calls func(*args) at the time when. Returns a handle for cancel()."""
+    entry = [when, next(self._seq), func, args]
+    with self._lock:
+      heapq.heappush(self._heap, entry)
+    return entry
+  def call_later(self, delay, func, *args):
+    """Calls func(*args) in delay seconds. Returns a handle for cancel()."""
+    return self.call_at(self.clock() + delay, func, *args)
+  def cancel(self, entry):
+    entry[2] = None
+  def next_due(self):
+    """Returns the time the next call is due, or None if there is none."""
+    with self._lock:
+      heap = self._heap
+      while heap and heap[0][2] is None:
+        heapq.heappop(heap)
+      return heap[0][0] if heap else None
+  def run_due(self, now=None, limit=None):
+    """Runs the calls that are due at now, at most limit of them, in the
+    order they are due. Calls added while they run wait for the next
+    run_due(), so a call that reschedules itself runs once. Returns the
+    number of calls run."""
+    if now is None:
+      now = self.clock()
+    due = []
+    with self._lock:
+      heap = self._heap
+      while heap and heap[0][0] <= now and (limit is None or
+                                            len(due) < limit):
+        entry = heapq.heappop(heap)
+        if entry[2] is not None:
+          due.append(entry)
+    count = 0
+    for entry in due:
+      func, args = entry[2], entry[3]
+      if func is None:
+        continue # cancelled while an earlier call ran
+      try:
+        func(*args)
+      except Exception:
+        # Nobody is waiting for this one, so report it and carry on.
+        traceback.print_exc()
+      count += 1
+    return count
+  def __len__(self):
+    return len(self._heap)
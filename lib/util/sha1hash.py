@@ -16,51 +16,76 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """Contains a class Hash for representing sha1 hashes."""
+import binascii
 import math
 import sqlite3
+import threading
+import weakref
 
 class Hash(object):
-  """Represents a 160 byte (SHA1) hash."""
+  """Represents a 160 bit (SHA1) hash.
+
+  The hash is stored as its 20 byte binary string, which is what goes over
+  the wire and into the database. The integer form is computed the first time
+  it is needed and then cached. Hashes compare equal and hash alike when their
+  values are equal, so they can be used as dictionary keys."""
+  __slots__ = ("_20", "_int", "__weakref__")
   def __init__(self, raw_hash):
-    self.id = raw_hash
-    if isinstance(self.id, (basestring, buffer)):
-      if len(self.id) > 20:
+    if isinstance(raw_hash, Hash):
+      self._20 = raw_hash._20
+      self._int = raw_hash._int
+    elif isinstance(raw_hash, (basestring, buffer)):
+      if len(raw_hash) > 20:
         try:
-          self.id = int(self.id, 16)
+          self._int = int(str(raw_hash), 16)
         except ValueError:
-          raise ValueError("Invalid ID (len {0}, not hex)", len(self.id))
+          raise ValueError("Invalid ID (len {0}, not hex)".format(
+                                                              len(raw_hash)))
+        self._20 = _int_to_20(self._int)
       else:
-        while len(self.id) < 20:
-          self.id = "\x00" + self.id
-        raw_hash = self.id
-        self.id = 0
-        for char in raw_hash:
-          self.id = self.id << 8
-          self.id += ord(char)
-    elif isinstance(self.id, Hash):
-      self.id = self.id.id
+        self._20 = str(raw_hash).rjust(20, "\x00")
+        self._int = None
+    else:
+      self._int = raw_hash
+      self._20 = _int_to_20(raw_hash)
+  @classmethod
+  def from_20(cls, raw_hash):
+    """Returns a Hash for a 20 byte binary string.
+
+    This skips the type and length checks done by the constructor and is
+    meant for data that is already known to be a packed id, like slices of a
+    compact 'nodes' string."""
+    result = cls.__new__(cls)
+    result._20 = raw_hash
+    result._int = None
+    return result
   def get_hex(self):
     """Returns a 40 character lowercase hex representation of the hash."""
-    return "{0:040x}".format(self.id)
+    return binascii.hexlify(self._20)
   def get_20(self):
     """Returns a 20 character 'packed' binary representation of the hash."""
-    raw_hash = self.id
-    result = ""
-    while raw_hash != 0:
-      result = chr(raw_hash & 0xFF) + result
-      raw_hash = raw_hash >> 8
-    while len(result) < 20:
-      result = "\x00" + result
-    return buffer(result)
+    return buffer(self._20)
   def get_int(self):
     """Returns an integer representation of the hash."""
-    return self.id
+    if self._int is None:
+      self._int = long(binascii.hexlify(self._20), 16)
+    return self._int
   def __int__(self):
     return self.get_int()
   def __str__(self):
     return self.get_hex()
   def __long__(self):
     return self.get_int()
+  def __eq__(self, other):
+    if isinstance(other, Hash):
+      return self._20 == other._20
+    return NotImplemented
+  def __ne__(self, other):
+    if isinstance(other, Hash):
+      return self._20 != other._20
+    return NotImplemented
+  def __hash__(self):
+    return hash(self._20)
   def distance(self, other):
     """Returns the exclusive or disteance between this and another hash."""
     return self.get_int() ^ other.get_int()
@@ -73,3 +98,40 @@ class Hash(object):
   def __conform__(self, protocol):
     if protocol is sqlite3.PrepareProtocol:
       return self.get_20()
+
+def _int_to_20(value):
+  if not 0 <= value < (1 << 160):
+    raise ValueError("Invalid ID (out of range)")
+  return binascii.unhexlify("{0:040x}".format(value))
+
+_interned = weakref.WeakValueDictionary()
+_intern_lock = threading.Lock()
+
+def intern_hash(raw_hash):
+  """Returns a Hash like Hash(raw_hash), but shares one object per value.
+
+  Interned hashes are only weakly referenced by the intern table, so this is
+  meant for values that show up over and over again, like node ids read from
+  packets and database rows."""
+  hash = Hash(raw_hash)
+  with _intern_lock:
+    # Not setdefault: for a key whose value has died but not been removed
+    # yet, WeakValueDictionary.setdefault returns None.
+    interned = _interned.get(hash._20)
+    if interned is None:
+      interned = _interned[hash._20] = hash
+    return interned
+
+def intern_20s(ids):
+  """Returns interned Hashes for a list of 20 byte binary strings, like
+  intern_hash but without its checks and with one lock for the list."""
+  result = []
+  append = result.append
+  get = _interned.get
+  with _intern_lock:
+    for id in ids:
+      hash = get(id)
+      if hash is None:
+        hash = _interned[id] = Hash.from_20(id)
+      append(hash)
+  return result
@@ -0,0 +1,120 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Contains a binary trie over node ids for finding the closest nodes."""
+
+BITS = 160
+LEAF_SIZE = 16
+
+class XorTrie(object):
+  """A binary trie mapping integer keys of BITS bits to values.
+
+  Internal nodes are two element lists indexed by the next bit of the key and
+  leaves are dicts of at most leaf_size items, which are split when they get
+  larger. Walking the trie with the bits of a target key preferred gives the
+  subtrees in order of XOR distance, so closest() only has to look at the
+  leaves holding the k closest keys: O(log N + k log k)."""
+  def __init__(self, bits=BITS, leaf_size=LEAF_SIZE):
+    self.bits = bits
+    self.leaf_size = leaf_size
+    self._root = {}
+    self._len = 0
+  def __len__(self):
+    return self._len
+  def _find(self, key):
+    """Returns the path to the leaf for key as (node, index) pairs, and the
+    leaf."""
+    path = []
+    node = self._root
+    shift = self.bits - 1
+    while node.__class__ is list:
+      bit = (key >> shift) & 1
+      path.append((node, bit))
+      node = node[bit]
+      shift -= 1
+    return path, node
+  def __contains__(self, key):
+    return key in self._find(key)[1]
+  def get(self, key, default=None):
+    return self._find(key)[1].get(key, default)
+  def insert(self, key, value):
+    """Adds or replaces the value for key."""
+    path, leaf = self._find(key)
+    if key not in leaf:
+      self._len += 1
+    leaf[key] = value
+    depth = len(path)
+    while len(leaf) > self.leaf_size and depth < self.bits:
+      shift = self.bits - 1 - depth
+      split = [{}, {}]
+      for k, v in leaf.iteritems():
+        split[(k >> shift) & 1][k] = v
+      if path:
+        parent, bit = path[-1]
+        parent[bit] = split
+      else:
+        self._root = split
+      bit = (key >> shift) & 1
+      path.append((split, bit))
+      leaf = split[bit]
+      depth += 1
+  def remove(self, key):
+    """Removes key. Returns whether it was present."""
+    path, leaf = self._find(key)
+    if key not in leaf:
+      return False
+    del leaf[key]
+    self._len -= 1
+    # Fold a pair of small sibling leaves back into their parent's place.
+    if path:
+      parent, bit = path[-1]
+      sibling = parent[1 - bit]
+      if (sibling.__class__ is dict and
+          len(leaf) + len(sibling) <= self.leaf_size / 2):
+        leaf.update(sibling)
+        if len(path) > 1:
+          grandparent, pbit = path[-2]
+          grandparent[pbit] = leaf
+        else:
+          self._root = leaf
+    return True
+  def closest(self, key, k):
+    """Returns the values of the k keys closest to key by XOR distance,
+    closest first."""
+    found = []
+    stack = [(self._root, self.bits - 1)]
+    while stack and len(found) < k:
+      node, shift = stack.pop()
+      if node.__class__ is dict:
+        found.extend(node.iteritems())
+      else:
+        bit = (key >> shift) & 1
+        stack.append((node[1 - bit], shift - 1))
+        stack.append((node[bit], shift - 1))
+    # Everything in a subtree popped earlier is closer than everything in
+    # one popped later, so only the items found so far can be among the k.
+    found.sort(key=lambda item: item[0] ^ key)
+    return [item[1] for item in found[:k]]
+  def itervalues(self):
+    stack = [self._root]
+    while stack:
+      node = stack.pop()
+      if node.__class__ is dict:
+        for value in node.itervalues():
+          yield value
+      else:
+        stack.extend(node)
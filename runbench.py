@@ -0,0 +1,28 @@
+#!/usr/bin/python
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bench import bencode, krpc, sha1hash, compact, sqlthread, readers, xortrie
+from bench import expiry, ingest, routingtable, buckets, timers
+from bench import transactions, notify, lookup
+
+if __name__ == "__main__":
+  for module in (bencode, krpc, sha1hash, compact, sqlthread,
+                 readers, xortrie, expiry, ingest, routingtable,
+                 buckets, timers, transactions, notify, lookup):
+    print module.__doc__
+    module.main()
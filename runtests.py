@@ -18,7 +18,26 @@
 
 import unittest
 
-from test.bloom import TestBloomFilter
+from test.bloom import TestBloomFilter, TestBloomSQL
+from test.bencode import TestBdecodeStrict, TestBdecodeLazy
+from test.krpc import TestKRPCEncoder
+from test.sha1hash import TestHash
+from test.contactinfo import TestContactInfo
+from test.compact import TestCompact
+from test.tokens import TestTokenManager
+from test.sqlthread import TestSQLiteThread
+from test.statements import TestStatements
+from test.xortrie import TestXorTrie
+from test.queryplan import TestQueryPlan
+from test.snapshot import TestSnapshot
+from test.expiry import TestExpiry
+from test.ingest import TestIngest
+from test.routingtable import TestRoutingTable
+from test.scheduler import TestScheduler
+from test.transactions import TestTransactionManager
+from test.notify import TestNotifier
+from test.lookup import TestLookup
+from test.db import TestCreateDB
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,69 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the bencode implementation."""
+import unittest
+
+from lib.util.bencode import (bencode, bdecode_strict, bdecode_at,
+                               bdecode_lazy, LazyDict, BencodeError)
+
+class TestBdecodeStrict(unittest.TestCase):
+  def test_roundtrip(self):
+    obj = {"t": "aa", "y": "r", "r": {"id": "\x00" * 20, "nodes": "x" * 52,
+                                      "values": ["abcdef", "ghijkl"]},
+           "n": -42, "z": 0, "l": [1, [2, {}], ""]}
+    self.assertEqual(bdecode_strict(bencode(obj)), (obj, ""))
+  def test_at(self):
+    self.assertEqual(bdecode_at("4:spami3e", 0), ("spam", 6))
+    self.assertEqual(bdecode_at("4:spami3e", 6), (3, 9))
+  def test_trailing(self):
+    self.assertRaises(BencodeError, bdecode_strict, "i3ei4e")
+  def test_non_canonical(self):
+    for s in ("i03e", "i-0e", "ie", "i-e", "i+3e", "i 3e", "03:abc"):
+      self.assertRaises(BencodeError, bdecode_strict, s)
+  def test_malformed(self):
+    for s in ("", "x", "l", "4:abc", "d1:ai1e", "di1ei2ee", "l" * 5000):
+      self.assertRaises(BencodeError, bdecode_strict, s)
+
+class TestBdecodeLazy(unittest.TestCase):
+  def setUp(self):
+    self.obj = {"t": "aa", "y": "q", "q": "get_peers",
+                "a": {"id": "x" * 20, "info_hash": "y" * 20, "scrape": 1,
+                      "l": [1, {"a": [2, "b"]}]}}
+    self.lazy = bdecode_lazy(bencode(self.obj), ("a",))[0]
+  def test_values(self):
+    self.assertTrue(isinstance(self.lazy["a"], LazyDict))
+    self.assertEqual(self.lazy["a"]["l"], self.obj["a"]["l"])
+    self.assertEqual(self.lazy, self.obj)
+  def test_keys(self):
+    self.assertTrue(self.lazy.has_key("q"))
+    self.assertFalse("r" in self.lazy)
+    self.assertEqual(sorted(self.lazy["a"]), sorted(self.obj["a"]))
+    self.assertRaises(KeyError, lambda: self.lazy["r"])
+  def test_malformed(self):
+    for s in ("", "li1ee", "d1:ai1e", "di1ei2ee", "d1:ai1eex", "d1:al3:abee",
+              "d1:a-1:ae"):
+      self.assertRaises(BencodeError, bdecode_lazy, s)
+  def test_malformed_value(self):
+    # Leaves that pass the structural check fail when they are decoded.
+    for s in ("d1:ti03ee", "d1:tiee", "d1:ti-ee", "d1:t02:abe",
+              "d1:tl1:ai0-eee"):
+      lazy = bdecode_lazy(s)[0]
+      self.assertRaises(BencodeError, lambda: lazy["t"])
+
+if __name__ == "__main__":
+  unittest.main()
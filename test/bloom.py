@@ -16,9 +16,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """Test for the bloom filter implementation."""
+import sqlite3
 import unittest
 
-from lib.util.bloom import BloomFilter
+from lib.util.bloom import BloomFilter, BloomUnion, bloom_or, bloom_estimate
 from lib.util.contactinfo import ContactInfo
 
 class TestBloomFilter(unittest.TestCase):
@@ -39,6 +40,50 @@ class TestBloomFilter(unittest.TestCase):
         "C67F17EFD5D75EBA6FFEBA7FFF47A91EB1BFBB53E8ABFB5762ABE8FF237279BF" +
         "EFBFEEF5FFC5FEBFDFE5ADFFADFEE1FB737FFFFBFD9F6AEFFEEE76B6FD8F72EF"
         ).lower())
+  def test_bin(self):
+    self.assertEqual(BloomFilter(self.b.get_bin()).get_hex(), self.b.get_hex())
+    self.assertEqual(BloomFilter(self.b.get_hex()).get_hex(), self.b.get_hex())
+  def test_union(self):
+    hosts = [ContactInfo("198.51.100.{0}".format(i), 80) for i in range(256)]
+    other = BloomFilter()
+    other.insert_hosts(hosts)
+    union = self.b | other
+    estimate = self.b.get_estimate()
+    self.b |= other
+    self.assertEqual(self.b.get_hex(), union.get_hex())
+    self.assertTrue(self.b.get_estimate() > estimate)
+    bits = "".join("{0:08b}".format(ord(c)) for c in str(self.b.get_bin()))
+    self.assertEqual(self.b.count_zero_bits(), bits.count("0"))
+
+class TestBloomSQL(unittest.TestCase):
+  def setUp(self):
+    self.conn = sqlite3.connect(":memory:")
+    self.conn.create_function("bloom_or", 2, bloom_or)
+    self.conn.create_function("bloom_estimate", 1, bloom_estimate)
+    self.conn.create_aggregate("bloom_union", 1, BloomUnion)
+    self.conn.execute("CREATE TABLE filters (bloom BLOB)")
+    self.filters = []
+    for i in range(3):
+      b = BloomFilter()
+      b.insert_hosts(ContactInfo("192.0.2.{0}".format(j), 80)
+                     for j in range(i * 10, i * 10 + 10))
+      self.filters.append(b)
+      self.conn.execute("INSERT INTO filters VALUES (?)", (b,))
+  def test_or(self):
+    result = self.conn.execute("SELECT bloom_or(?, ?)",
+                               self.filters[:2]).fetchone()[0]
+    self.assertEqual(BloomFilter(result).get_hex(),
+                     (self.filters[0] | self.filters[1]).get_hex())
+    result = self.conn.execute("SELECT bloom_or(NULL, ?)",
+                               self.filters[:1]).fetchone()[0]
+    self.assertEqual(BloomFilter(result).get_hex(), self.filters[0].get_hex())
+  def test_union(self):
+    result = self.conn.execute("""SELECT bloom_union(bloom),
+                                  bloom_estimate(bloom_union(bloom))
+                                  FROM filters""").fetchone()
+    union = self.filters[0] | self.filters[1] | self.filters[2]
+    self.assertEqual(BloomFilter(result[0]).get_hex(), union.get_hex())
+    self.assertAlmostEqual(result[1], union.get_estimate())
 
 if __name__ == "__main__":
   print unittest.main()
@@ -0,0 +1,52 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the compact node and peer info parsers."""
+import unittest
+
+from lib.util import compact
+from lib.util.sha1hash import Hash, intern_hash
+from lib.util.contactinfo import ContactInfo
+
+NODES = ("\x01" * 20 + "\xc0\x00\x02\x01\x1a\xe1" +
+         "\x02" * 20 + "\xc0\x00\x02\x02\x00\x50")
+
+class TestCompact(unittest.TestCase):
+  def test_parse_nodes(self):
+    hashes, contacts = compact.parse_nodes(NODES)
+    self.assertEqual(hashes, [Hash("\x01" * 20), Hash("\x02" * 20)])
+    self.assertEqual(contacts, [ContactInfo("192.0.2.1", 6881),
+                                ContactInfo("192.0.2.2", 80)])
+    self.assertTrue(hashes[0] is intern_hash("\x01" * 20))
+    self.assertEqual(compact.parse_nodes(""), ([], []))
+    self.assertRaises(ValueError, compact.parse_nodes, NODES[:-1])
+  def test_pack_nodes(self):
+    self.assertEqual(compact.pack_nodes(zip(*compact.parse_nodes(NODES))),
+                     NODES)
+  def test_parse_values(self):
+    values = ["\xc0\x00\x02\x01\x1a\xe1", "short"]
+    self.assertEqual(compact.parse_values(values),
+                     [ContactInfo("192.0.2.1", 6881)])
+  @unittest.skipUnless(compact.HAVE_NUMPY, "No numpy support")
+  def test_nodes_array(self):
+    array = compact.nodes_array(NODES)
+    self.assertEqual(list(array["port"]), [6881, 80])
+    self.assertEqual(array["id"][1].tostring(), "\x02" * 20)
+    self.assertEqual(list(array["ip"][0]), [192, 0, 2, 1])
+
+if __name__ == "__main__":
+  unittest.main()
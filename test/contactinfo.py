@@ -0,0 +1,45 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the ContactInfo class."""
+import unittest
+
+from lib.util.contactinfo import ContactInfo
+
+class TestContactInfo(unittest.TestCase):
+  def test_ipv4(self):
+    c = ContactInfo("192.0.2.1", 6881)
+    self.assertEqual(str(c.get_packed()), "\xc0\x00\x02\x01\x1a\xe1")
+    self.assertEqual(str(c.get_packed_host()), "\xc0\x00\x02\x01")
+    self.assertEqual(ContactInfo(c.get_packed()).get_tuple(),
+                     ("192.0.2.1", 6881))
+    self.assertEqual(ContactInfo("\xc0\x00\x02\x01", "\x1a\xe1"), c)
+  def test_ipv6(self):
+    c = ContactInfo("2001:db8::1", 80)
+    self.assertEqual(len(c.get_packed()), 18)
+    self.assertEqual(str(ContactInfo.from_packed(str(c.get_packed()))),
+                     "2001:db8::1:80")
+  def test_keys(self):
+    a = ContactInfo("192.0.2.1", 1)
+    b = ContactInfo("192.0.2.1", 2)
+    self.assertEqual(len(set([a, b, ContactInfo(a.get_packed())])), 2)
+    self.assertTrue(a < b)
+  def test_invalid(self):
+    self.assertRaises(ValueError, ContactInfo, "\x00" * 5)
+
+if __name__ == "__main__":
+  unittest.main()
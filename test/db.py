@@ -0,0 +1,100 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for creating and migrating the database."""
+import unittest
+from datetime import datetime
+
+from lib.sql import queries
+from lib.sql.db import create_db, SCHEMA_VERSION
+from lib.sql.thread import SQLiteThread
+from lib.util.bloom import BloomFilter
+from lib.util.contactinfo import ContactInfo
+from lib.util.sha1hash import Hash
+
+# The tables of the first release, which the later columns are missing from.
+OLD_SCRIPT = """
+CREATE TABLE servers (id INTEGER PRIMARY KEY NOT NULL,
+  hash sha1hash UNIQUE NOT NULL, bind contactinfo UNIQUE NOT NULL,
+  host contactinfo NULL, upnp BOOLEAN NOT NULL);
+CREATE TABLE buckets (id INTEGER PRIMARY KEY NOT NULL,
+  server_id INTEGER NOT NULL, start sha1hash NOT NULL, end sha1hash NOT NULL,
+  created timestamp NOT NULL, updated timestamp NOT NULL);
+CREATE INDEX buckets_server_id ON buckets(server_id);
+CREATE TABLE nodes (id INTEGER PRIMARY KEY NOT NULL, hash sha1hash NOT NULL,
+  contact contactinfo NOT NULL, bucket_id INTEGER NOT NULL,
+  good BOOLEAN NOT NULL, pending BOOLEAN NOT NULL, version BLOB NULL,
+  received INTEGER NOT NULL, sent INTEGER NOT NULL,
+  created timestamp NOT NULL, updated timestamp NOT NULL);
+CREATE INDEX nodes_hash ON nodes(hash);
+CREATE TABLE peers (id INTEGER PRIMARY KEY NOT NULL,
+  contact contactinfo UNIQUE NOT NULL, created timestamp NOT NULL,
+  updated timestamp NOT NULL);
+CREATE TABLE torrents (id INTEGER PRIMARY KEY NOT NULL,
+  hash sha1hash UNIQUE NOT NULL, created timestamp NOT NULL,
+  updated timestamp NOT NULL, seeds bloom NOT NULL, peers bloom NOT NULL);
+CREATE TABLE peer_torrents (id INTEGER PRIMARY KEY NOT NULL,
+  peer_id INTEGER NOT NULL, torrent_id INTEGER NOT NULL,
+  seed BOOLEAN NOT NULL, created timestamp NOT NULL,
+  updated timestamp NOT NULL);
+"""
+
+class TestCreateDB(unittest.TestCase):
+  def setUp(self):
+    self.thread = SQLiteThread(":memory:")
+    self.thread.start()
+  def tearDown(self):
+    self.thread.close()
+  def columns(self, table):
+    return [row["name"] for row in
+            self.thread.select("PRAGMA table_info({0})".format(table))]
+  def test_new(self):
+    create_db(self.thread)
+    self.assertTrue("server_id" in self.columns("nodes"))
+    self.assertEqual(self.thread.select_one("PRAGMA user_version")[0],
+                     SCHEMA_VERSION)
+    # Running it again on an up to date database changes nothing.
+    create_db(self.thread)
+    self.assertEqual(self.columns("nodes").count("server_id"), 1)
+  def test_migrate(self):
+    self.thread.executescript(OLD_SCRIPT)
+    now = datetime.now()
+    self.thread.execute("INSERT INTO servers VALUES (3, ?, ?, NULL, 0)",
+                        (Hash(1), ContactInfo("127.0.0.1", 6881)))
+    self.thread.execute("INSERT INTO buckets VALUES (5, 3, ?, ?, ?, ?)",
+                        (Hash(0), Hash((1 << 160) - 1), now, now))
+    self.thread.execute("""INSERT INTO nodes VALUES (7, ?, ?, 5, 1, 0, NULL,
+                           0, 0, ?, ?)""",
+                        (Hash(2), ContactInfo("10.0.0.1", 6881), now, now))
+    seeds = BloomFilter()
+    seeds.insert_host(ContactInfo("10.0.0.2", 6881))
+    self.thread.execute("INSERT INTO torrents VALUES (1, ?, ?, ?, ?, ?)",
+                        (Hash(4), now, now, seeds, BloomFilter()))
+    create_db(self.thread)
+    self.assertEqual(self.thread.select_one("PRAGMA user_version")[0],
+                     SCHEMA_VERSION)
+    node = queries.get_nodes_in_server(self.thread, 3)[0]
+    self.assertEqual((node["id"], node["server_id"], node["rtt"]),
+                     (7, 3, None))
+    torrent = queries.get_torrent_by_hash(self.thread, Hash(4))
+    self.assertTrue(torrent["seeds_estimate"] > torrent["peers_estimate"])
+    indexes = [row["name"] for row in self.thread.select(
+                 "SELECT name FROM sqlite_master WHERE type='index'")]
+    self.assertTrue("nodes_server_hash" in indexes)
+    self.assertTrue("torrents_seeds_estimate" in indexes)
+    self.assertFalse("nodes_hash" in indexes)
+    self.assertFalse("buckets_server_id" in indexes)
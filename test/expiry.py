@@ -0,0 +1,89 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the expiry of old torrent db rows."""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from lib.sql import expiry, queries
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql.thread import SQLiteThread
+from lib.util.bloom import BloomFilter
+from lib.util.contactinfo import ContactInfo
+from lib.util.sha1hash import Hash
+
+class TestExpiry(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.thread = SQLiteThread(os.path.join(self.dir, "test.db"))
+    self.thread.start()
+    self.thread.executescript(CREATE_DB_SCRIPT)
+    self.now = datetime(2013, 1, 1)
+  def tearDown(self):
+    self.thread.close()
+    shutil.rmtree(self.dir)
+  def add(self, peer, torrent, age):
+    time = self.now - timedelta(seconds=age)
+    peer_id = queries.add_peer(self.thread, peer, time)
+    row = queries.get_torrent_by_hash(self.thread, torrent)
+    if row is None:
+      torrent_id = queries.add_torrent(self.thread, torrent, time,
+                                       BloomFilter(), BloomFilter())
+    else:
+      torrent_id = row["id"]
+    queries.add_peer_torrent(self.thread, peer_id, torrent_id, False, time)
+  def count(self, table):
+    return self.thread.select_one("SELECT count(*) FROM " + table)[0]
+  def test_expire(self):
+    old, new = Hash(1), Hash(2)
+    for i in range(5):
+      self.add(ContactInfo("192.0.2.{0}".format(i), 6881), old, 500)
+    self.add(ContactInfo("192.0.2.100", 6881), new, 500)
+    self.add(ContactInfo("192.0.2.101", 6881), new, 10)
+    removed = []
+    total = expiry.expire(self.thread, 100, 1000, 2,
+                          lambda *args: removed.append(args), self.now)
+    # 6 peer_torrents and their 6 peers expire. Both torrents are within
+    # their ttl.
+    self.assertEqual(total, 12)
+    self.assertEqual(self.count("peer_torrents"), 1)
+    self.assertEqual(self.count("peers"), 1)
+    self.assertEqual(self.count("torrents"), 2)
+    self.assertEqual(len(removed), 12)
+    self.assertTrue(("peer-removed", ContactInfo("192.0.2.0", 6881))
+                    in removed)
+    self.assertTrue(("peer-torrent-removed", ContactInfo("192.0.2.100", 6881),
+                     new) in removed)
+    # Now the torrent without any peers left expires, but not the one still
+    # referred to.
+    self.assertEqual(expiry.expire(self.thread, 100, 100, 2, None, self.now),
+                     1)
+    self.assertEqual(queries.get_torrent_by_hash(self.thread, old), None)
+    self.assertNotEqual(queries.get_torrent_by_hash(self.thread, new), None)
+  def test_vacuum(self):
+    for i in range(200):
+      self.add(ContactInfo("192.0.2.{0}".format(i), 6881), Hash(i), 500)
+    self.thread.flush()
+    expiry.expire(self.thread, 100, 100, 50, None, self.now)
+    self.assertEqual(self.thread.select_one("PRAGMA auto_vacuum")[0], 2)
+    self.assertEqual(self.thread.select_one("PRAGMA freelist_count")[0], 0)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,90 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Tests for the ingest of peers into the torrent db."""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from lib.sql import ingest, queries
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql.thread import SQLiteThread
+from lib.util.bloom import BloomFilter
+from lib.util.contactinfo import ContactInfo
+from lib.util.sha1hash import Hash
+
+class TestIngest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.thread = SQLiteThread(os.path.join(self.dir, "test.db"))
+    self.thread.start()
+    self.thread.executescript(CREATE_DB_SCRIPT)
+    self.now = datetime(2013, 1, 1)
+  def tearDown(self):
+    self.thread.close()
+    shutil.rmtree(self.dir)
+  def assertInBloom(self, host, bloom):
+    expected = BloomFilter()
+    expected.insert_host(host)
+    self.assertEqual(bloom.bits & expected.bits, expected.bits)
+  def count(self, table):
+    return self.thread.select_one("SELECT count(*) FROM " + table)[0]
+  def test_add(self):
+    a, b = ContactInfo("192.0.2.1", 6881), ContactInfo("192.0.2.2", 6881)
+    result = ingest.add_torrent_peers(self.thread, Hash(1), [a, b, a], False,
+                                      self.now)
+    self.assertTrue(result.torrent_added)
+    self.assertEqual([(p.contact, p.added, p.link_added)
+                      for p in result.peers],
+                     [(a, True, True), (b, True, True)])
+    self.assertEqual(result.peers[0].id,
+                     queries.get_peer_by_contact(self.thread, a)["id"])
+    self.assertEqual(result.torrent_id,
+                     queries.get_torrent_by_hash(self.thread, Hash(1))["id"])
+    self.assertEqual(self.count("peer_torrents"), 2)
+    row = queries.get_torrent_by_hash(self.thread, Hash(1))
+    self.assertInBloom(a, row["peers"])
+    self.assertTrue(row["peers_estimate"] > row["seeds_estimate"])
+  def test_update(self):
+    a, b = ContactInfo("192.0.2.1", 6881), ContactInfo("192.0.2.2", 6881)
+    ingest.add_torrent_peers(self.thread, Hash(1), [a], False, self.now)
+    ingest.add_torrent_peers(self.thread, Hash(2), [b], False, self.now)
+    later = self.now + timedelta(seconds=10)
+    result = ingest.add_torrent_peers(self.thread, Hash(1), [a, b], True,
+                                      later)
+    self.assertFalse(result.torrent_added)
+    self.assertEqual([(p.added, p.link_added) for p in result.peers],
+                     [(False, False), (False, True)])
+    self.assertEqual(self.count("peers"), 2)
+    self.assertEqual(self.count("peer_torrents"), 3)
+    row = queries.get_torrent_by_hash(self.thread, Hash(1))
+    self.assertEqual(row["created"], self.now)
+    self.assertEqual(row["updated"], later)
+    self.assertInBloom(a, row["peers"])
+    self.assertInBloom(b, row["seeds"])
+    self.assertEqual(queries.get_peer_by_contact(self.thread, a)["updated"],
+                     later)
+  def test_rollback(self):
+    def fail(tx):
+      queries.upsert_peer(tx, ContactInfo("192.0.2.1", 6881), self.now)
+      tx.call("get_peer", ())
+    self.assertRaises(ValueError, self.thread.transaction, fail)
+    self.assertEqual(self.count("peers"), 0)
+
+if __name__ == "__main__":
+  unittest.main()
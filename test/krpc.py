@@ -0,0 +1,62 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the KRPC message helpers."""
+import unittest
+
+from lib.net.krpc import KRPCEncoder
+from lib.util.bencode import bencode
+
+ID = "\x01" * 20
+VERSION = "DP\x00\x01"
+
+def make_message(y, tid, body):
+  message = {"y": y, "t": tid, "v": VERSION}
+  message.update(body)
+  return bencode(message)
+
+class TestKRPCEncoder(unittest.TestCase):
+  def setUp(self):
+    self.krpc = KRPCEncoder(buffer(ID), VERSION)
+  def test_queries(self):
+    self.assertEqual(self.krpc.ping_query("ab"),
+                     make_message("q", "ab", {"q": "ping", "a": {"id": ID}}))
+    self.assertEqual(self.krpc.find_node_query("ab", "\x02" * 20),
+                     make_message("q", "ab", {"q": "find_node",
+                                  "a": {"id": ID, "target": "\x02" * 20}}))
+    self.assertEqual(self.krpc.query("ab", "get_peers",
+                                     {"info_hash": "x" * 20, "scrape": True}),
+                     make_message("q", "ab", {"q": "get_peers",
+                                  "a": {"id": ID, "info_hash": "x" * 20,
+                                        "scrape": 1}}))
+  def test_responses(self):
+    self.assertEqual(self.krpc.ping_response("ab"),
+                     make_message("r", "ab", {"r": {"id": ID}}))
+    self.assertEqual(self.krpc.find_node_response("ab", "n" * 52),
+                     make_message("r", "ab", {"r": {"id": ID,
+                                                    "nodes": "n" * 52}}))
+    args = {"BFsd": "b", "nodes": "", "token": "t", "values": ["a"]}
+    expected = dict(args)
+    expected["id"] = ID
+    self.assertEqual(self.krpc.response("ab", args),
+                     make_message("r", "ab", {"r": expected}))
+  def test_error(self):
+    self.assertEqual(self.krpc.error("ab", [203, "x"]),
+                     make_message("e", "ab", {"e": [203, "x"]}))
+
+if __name__ == "__main__":
+  unittest.main()
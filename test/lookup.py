@@ -0,0 +1,179 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the iterative lookup, over a simulated network."""
+import random
+import unittest
+
+from lib.net.krpc import decode_message
+from lib.net.lookup import Lookup, K
+from lib.util import compact
+from lib.util.contactinfo import ContactInfo
+from lib.util.scheduler import Scheduler
+from lib.util.sha1hash import Hash
+
+class SimulatedNetwork(object):
+  """A network of size nodes with routing tables like a Kademlia node's:
+  up to K random nodes at each distance 2**i to 2**(i+1). A dead fraction
+  of them never answer. Round trips take latency seconds, given as a range,
+  and a query with no answer times out after timeout seconds. Time is
+  simulated on scheduler."""
+  def __init__(self, size, seed=0, dead=0.1, latency=(0.05, 0.3),
+               timeout=2.0):
+    self.random = random.Random(seed)
+    self.now = [0.0]
+    self.scheduler = Scheduler(lambda: self.now[0])
+    self.latency = latency
+    self.timeout = timeout
+    self.hashes = [Hash(self.random.getrandbits(160)) for i in range(size)]
+    self.contacts = dict((hash, ContactInfo("10.{0}.{1}.{2}".format(
+                          i >> 16, (i >> 8) & 255, i & 255), 6881))
+                         for i, hash in enumerate(self.hashes))
+    self.by_contact = dict((c, h) for h, c in self.contacts.iteritems())
+    self.dead = set(self.random.sample(self.hashes, int(size * dead)))
+    self.tables = {}
+    for hash in self.hashes:
+      levels = {}
+      for other in self.hashes:
+        if other != hash:
+          levels.setdefault((hash.get_int() ^ other.get_int()).bit_length(),
+                            []).append(other)
+      self.tables[hash] = [other for nodes in levels.itervalues()
+                           for other in self.random.sample(nodes,
+                                                           min(K, len(nodes)))]
+  def closest(self, hashes, target, number=K):
+    return sorted(hashes, key=lambda hash: hash.get_int() ^ target.get_int()
+                  )[:number]
+  def alive_closest(self, target):
+    return self.closest([h for h in self.hashes if h not in self.dead],
+                        target)
+  def seeds(self, hash, target):
+    """The nodes a lookup from the node hash starts with."""
+    return [(h, self.contacts[h])
+            for h in self.closest(self.tables[hash], target)]
+  def sender(self, target):
+    """Returns a send function for a Lookup of target."""
+    def send(contact, callback):
+      hash = self.by_contact[contact]
+      if hash in self.dead:
+        self.scheduler.call_later(self.timeout, callback, None)
+      else:
+        nodes = [(h, self.contacts[h])
+                 for h in self.closest(self.tables[hash], target)]
+        message = {"y": "r", "r": {"id": hash.get_20(),
+                                   "nodes": compact.pack_nodes(nodes)}}
+        self.scheduler.call_later(self.random.uniform(*self.latency),
+                                  callback, message)
+      return True
+    return send
+  def run(self, lookup):
+    """Runs lookup to the end. Returns the simulated time it took."""
+    start = self.now[0]
+    lookup.start()
+    while self.scheduler.next_due() is not None:
+      self.now[0] = self.scheduler.next_due()
+      self.scheduler.run_due()
+    return self.now[0] - start
+
+class TestLookup(unittest.TestCase):
+  def setUp(self):
+    self.network = SimulatedNetwork(300)
+    self.origin = [h for h in self.network.hashes
+                   if h not in self.network.dead][0]
+  def lookup(self, target, alpha, **kwargs):
+    return Lookup(target, self.network.sender(target),
+                  self.network.seeds(self.origin, target), alpha=alpha,
+                  exclude=self.origin, **kwargs)
+  def test_converge(self):
+    done = []
+    for i in range(10):
+      target = Hash(self.network.random.getrandbits(160))
+      lookup = self.lookup(target, 3, done=done.append)
+      self.network.run(lookup)
+      self.assertTrue(lookup.finished)
+      expected = [h for h in self.network.alive_closest(target)
+                  if h != self.origin]
+      self.assertEqual([h for h, c in lookup.get_closest()], expected[:K])
+    self.assertEqual(len(done), 10)
+  def test_parallel(self):
+    # Sequential single hops, one query at a time, find the same nodes but
+    # take longer, mostly waiting on timeouts one after another.
+    parallel = sequential = 0
+    for i in range(10):
+      target = Hash(self.network.random.getrandbits(160))
+      fast = self.lookup(target, 3)
+      parallel += self.network.run(fast)
+      slow = self.lookup(target, 1)
+      sequential += self.network.run(slow)
+      self.assertEqual(fast.get_closest(), slow.get_closest())
+    self.assertTrue(parallel < sequential)
+  def test_bootstrap(self):
+    # A lookup can start from an address alone.
+    target = Hash(self.network.random.getrandbits(160))
+    lookup = Lookup(target, self.network.sender(target),
+                    contacts=[self.network.contacts[self.origin]])
+    self.network.run(lookup)
+    self.assertEqual([h for h, c in lookup.get_closest()],
+                     self.network.alive_closest(target))
+    self.assertTrue(lookup.get_rounds() >= 2)
+  def test_dead(self):
+    target = Hash(1)
+    lookup = Lookup(target, self.network.sender(target),
+                    [(h, self.network.contacts[h])
+                     for h in list(self.network.dead)[:3]])
+    self.assertEqual(self.network.run(lookup), self.network.timeout)
+    self.assertTrue(lookup.finished)
+    self.assertEqual(lookup.get_closest(), [])
+    self.assertEqual(lookup.queries, 3)
+  def test_malformed(self):
+    # A node that answers with nodes or values of the wrong type, or that
+    # don't decode, counts as having answered, and the lookup carries on
+    # without what it sent. With one query at a time it is the only one in
+    # flight when it answers.
+    target = Hash(self.network.random.getrandbits(160))
+    seeds = self.network.seeds(self.origin, target)
+    bad = seeds[0][1]
+    id = str(self.network.by_contact[bad].get_20())
+    messages = [{"y": "r", "r": {"id": id, "nodes": 5, "values": [5]}}]
+    for field in ("5:nodesi03e", "6:valuesli-0ee", "6:valuesl02:abe"):
+      messages.append(decode_message("d1:rd2:id20:" + id + field +
+                                     "e1:t2:aa1:y1:re"))
+    send = self.network.sender(target)
+    expected = [h for h in self.network.alive_closest(target)
+                if h != self.origin]
+    for message in messages:
+      def sender(contact, callback):
+        if contact != bad:
+          return send(contact, callback)
+        self.network.scheduler.call_later(0.1, callback, message)
+        return True
+      done = []
+      lookup = Lookup(target, sender, seeds, alpha=1, exclude=self.origin,
+                      done=done.append)
+      self.network.run(lookup)
+      self.assertTrue(lookup.finished)
+      self.assertEqual(len(done), 1)
+      self.assertEqual(lookup.peers, set())
+      self.assertEqual([h for h, c in lookup.get_closest()], expected[:K])
+  def test_not_sent(self):
+    done = []
+    lookup = Lookup(Hash(1), lambda contact, callback: False,
+                    self.network.seeds(self.origin, Hash(1)),
+                    done=done.append).start()
+    self.assertTrue(lookup.finished)
+    self.assertEqual(lookup.queries, 0)
+    self.assertEqual(len(done), 1)
@@ -0,0 +1,66 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the change notification aggregator."""
+import unittest
+
+from lib.net.notify import Notifier
+
+class TestNotifier(unittest.TestCase):
+  def setUp(self):
+    self.deltas = []
+    self.scheduled = []
+    self.notifier = Notifier(self.deltas.append,
+                             lambda ms, func: self.scheduled.append(func))
+  def test_batch(self):
+    # One delivery is scheduled for any number of changes until it runs.
+    for i in range(100):
+      self.notifier.note("node-changed", i % 10)
+    self.notifier.note("bucket-split", 1, 2)
+    self.notifier.note("peer-torrent-added", "peer", "torrent")
+    self.assertEqual(len(self.scheduled), 1)
+    self.assertFalse(self.scheduled.pop()())
+    delta, = self.deltas
+    self.assertEqual(delta.changed("node"), set(range(10)))
+    self.assertEqual(delta.added("bucket"), set([2]))
+    self.assertEqual(delta.changed("bucket"), set([1]))
+    self.assertEqual(delta.added("peer-torrent"), set([("peer", "torrent")]))
+    self.assertEqual(delta.removed("torrent"), set())
+    self.assertEqual(len(delta), 13)
+    self.notifier.note("node-changed", 1)
+    self.assertEqual(len(self.scheduled), 1)
+  def test_merge(self):
+    note = self.notifier.note
+    note("node-added", "a")
+    note("node-changed", "a") # still new to the view
+    note("node-added", "b")
+    note("node-removed", "b") # never seen by the view
+    note("node-changed", "c")
+    note("node-removed", "c")
+    note("node-removed", "d")
+    note("node-added", "d") # the view still has the old row
+    self.scheduled.pop()()
+    delta, = self.deltas
+    self.assertEqual(delta.added("node"), set(["a"]))
+    self.assertEqual(delta.changed("node"), set(["d"]))
+    self.assertEqual(delta.removed("node"), set(["c"]))
+  def test_empty(self):
+    note = self.notifier.note
+    note("torrent-added", "a")
+    note("torrent-removed", "a")
+    self.scheduled.pop()()
+    self.assertEqual(self.deltas, [])
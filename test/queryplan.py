@@ -0,0 +1,57 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Query plan regression tests for the statements in queries.py.
+
+Every registered statement is run through EXPLAIN QUERY PLAN against the
+schema, and any that reads a whole table fails unless it is declared with
+scan=True."""
+import unittest
+
+from lib.sql import queries, statements
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql.thread import SQLiteThread
+
+class TestQueryPlan(unittest.TestCase):
+  def setUp(self):
+    self.thread = SQLiteThread(":memory:")
+    self.thread.start()
+    self.thread.executescript(CREATE_DB_SCRIPT)
+  def tearDown(self):
+    self.thread.close()
+  def get_plan(self, stmt):
+    return [row[3] for row in
+            self.thread.select("EXPLAIN QUERY PLAN " + stmt.sql,
+                               (None,) * stmt.arity)]
+  def test_no_scans(self):
+    scans = []
+    for stmt in statements.STATEMENTS.itervalues():
+      if stmt.scan:
+        continue
+      for detail in self.get_plan(stmt):
+        if detail.startswith("SCAN "):
+          scans.append("{0}: {1}".format(stmt.name, detail))
+    self.assertEqual(scans, [])
+  def test_indexes(self):
+    for name, index in (("get_buckets_in_server", "buckets_server_range"),
+                        ("get_peer_torrent_by_peer_and_torrent",
+                         "peer_torrents_peer_torrent")):
+      plan = self.get_plan(statements.get_statement(name))
+      self.assertTrue(index in plan[0], "{0}: {1}".format(name, plan))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,238 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Tests for the in memory routing table and its database mirror."""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from lib.net.routingtable import (RoutingTable, MAX_BUCKET_SIZE, IDLE_TIMEOUT,
+                                  PING_TIMEOUT, LOAD_SPREAD, MAX_FAILURES,
+                                  iter_buckets)
+from lib.sql import queries
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql.thread import SQLiteThread
+from lib.util.contactinfo import ContactInfo
+from lib.util.sha1hash import Hash
+
+OWN_ID = Hash(1 << 159)
+
+def contact(i):
+  return ContactInfo("10.0.{0}.{1}".format(*divmod(i, 256)), 6881)
+
+class TestRoutingTable(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.thread = SQLiteThread(os.path.join(self.dir, "test.db"), 100, 10)
+    self.thread.start()
+    self.thread.executescript(CREATE_DB_SCRIPT)
+    self.server = queries.add_server(self.thread, OWN_ID,
+                                     ContactInfo("127.0.0.1", 6881), None,
+                                     False)
+    self.changes = []
+    self.pings = []
+    self.table = self.new_table()
+  def tearDown(self):
+    self.thread.close()
+    shutil.rmtree(self.dir)
+  def new_table(self):
+    return RoutingTable(self.thread, self.server, OWN_ID,
+                        lambda *args: self.changes.append(args),
+                        self.pings.append)
+  def db_rows(self, table):
+    return sorted(dict((k, row[k]) for k in row.keys() if k != "server_id")
+                  for row in self.thread.select("SELECT * FROM " + table))
+  def test_add(self):
+    self.table.add_node(contact(1), Hash(1), "v1", True)
+    row = self.table.get_node_row(Hash(1))
+    self.assertEqual(row["contact"], contact(1))
+    self.assertEqual(row["received"], 1)
+    self.assertEqual(self.table.get_node_row(contact(1))["id"], row["id"])
+    self.assertEqual(self.table.get_node_row(contact(2)), None)
+    self.table.add_node_sent(contact(1))
+    self.table.add_node(contact(1), Hash(1), "v2", True)
+    row = self.table.get_node_row(Hash(1))
+    self.assertEqual((row["sent"], row["received"], str(row["version"])),
+                     (1, 2, "v2"))
+    self.assertEqual([c[0] for c in self.changes],
+                     ["node-added", "bucket-changed", "node-changed",
+                      "node-changed"])
+    self.assertEqual(self.table.get_closest(Hash(3)), [(Hash(1), contact(1))])
+  def test_split(self):
+    # Nodes on our side of the id space split the bucket we are in, the rest
+    # fill up the far half and then wait as pending replacements.
+    for i in range(3 * MAX_BUCKET_SIZE):
+      self.table.add_node(contact(i), Hash((i + 1) << 150))
+    buckets = self.table.get_bucket_rows()
+    self.assertEqual(len(buckets), 2)
+    self.assertEqual(buckets[1]["start"], OWN_ID)
+    nodes = self.table.get_node_rows()
+    self.assertEqual(len(nodes), 3 * MAX_BUCKET_SIZE)
+    self.assertEqual(len([n for n in nodes if n["pending"]]),
+                     2 * MAX_BUCKET_SIZE)
+    self.assertTrue(("bucket-split", buckets[0]["id"], buckets[1]["id"])
+                    in self.changes)
+  def test_rtt(self):
+    hash = Hash.from_20(os.urandom(20))
+    # A node has to be added before its rtt can be recorded.
+    self.table.set_node_rtt(hash, 0.5)
+    self.table.add_node(contact(0), hash, None, True)
+    self.assertEqual(self.table.get_node_row(hash)["rtt"], None)
+    self.table.set_node_rtt(hash, 0.25)
+    self.assertEqual(self.table.get_node_row(hash)["rtt"], 0.25)
+  def test_mirror(self):
+    for i in range(3 * MAX_BUCKET_SIZE):
+      self.table.add_node(contact(i), Hash.from_20(os.urandom(20)), None,
+                          True)
+    self.table.set_node_rtt(self.table.get_node_rows()[0]["hash"], 0.25)
+    self.thread.flush()
+    self.assertEqual(self.db_rows("buckets"),
+                     sorted(self.table.get_bucket_rows()))
+    self.assertEqual(self.db_rows("nodes"), sorted(self.table.get_node_rows()))
+    # A table loaded from the database is the same as the one that wrote it.
+    table = self.new_table()
+    self.assertEqual(sorted(table.get_node_rows()),
+                     sorted(self.table.get_node_rows()))
+    self.assertEqual(sorted(table.get_bucket_rows()),
+                     sorted(self.table.get_bucket_rows()))
+  def test_timers(self):
+    for i in range(MAX_BUCKET_SIZE + 1):
+      self.table.add_node(contact(i), Hash(i + 1))
+    self.assertTrue(self.table.get_node_row(Hash(MAX_BUCKET_SIZE + 1))
+                    ["pending"])
+    self.assertEqual(self.table.scheduler.run_due(), 0)
+    # Idle nodes are pinged, and so is one node in every idle bucket that
+    # has any.
+    idle = datetime.now() - timedelta(seconds=IDLE_TIMEOUT + 1)
+    for node in self.table._nodes.itervalues():
+      if not node.pending:
+        node.updated = idle
+    for bucket in iter_buckets(self.table._root):
+      bucket.updated = idle
+    self.table.scheduler.run_due(time.time() + IDLE_TIMEOUT + 1)
+    self.assertEqual(len(self.pings), MAX_BUCKET_SIZE + 1)
+    # The nodes that do not answer go bad, and the pending node takes the
+    # place of one of them.
+    self.table.add_node(contact(0), Hash(1))
+    self.table.scheduler.run_due(time.time() + IDLE_TIMEOUT + PING_TIMEOUT
+                                 + 1)
+    rows = self.table.get_node_rows()
+    self.assertEqual(len(rows), MAX_BUCKET_SIZE)
+    self.assertEqual(len([r for r in rows if r["good"]]), 2)
+    self.assertTrue(self.table.get_node_row(Hash(1))["good"])
+    self.assertFalse(self.table.get_node_row(Hash(MAX_BUCKET_SIZE + 1))
+                     ["pending"])
+    # A bad node that is heard from again is good.
+    bad = [r["hash"] for r in rows if not r["good"]][0]
+    self.table.add_node(contact(bad.get_int() - 1), bad)
+    self.assertTrue(self.table.get_node_row(bad)["good"])
+    # and is checked again once it has been idle for too long.
+    del self.pings[:]
+    self.table._nodes[bad].updated = idle
+    self.table.scheduler.run_due(time.time() + 2 * IDLE_TIMEOUT)
+    self.assertEqual(self.pings.count(contact(bad.get_int() - 1).get_tuple()),
+                     1)
+    self.thread.flush()
+    state = lambda rows: sorted((r["id"], bool(r["good"]), bool(r["pending"]))
+                                for r in rows)
+    self.assertEqual(state(self.db_rows("nodes")),
+                     state(self.table.get_node_rows()))
+  def test_failed(self):
+    for i in range(MAX_BUCKET_SIZE + 2):
+      self.table.add_node(contact(i), Hash(i + 1))
+    # A pending node is dropped after one timeout, a good node goes bad after
+    # MAX_FAILURES in a row and a pending node takes its place.
+    self.table.add_node_failed(contact(MAX_BUCKET_SIZE + 1))
+    self.assertEqual(self.table.get_node_row(Hash(MAX_BUCKET_SIZE + 2)), None)
+    for i in range(MAX_FAILURES - 1):
+      self.table.add_node_failed(contact(0))
+    self.table.add_node(contact(0), Hash(1))
+    self.table.add_node_failed(contact(0))
+    self.assertTrue(self.table.get_node_row(Hash(1))["good"])
+    for i in range(MAX_FAILURES - 1):
+      self.table.add_node_failed(contact(0))
+    self.assertEqual(self.table.get_node_row(Hash(1)), None)
+    self.assertFalse(self.table.get_node_row(Hash(MAX_BUCKET_SIZE + 1))
+                     ["pending"])
+    self.table.add_node_failed(contact(100))
+  def test_load_spread(self):
+    # Checks that came due while the table was not loaded are spread out
+    # instead of all running at once.
+    for i in range(MAX_BUCKET_SIZE):
+      self.table.add_node(contact(i), Hash(i + 1))
+    idle = datetime.now() - timedelta(seconds=2 * IDLE_TIMEOUT)
+    self.thread.execute("UPDATE nodes SET updated=?", (idle,))
+    self.thread.execute("UPDATE buckets SET updated=?", (idle,))
+    start = time.time()
+    table = self.new_table()
+    now = time.time()
+    self.assertTrue(start <= table.scheduler.next_due() <= now + LOAD_SPREAD)
+    self.assertEqual(table.scheduler.run_due(now + LOAD_SPREAD),
+                     MAX_BUCKET_SIZE + 1)
+    self.assertEqual(len(self.pings), MAX_BUCKET_SIZE + 1)
+  def test_tree(self):
+    for i in range(1000):
+      self.table.add_node(contact(i), Hash.from_20(os.urandom(20)))
+    buckets = list(iter_buckets(self.table._root))
+    self.assertTrue(len(buckets) > 2)
+    self.assertEqual(buckets[0].start, 0)
+    for lower, upper in zip(buckets, buckets[1:]):
+      self.assertEqual(lower.end, upper.start)
+    for bucket in buckets:
+      self.assertTrue(self.table._get_bucket(bucket.start) is bucket)
+      self.assertTrue(self.table._get_bucket(bucket.end - 1) is bucket)
+      for node in bucket.nodes + bucket.pending:
+        self.assertTrue(node.bucket is bucket)
+        self.assertTrue(bucket.start <= node.hash.get_int() < bucket.end)
+  def test_load_old_ranges(self):
+    # Older versions split the first bucket at (2**160 - 1) / 2, one below
+    # the middle, and could leave gaps between the buckets.
+    now = datetime.now()
+    top = (1 << 160) - 1
+    self.thread.execute("DELETE FROM buckets")
+    for id, start, end in ((10, 0, top / 2 - 1),
+                           (11, top / 2, top / 2 + top / 4),
+                           (12, top / 2 + top / 4, top)):
+      queries.create_bucket(self.thread, id, Hash(start), Hash(end), now,
+                            self.server)
+    queries.create_node(self.thread, 1, self.server, Hash(top / 2), contact(1),
+                        10, True, False, None, 0, 0, now)
+    table = self.new_table()
+    self.assertEqual([b["id"] for b in table.get_bucket_rows()], [10, 11, 12])
+    self.assertEqual(table.get_node_row(Hash(top / 2))["bucket_id"], 11)
+    self.assertTrue(table._get_bucket(top / 2 - 1) is table._bucket_ids[10])
+    self.assertTrue(table._get_bucket(top) is table._bucket_ids[12])
+    self.thread.flush()
+    self.assertEqual(self.thread.select_one("SELECT bucket_id FROM nodes")[0],
+                     11)
+    self.assertEqual([(row[0], row[1]) for row in
+                      self.thread.select("""SELECT id, end FROM buckets
+                                            ORDER BY id""")],
+                     [(10, Hash(top / 2)), (11, Hash(top / 2 + top / 4)),
+                      (12, Hash(top))])
+  def test_ids(self):
+    self.table.add_node(contact(1), Hash(1))
+    self.thread.flush()
+    table = self.new_table()
+    table.add_node(contact(2), Hash(2))
+    self.assertTrue(table.get_node_row(Hash(2))["id"] >
+                    table.get_node_row(Hash(1))["id"])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,56 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the timer heap."""
+import unittest
+
+from lib.util.scheduler import Scheduler
+
+class TestScheduler(unittest.TestCase):
+  def setUp(self):
+    self.now = [100.0]
+    self.scheduler = Scheduler(lambda: self.now[0])
+    self.calls = []
+  def test_order(self):
+    self.scheduler.call_later(3, self.calls.append, "c")
+    self.scheduler.call_at(101, self.calls.append, "a")
+    self.scheduler.call_later(1, self.calls.append, "b")
+    self.assertEqual(self.scheduler.next_due(), 101)
+    self.assertEqual(self.scheduler.run_due(), 0)
+    self.now[0] = 103
+    self.assertEqual(self.scheduler.run_due(limit=2), 2)
+    self.assertEqual(self.calls, ["a", "b"])
+    self.assertEqual(self.scheduler.run_due(), 1)
+    self.assertEqual(self.calls, ["a", "b", "c"])
+    self.assertEqual(self.scheduler.next_due(), None)
+  def test_cancel(self):
+    entry = self.scheduler.call_later(1, self.calls.append, "a")
+    self.scheduler.call_later(2, self.calls.append, "b")
+    self.scheduler.cancel(entry)
+    self.assertEqual(self.scheduler.next_due(), 102)
+    self.assertEqual(self.scheduler.run_due(200), 1)
+    self.assertEqual(self.calls, ["b"])
+  def test_reschedule(self):
+    # A call that adds itself again runs once per run_due, even if the new
+    # time is already due.
+    def tick():
+      self.calls.append(self.now[0])
+      self.scheduler.call_later(1, tick)
+    self.scheduler.call_later(1, tick)
+    self.assertEqual(self.scheduler.run_due(1000), 1)
+    self.assertEqual(self.scheduler.run_due(1000), 1)
+    self.assertEqual(len(self.scheduler), 1)
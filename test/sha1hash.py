@@ -0,0 +1,52 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the Hash class."""
+import unittest
+import weakref
+
+from lib.util import sha1hash
+from lib.util.sha1hash import Hash, intern_hash
+
+HEX = "991b2fa313d425258ae99b7a9841940c0a0bc998"
+
+class TestHash(unittest.TestCase):
+  def test_forms(self):
+    h = Hash(HEX)
+    self.assertEqual(h.get_hex(), HEX)
+    self.assertEqual(Hash(h.get_int()).get_hex(), HEX)
+    self.assertEqual(Hash(h.get_20()).get_int(), int(HEX, 16))
+    self.assertEqual(str(Hash(1).get_20()), "\x00" * 19 + "\x01")
+    self.assertEqual(Hash("\x01").get_int(), 1)
+    self.assertRaises(ValueError, Hash, 1 << 160)
+  def test_equality(self):
+    self.assertEqual(Hash(HEX), Hash(int(HEX, 16)))
+    self.assertNotEqual(Hash(1), Hash(2))
+    self.assertEqual(len(set([Hash(1), Hash("\x01"), Hash(2)])), 2)
+  def test_intern(self):
+    self.assertTrue(intern_hash(HEX) is intern_hash(Hash(HEX).get_20()))
+  def test_intern_dead(self):
+    # An entry whose hash has died but whose callback hasn't removed it yet.
+    hash = Hash(3)
+    sha1hash._interned.data[hash._20] = weakref.KeyedRef(hash, lambda r: None,
+                                                         hash._20)
+    del hash
+    self.assertEqual(intern_hash(3), Hash(3))
+    self.assertTrue(intern_hash(3) is intern_hash(3))
+
+if __name__ == "__main__":
+  unittest.main()
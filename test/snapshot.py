@@ -0,0 +1,64 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the routing table snapshot file format."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib.net import snapshot
+from lib.net.snapshot import SnapshotNode
+from lib.util.contactinfo import ContactInfo
+from lib.util.sha1hash import Hash
+
+class TestSnapshot(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, "nodes.snapshot")
+    self.nodes = [
+      SnapshotNode(Hash(1), ContactInfo("192.0.2.1", 6881), 1300000000, 0.25),
+      SnapshotNode(Hash(2), ContactInfo("2001:db8::1", 6882), 1300000001,
+                   None),
+    ]
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+  def test_round_trip(self):
+    snapshot.write_snapshot(self.path, [(Hash(10), self.nodes),
+                                        (Hash(11), [])])
+    servers = snapshot.read_snapshot(self.path)
+    self.assertEqual(sorted(servers.keys()),
+                     [str(Hash(10).get_20()), str(Hash(11).get_20())])
+    self.assertEqual(servers[str(Hash(10).get_20())], self.nodes)
+    self.assertEqual(servers[str(Hash(11).get_20())], [])
+    self.assertFalse(os.path.exists(self.path + ".tmp"))
+  def test_missing(self):
+    self.assertEqual(snapshot.read_snapshot(self.path), {})
+  def test_corrupt(self):
+    snapshot.write_snapshot(self.path, [(Hash(10), self.nodes)])
+    data = open(self.path, "rb").read()
+    open(self.path, "wb").write(data[:-3])
+    self.assertRaises(ValueError, snapshot.read_snapshot, self.path)
+    open(self.path, "wb").write("garbage")
+    self.assertRaises(ValueError, snapshot.read_snapshot, self.path)
+  def test_sort(self):
+    fast = self.nodes[0]._replace(rtt=0.01)
+    order = snapshot.sort_for_warm_start(self.nodes + [fast])
+    self.assertEqual(order, [fast, self.nodes[0], self.nodes[1]])
+
+if __name__ == "__main__":
+  unittest.main()
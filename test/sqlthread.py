@@ -0,0 +1,161 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the SQLiteThread connection wrapper."""
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from lib.sql.thread import SQLiteThread, ReaderPool
+
+class TestSQLiteThread(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, "test.db")
+    self.thread = SQLiteThread(self.path)
+    self.thread.start()
+    self.thread.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v INTEGER)")
+  def tearDown(self):
+    if self.thread.is_alive():
+      self.thread.close()
+    shutil.rmtree(self.dir)
+  def test_select(self):
+    rowid = self.thread.insert("INSERT INTO t (v) VALUES (?)", (5,))
+    self.assertEqual(self.thread.select_one("SELECT v FROM t WHERE id=?",
+                                            (rowid,))[0], 5)
+  def test_error(self):
+    self.assertRaises(ValueError, self.thread.select, "SELECT * FROM nope")
+    self.assertEqual(self.thread.select_one("SELECT 1")[0], 1)
+  def test_async(self):
+    done = threading.Event()
+    result = []
+    def callback(rows):
+      result.extend(rows)
+      done.set()
+    self.thread.execute("INSERT INTO t (v) VALUES (?)", (7,))
+    self.thread.select_async("SELECT v FROM t", callback=callback)
+    done.wait(5)
+    self.assertEqual([r[0] for r in result], [7])
+  def test_concurrent(self):
+    errors = []
+    def worker(n):
+      for i in range(50):
+        if self.thread.select_one("SELECT ?", (n,))[0] != n:
+          errors.append(n)
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for w in workers:
+      w.start()
+    for w in workers:
+      w.join()
+    self.assertEqual(errors, [])
+  def test_batch(self):
+    self.thread.close()
+    self.thread = SQLiteThread(self.path, 100, 10)
+    self.thread.start()
+    for i in range(25):
+      self.thread.execute("INSERT INTO t (v) VALUES (?)", (i,))
+    self.assertEqual(self.thread.select_one("SELECT count(*) FROM t")[0], 25)
+    conn = sqlite3.connect(self.path)
+    self.assertEqual(conn.execute("SELECT count(*) FROM t").fetchone()[0], 0)
+    self.thread.flush()
+    self.assertEqual(conn.execute("SELECT count(*) FROM t").fetchone()[0], 25)
+    conn.close()
+    self.assertEqual(self.thread.get_batch_stats(), (1, 25.0))
+  def test_readers(self):
+    self.assertTrue(isinstance(self.thread.readers, ReaderPool))
+    self.thread.execute("INSERT INTO t (v) VALUES (?)", (3,))
+    self.thread.flush()
+    readers = self.thread.readers
+    self.assertEqual(readers.select_one("SELECT v FROM t")[0], 3)
+    self.assertEqual(str(readers.select_one("SELECT xor(?, ?)",
+                                            (buffer("\x01"),
+                                             buffer("\x03")))[0]), "\x02")
+    self.assertRaises(ValueError, readers.select, "DELETE FROM t")
+    self.assertEqual(self.thread.select_one("PRAGMA journal_mode")[0], "wal")
+  def test_memory_readers(self):
+    thread = SQLiteThread(":memory:")
+    self.assertTrue(thread.readers is thread)
+  def test_close(self):
+    for i in range(100):
+      self.thread.execute("INSERT INTO t (v) VALUES (?)", (i,))
+    self.thread.close()
+    self.assertFalse(self.thread.is_alive())
+    self.assertRaises(RuntimeError, self.thread.execute, "SELECT 1")
+    conn = sqlite3.connect(self.path)
+    self.assertEqual(conn.execute("SELECT count(*) FROM t").fetchone()[0], 100)
+    conn.close()
+
+  def test_batch_error(self):
+    self.thread.close()
+    self.thread = SQLiteThread(self.path, 100, 10)
+    self.thread.start()
+    started, release = threading.Event(), threading.Event()
+    def hold(tx):
+      started.set()
+      release.wait(5)
+    holder = threading.Thread(target=self.thread.transaction, args=(hold,))
+    holder.start()
+    started.wait(5)
+    # Queued behind hold() so they all go into one batch; the third one
+    # reuses the first one's id.
+    for i in (1, 2, 1, 3, 4):
+      self.thread.execute("INSERT INTO t (id, v) VALUES (?, ?)", (i, i))
+    release.set()
+    holder.join()
+    self.assertEqual([r[0] for r in self.thread.select("SELECT id FROM t")],
+                     [1, 2, 3, 4])
+  def test_commit_error(self):
+    # A deferred foreign key is only checked at COMMIT, which fails and
+    # leaves the transaction open.
+    self.thread.executescript("""PRAGMA foreign_keys=ON;
+      CREATE TABLE c (id INTEGER PRIMARY KEY, t_id INTEGER
+                      REFERENCES t(id) DEFERRABLE INITIALLY DEFERRED);""")
+    self.thread.execute("INSERT INTO c (t_id) VALUES (?)", (5,))
+    self.thread.execute("INSERT INTO t (v) VALUES (?)", (1,))
+    # Flush from another thread, so that a dead DB thread fails the test
+    # instead of hanging it.
+    flusher = threading.Thread(target=self.thread.flush)
+    flusher.daemon = True
+    flusher.start()
+    flusher.join(5)
+    self.assertTrue(self.thread.is_alive())
+    self.assertFalse(flusher.is_alive())
+    self.assertEqual(self.thread.select_one("SELECT count(*) FROM c")[0], 0)
+    self.assertEqual(self.thread.select_one("SELECT count(*) FROM t")[0], 1)
+  def test_transaction_error(self):
+    def fail(tx):
+      raise KeyError("missing")
+    self.assertRaises(KeyError, self.thread.transaction, fail)
+    self.assertEqual(self.thread.select_one("SELECT 1")[0], 1)
+  def test_close_batched(self):
+    self.thread.close()
+    self.thread = SQLiteThread(self.path, 100, 10)
+    self.thread.start()
+    # close() while the writes are still being gathered into a batch.
+    for i in range(10):
+      self.thread.execute("INSERT INTO t (v) VALUES (?)", (i,))
+    self.thread.close()
+    self.assertFalse(self.thread.is_alive())
+    conn = sqlite3.connect(self.path)
+    self.assertEqual(conn.execute("SELECT count(*) FROM t").fetchone()[0], 10)
+    conn.close()
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,78 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the named statement registry and the queries declared in it."""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from lib.sql import queries, statements
+from lib.sql.db import CREATE_DB_SCRIPT
+from lib.sql.thread import SQLiteThread
+from lib.util.contactinfo import ContactInfo
+from lib.util.sha1hash import Hash
+
+class TestStatements(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.thread = SQLiteThread(os.path.join(self.dir, "test.db"))
+    self.thread.start()
+    self.thread.executescript(CREATE_DB_SCRIPT)
+  def tearDown(self):
+    self.thread.close()
+    shutil.rmtree(self.dir)
+  def test_compile(self):
+    for stmt in statements.STATEMENTS.itervalues():
+      self.thread.select("EXPLAIN " + stmt.sql, (None,) * stmt.arity)
+  def test_shapes(self):
+    now = datetime.now()
+    hash = Hash(12345)
+    server = queries.add_server(self.thread, hash,
+                                ContactInfo("127.0.0.1", 6881), None, False)
+    self.assertEqual(queries.get_server_by_hash(self.thread, hash)["id"],
+                     server)
+    self.assertEqual(queries.get_num_buckets(self.thread, server), 0)
+    bucket = self.thread.next_id("buckets")
+    queries.create_bucket(self.thread, bucket, Hash(0), Hash(1 << 159), now,
+                          server)
+    queries.set_bucket_updated(self.thread, bucket, now)
+    self.assertEqual(queries.get_num_buckets(self.thread, server), 1)
+    self.assertEqual([r["id"] for r in
+                      queries.get_buckets_in_server(self.thread, server)],
+                     [bucket])
+    self.assertTrue(queries.get_bucket(self.thread, bucket + 1) is None)
+    self.thread.flush()
+    self.assertEqual(queries.get_num_buckets(self.thread.readers, server), 1)
+  def test_errors(self):
+    self.assertRaises(ValueError, self.thread.call, "no_such_statement")
+    self.assertRaises(ValueError, self.thread.call, "get_bucket", ())
+    self.assertRaises(ValueError, self.thread.readers.call, "delete_node",
+                      (1,))
+  def test_stats(self):
+    statements.reset_stats()
+    for i in range(3):
+      queries.get_bucket(self.thread, i)
+    queries.delete_node(self.thread, 1)
+    self.thread.flush()
+    stats = dict((name, calls) for name, calls, seconds
+                 in statements.get_stats())
+    self.assertEqual(stats, {"get_bucket": 3, "delete_node": 1})
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,44 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the get_peers token manager."""
+import unittest
+
+from lib.net.tokens import TokenManager
+from lib.util.contactinfo import ContactInfo
+
+class TestTokenManager(unittest.TestCase):
+  def setUp(self):
+    self.tokens = TokenManager()
+    self.contact = ContactInfo("192.0.2.1", 6881)
+    self.other = ContactInfo("192.0.2.2", 6881)
+  def test_check(self):
+    token = self.tokens.get_token(self.contact)
+    self.assertEqual(token, self.tokens.get_token(self.contact))
+    self.assertTrue(self.tokens.check_token(self.contact, token))
+    self.assertFalse(self.tokens.check_token(self.other, token))
+    self.assertFalse(self.tokens.check_token(self.contact, "x" * len(token)))
+  def test_rotate(self):
+    token = self.tokens.get_token(self.contact)
+    self.tokens.rotate()
+    self.assertTrue(self.tokens.check_token(self.contact, token))
+    self.assertNotEqual(token, self.tokens.get_token(self.contact))
+    self.tokens.rotate()
+    self.assertFalse(self.tokens.check_token(self.contact, token))
+
+if __name__ == "__main__":
+  unittest.main()
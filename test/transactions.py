@@ -0,0 +1,94 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the outstanding transaction table."""
+import unittest
+
+from lib.net.transactions import TransactionManager
+from lib.util.contactinfo import ContactInfo
+from lib.util.scheduler import Scheduler
+
+A = ContactInfo("10.0.0.1", 6881)
+B = ContactInfo("10.0.0.2", 6881)
+
+class TestTransactionManager(unittest.TestCase):
+  def setUp(self):
+    self.now = [0.0]
+    self.scheduler = Scheduler(lambda: self.now[0])
+    self.timed_out = []
+    self.manager = TransactionManager(self.scheduler, self.timed_out.append,
+                                      10, 4)
+  def test_finish(self):
+    tid = self.manager.begin(A)
+    self.assertEqual(len(tid), 4)
+    self.manager.add_callback(tid, "first")
+    self.manager.add_callback(tid, "second")
+    # Only the node the query went to can answer it, and only once.
+    self.assertEqual(self.manager.finish(tid, B), None)
+    self.assertEqual(self.manager.mismatched, 1)
+    self.assertEqual(self.manager.finish(tid, A), ["first", "second"])
+    self.assertEqual(self.manager.finish(tid, A), None)
+    self.assertEqual(len(self.manager), 0)
+    self.now[0] = 100
+    self.scheduler.run_due()
+    self.assertEqual(self.timed_out, [])
+  def test_unique(self):
+    self.manager._next = 0xFFFFFFFF
+    tids = [self.manager.begin(A) for i in range(3)]
+    self.assertEqual(tids[1], "\0\0\0\0")
+    self.assertEqual(len(set(tids)), 3)
+  def test_expire(self):
+    tid = self.manager.begin(A)
+    expired = []
+    self.manager.add_callback(tid, "callback", lambda: expired.append(tid))
+    self.now[0] = 5
+    self.manager.begin(B)
+    self.now[0] = 10
+    self.scheduler.run_due()
+    self.assertEqual(self.timed_out, [A])
+    self.assertEqual(expired, [tid])
+    self.assertEqual(self.manager.finish(tid, A), None)
+    self.assertEqual(len(self.manager), 1)
+    self.now[0] = 15
+    self.scheduler.run_due()
+    self.assertEqual(self.timed_out, [A, B])
+    self.assertEqual(self.manager.expired, 2)
+  def test_expire_error(self):
+    # A timeout callback that raises doesn't stop the others from running.
+    def fail():
+      raise KeyError("fail")
+    tid = self.manager.begin(A)
+    expired = []
+    self.manager.add_callback(tid, "first", fail)
+    self.manager.add_callback(tid, "second", lambda: expired.append(tid))
+    self.now[0] = 10
+    self.scheduler.run_due()
+    self.assertEqual(self.timed_out, [A])
+    self.assertEqual(expired, [tid])
+  def test_bounded(self):
+    # Queries to nodes that never answer are shed once the table is full,
+    # and neither the table nor the timer heap grows past it.
+    for second in range(1000):
+      self.now[0] = second
+      self.scheduler.run_due()
+      for i in range(2):
+        self.manager.begin(A)
+      self.assertTrue(len(self.manager) <= 4)
+      self.assertTrue(len(self.scheduler) <= 4)
+    self.assertTrue(self.manager.shed > 0)
+    self.assertEqual(self.manager.expired + len(self.manager) +
+                     self.manager.shed, 2000)
@@ -0,0 +1,61 @@
+# Copyright (c) 2011-2013 Allan Wirth <allan@allanwirth.com>
+#
+# This file is part of DHTPlay.
+#
+# DHTPlay is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the XOR distance trie."""
+import random
+import unittest
+
+from lib.util.xortrie import XorTrie
+
+class TestXorTrie(unittest.TestCase):
+  def setUp(self):
+    self.random = random.Random(42)
+    self.trie = XorTrie(16, 2)
+    self.keys = set(self.random.getrandbits(16) for i in range(500))
+    for key in self.keys:
+      self.trie.insert(key, str(key))
+  def brute(self, target, k):
+    return [str(key) for key in sorted(self.keys,
+                                       key=lambda key: key ^ target)[:k]]
+  def test_closest(self):
+    self.assertEqual(len(self.trie), len(self.keys))
+    for i in range(100):
+      target = self.random.getrandbits(16)
+      self.assertEqual(self.trie.closest(target, 8), self.brute(target, 8))
+    self.assertEqual(len(self.trie.closest(0, 1000)), len(self.keys))
+  def test_remove(self):
+    for key in list(self.keys)[:400]:
+      self.assertTrue(self.trie.remove(key))
+      self.assertFalse(key in self.trie)
+      self.keys.remove(key)
+    self.assertFalse(self.trie.remove(list(self.keys)[0] ^ 0x10000))
+    self.assertEqual(len(self.trie), len(self.keys))
+    self.assertEqual(sorted(self.trie.itervalues()),
+                     sorted(str(key) for key in self.keys))
+    for i in range(100):
+      target = self.random.getrandbits(16)
+      self.assertEqual(self.trie.closest(target, 8), self.brute(target, 8))
+  def test_replace(self):
+    key = iter(self.keys).next()
+    self.trie.insert(key, "new")
+    self.assertEqual(len(self.trie), len(self.keys))
+    self.assertEqual(self.trie.get(key), "new")
+  def test_empty(self):
+    self.assertEqual(XorTrie().closest(5, 8), [])
+
+if __name__ == "__main__":
+  unittest.main()